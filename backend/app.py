@@ -1,27 +1,99 @@
 # FastAPI entrypoint for Telegram Mini App "Лотерея"
 
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy import func
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import exists, func, insert, select, tuple_, union, update
+from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from collections import Counter
 from datetime import datetime
-import os, hashlib, hmac
+from typing import Literal
+import asyncio, os, hashlib, hmac, heapq
 from dotenv import load_dotenv
-from db import SessionLocal, init_db, Lottery, Ticket, User, Setting
+load_dotenv()  # before the local modules below read their settings from the environment
+from db import engine, SessionLocal, AsyncSessionLocal, async_write_lock, dispose_async_engine, init_db, version_listeners, checkout_observers, Lottery, Ticket, ArchivedUserTickets, User, Setting, DrawJob, bump_version, delete_lottery_rows, bump_version_async, get_data_version_async, get_lottery_version_async
+from events import broker
+from notifier import OutboxDispatcher, enqueue_notifications
+from draws import ACTIVE_STATES, DrawError, DrawWorker, enqueue_draw, set_job_state
+from outbound import get_outbound
+from cache import AsyncTTLCache, SettingsCache
+from rates import RateService
+from grid import to_bitmap, to_ranges
+from exports import ExportFormat, export_response
+from archive import ARCHIVE_AFTER_DAYS, ArchiveWorker, archived_tickets, iter_archived_rows
+from lifecycle import LifecycleScheduler
+from snapshots import SnapshotCache, dumps, is_current, snapshot_response
+from pagination import decode_cursor, encode_cursor, page_size, set_next_cursor, NEXT_CURSOR_HEADER
+import metrics
+from sqlalchemy import event
 from sqlalchemy.orm import Session
-from fastapi import Depends
-
-load_dotenv()
-
-from fastapi import Body
-
-app = FastAPI()
-
-# Ensure database schema is up-to-date (creates missing columns)
-init_db()
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+
+# ---- Startup / shutdown ----
+dispatcher: OutboxDispatcher | None = None
+draw_worker: DrawWorker | None = None
+archive_worker: ArchiveWorker | None = None
+lifecycle: LifecycleScheduler | None = None
+
+def _lifecycle_wake():
+    # a lottery was drawn, finished or deleted: open its replacement now
+    if lifecycle:
+        lifecycle.wake()
+
+def _draw_queued(lottery_id: int):
+    if draw_worker:
+        draw_worker.wake()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Schema check once per boot, then the shared HTTP clients and background workers."""
+    global dispatcher, draw_worker, archive_worker, lifecycle
+    # a single SELECT when the schema is current; see migrations.py
+    await run_in_threadpool(init_db)
+    lifecycle = LifecycleScheduler(SessionLocal, engine, on_opened=_publish_lottery,
+                                   on_deleted=_publish_deleted, on_draw_queued=_draw_queued)
+    # open lotteries before serving; later passes run in the background
+    await run_in_threadpool(lifecycle.run_once)
+    # open the async engine's first connection now rather than in the first request
+    async with AsyncSessionLocal() as db:
+        await get_data_version_async(db)
+    # Shared outbound HTTP clients (CoinGecko, tonapi, random.org, is.gd, Telegram)
+    outbound = get_outbound()
+    if metrics.observe_outbound not in outbound.observers:
+        outbound.observers.append(metrics.observe_outbound)
+    rate_service.start()
+    bot_token = os.getenv("BOT_TOKEN")
+    if bot_token:
+        dispatcher = OutboxDispatcher(SessionLocal, bot_token, get_outbound())
+        dispatcher.start()
+    draw_worker = DrawWorker(SessionLocal, _commit_winner)
+    draw_worker.start()
+    lifecycle.start()
+    if ARCHIVE_AFTER_DAYS > 0:
+        archive_worker = ArchiveWorker(SessionLocal)
+        archive_worker.start()
+    try:
+        yield
+    finally:
+        # workers first: they still use the outbound clients and the engines
+        if lifecycle:
+            await lifecycle.stop()
+        if archive_worker:
+            await archive_worker.stop()
+        if dispatcher:
+            await dispatcher.stop()
+        if draw_worker:
+            await draw_worker.stop()
+        await rate_service.stop()
+        await get_outbound().aclose()
+        await dispose_async_engine()
+
+app = FastAPI(lifespan=lifespan)
 
 # --- auto-fill timestamps ---------------------------------------------------
-from sqlalchemy import event
 @event.listens_for(Lottery, 'before_insert')
 def _lottery_before_insert(mapper, connection, target):
     if not target.created_at:
@@ -30,63 +102,33 @@ def _lottery_before_insert(mapper, connection, target):
 # Configure CORS (allow any origin, no credentials)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=["*"],  # можно ограничить до ["http://localhost:5173"]
     allow_methods=["*"],
     allow_headers=["*"],
     allow_credentials=False,
+    expose_headers=["ETag", NEXT_CURSOR_HEADER, metrics.QUERY_COUNT_HEADER, metrics.QUERY_TIME_HEADER],
 )
+# outermost, so CORS preflights and error responses are counted too
+app.add_middleware(metrics.MetricsMiddleware)
+checkout_observers.append(metrics.observe_checkout)
 
-# --- Startup hook to fill missing dates ---
-@app.on_event("startup")
-
-def _ensure_dates():
-    db = SessionLocal()
-    try:
-        # created_at null -> now
-        db.query(Lottery).filter(Lottery.created_at == None).update({Lottery.created_at: func.now()}, synchronize_session=False)
-        # finished_at for finished lotteries
-        db.query(Lottery).filter(Lottery.winner_id != None, Lottery.finished_at == None).update({Lottery.finished_at: func.now()}, synchronize_session=False)
-        db.commit()
-    finally:
-        db.close()
-
-# ---- Simple in-memory cache for TON/star rate ----
 ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "changeme")
+# /metrics is open unless this is set; Prometheus then passes it as ?token=
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
-_rate_cache = {
-    "value": None,
-    "ts": 0
-}
-RATE_CACHE_SECONDS = 300
-
-from fastapi.middleware.cors import CORSMiddleware
-
-
-@app.get("/users/{user_id}")
-def get_user(user_id: int, db: Session = Depends(lambda: SessionLocal())):
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        user = User(user_id=user_id)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    return {
-        "user_id": user.user_id,
-        "ton_wallet_address": user.ton_wallet_address,
-    }
+# ---- In-process caches: settings table and the TON/star rate ----
+settings_cache = SettingsCache(SessionLocal)
 
-from fastapi.middleware.cors import CORSMiddleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # можно ограничить до ["http://localhost:5173"]
-    allow_credentials=False,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def _get_star_usd():
+    value = settings_cache.get("STAR_USD_PRICE")
+    if value is not None:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+    return float(os.getenv("STAR_USD_PRICE", "0.0223"))
 
-@app.on_event("startup")
-def on_startup():
-    init_db()
+rate_service = RateService(_get_star_usd)
 
 class AuthData(BaseModel):
     id: int
@@ -102,6 +144,17 @@ async def ping():
     return {"message": "pong"}
 
 
+@app.get("/events")
+async def events_stream(request: Request, lottery_id: int | None = None):
+    """Server-Sent Events: lottery, tickets, draw, lottery_deleted and resync."""
+    sub = broker.subscribe(lottery_id)
+    return StreamingResponse(
+        broker.stream(sub, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -109,6 +162,27 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    # hot endpoints: queries are awaited on the event loop, no threadpool slot held
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# ---- Conditional GET ----
+def _etag_or_304(request: Request, response: Response, etag: str):
+    """Attach ETag; return a bare 304 if the client's If-None-Match is current."""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    if is_current(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+async def _global_etag_async(db: AsyncSession) -> str:
+    return f'W/"g{await get_data_version_async(db)}"'
+
+async def _lottery_etag_async(db: AsyncSession, lottery_id: int) -> str | None:
+    version = await get_lottery_version_async(db, lottery_id)
+    return None if version is None else f'W/"l{lottery_id}.{version}"'
+
 class LotteryOut(BaseModel):
     id: int
     name: str
@@ -128,73 +202,115 @@ class LotteryOut(BaseModel):
     class Config:
         orm_mode = True
 
+def _lottery_out(l: Lottery) -> dict:
+    return {
+        "id": l.id,
+        "name": l.name,
+        "ticket_price": l.ticket_price,
+        "max_tickets": l.max_tickets,
+        "tickets_sold": l.tickets_sold,
+        "participants": l.participants_count or 0,
+        "winner_id": l.winner_id,
+        "winner_username": l.winner_username,
+        "winner_first_name": l.winner_first_name,
+        "winner_last_name": l.winner_last_name,
+        "winner_ticket_number": l.winner_ticket_number,
+        "random_link": l.random_link,
+        "code": l.code,
+        "created_at": l.created_at.isoformat() if l.created_at else None,
+        "finished_at": l.finished_at.isoformat() if l.finished_at else None
+    }
+
+# encoded bodies of /lotteries, /lotteries/{id}/result and /lotteries/{id}/grid;
+# every committed bump_version drops the snapshots it affects
+snapshots = SnapshotCache(maxsize=int(os.getenv("SNAPSHOT_CACHE_SIZE", "1024")))
+version_listeners.append(snapshots.invalidate)
+
+def _publish_lottery(l: Lottery):
+    broker.publish("lottery", _lottery_out(l), lottery_id=l.id)
+
+def _publish_draw(l: Lottery):
+    broker.publish("draw", {
+        "lottery_id": l.id,
+        "winner_id": l.winner_id,
+        "winner_username": l.winner_username,
+        "winner_first_name": l.winner_first_name,
+        "winner_last_name": l.winner_last_name,
+        "winner_ticket_number": l.winner_ticket_number,
+        "random_link": l.random_link,
+    }, lottery_id=l.id)
+
+def _publish_deleted(lottery_id: int):
+    broker.publish("lottery_deleted", {"lottery_id": lottery_id}, lottery_id=lottery_id)
+
+LotteryStatus = Literal["active", "finished"]
+GridFormat = Literal["ranges", "bitmap"]
+
+async def _active_lotteries(db: AsyncSession, after_id: int | None = None, limit: int | None = None) -> list[Lottery]:
+    q = select(Lottery).where(Lottery.winner_id == None)
+    if after_id is not None:
+        q = q.where(Lottery.id > after_id)
+    return (await db.execute(q.order_by(Lottery.id).limit(limit))).scalars().all()
+
+async def _finished_lotteries(db: AsyncSession, before: tuple | None = None, limit: int | None = None) -> list[Lottery]:
+    # newest first, keyset on (finished_at, id)
+    q = select(Lottery).where(Lottery.winner_id != None)
+    if before is not None:
+        q = q.where(tuple_(Lottery.finished_at, Lottery.id) < tuple_(*before))
+    return (await db.execute(q.order_by(Lottery.finished_at.desc(), Lottery.id.desc()).limit(limit))).scalars().all()
+
 @app.get("/lotteries", response_model=list[LotteryOut])
-def get_lotteries(db: Session = Depends(get_db)):
-    lts = db.query(Lottery).all()
-    # Если нет ни одной лотереи, создать дефолтную
-    # Создать дефолтную лотерею, если её совсем нет или все предыдущие уже завершены
-    active_exists = any(l.winner_id is None for l in lts)
-    import re, uuid
-    def _gen_code():
-        return uuid.uuid4().hex[:8].upper()
-
-        # determine next sequential number for auto lottery naming
-    next_num = 1
-    pattern = re.compile(r"Лотерея #(?P<num>\d+)")
-    for lt in lts:
-        m = pattern.match(lt.name)
-        if m:
-            try:
-                n=int(m.group('num'))
-                if n>=next_num:
-                    next_num=n+1
-            except:
-                pass
-
-    if not lts or not active_exists:
-        obj = Lottery(
-            name=f"Лотерея #{next_num}",
-            ticket_price=1,
-            max_tickets=100,
-            tickets_sold=0,
-            created_at=datetime.utcnow()
-        )
-        db.add(obj)
-        db.commit()
-        db.refresh(obj)
-        if not lts:
-            lts = [obj]
-        else:
-            lts.append(obj)
-    # separate finished and active
-    finished = [l for l in lts if l.winner_id]
-    active = [l for l in lts if not l.winner_id]
-    finished.sort(key=lambda x: x.finished_at or datetime.min, reverse=True)
-    ordered = active + finished
-
-    result = []
-    for l in ordered:
-        winner_ticket = None
-        if l.winner_id:
-            winner_ticket = db.query(Ticket).filter_by(lottery_id=l.id, user_id=l.winner_id, ticket_number=l.winner_ticket_number).first()
-        result.append({
-            "id": l.id,
-            "name": l.name,
-            "ticket_price": l.ticket_price,
-            "max_tickets": l.max_tickets,
-            "tickets_sold": l.tickets_sold,
-            "participants": db.query(func.count(func.distinct(Ticket.user_id))).filter(Ticket.lottery_id==l.id).scalar(),
-            "winner_id": l.winner_id,
-            "winner_username": winner_ticket.username if winner_ticket else None,
-            "winner_first_name": winner_ticket.first_name if winner_ticket else None,
-            "winner_last_name": winner_ticket.last_name if winner_ticket else None,
-            "winner_ticket_number": l.winner_ticket_number,
-            "random_link": l.random_link,
-            "code": l.code,
-            "created_at": l.created_at.isoformat() if l.created_at else None,
-            "finished_at": l.finished_at.isoformat() if l.finished_at else None
-        })
-    return result
+async def get_lotteries(request: Request, response: Response, status: LotteryStatus | None = None,
+                        limit: int | None = Query(None, ge=1), cursor: str | None = None,
+                        db: AsyncSession = Depends(get_async_db)):
+    """Active lotteries first, then finished ones newest first.
+
+    ``status=active`` is the cheap call for the main screen. Passing ``limit``
+    or ``cursor`` switches to keyset pages; see pagination.py.
+    """
+    if limit is None and cursor is None:
+        async def build(version):
+            # participants and winner names are denormalized on the lottery row
+            lts = []
+            if status != "finished":
+                lts += await _active_lotteries(db)
+            if status != "active":
+                lts += await _finished_lotteries(db)
+            return f'W/"g{version}"', [_lottery_out(l) for l in lts]
+        snapshot = await snapshots.get(("lotteries", status), None, lambda: get_data_version_async(db), build)
+        return snapshot_response(request, snapshot)
+
+    not_modified = _etag_or_304(request, response, await _global_etag_async(db))
+    if not_modified:
+        return not_modified
+
+    size = page_size(limit)
+    # the cursor remembers which part ("a"ctive / "f"inished) the last page ended in
+    key = decode_cursor(cursor, "s") if cursor else {"s": "f" if status == "finished" else "a"}
+    lts, next_key = [], None
+    if key["s"] == "a":
+        lts = await _active_lotteries(db, key.get("id"), size + 1)
+        if len(lts) > size:
+            lts = lts[:size]
+            next_key = {"s": "a", "id": lts[-1].id}
+        elif status is None:
+            key = {"s": "f"}
+            if len(lts) == size:
+                next_key = key  # page filled exactly; finished ones start on the next
+    if key["s"] == "f" and next_key is None and len(lts) < size:
+        need = size - len(lts)
+        try:
+            before = (datetime.fromisoformat(key["t"]), int(key["id"])) if "t" in key else None
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(400, detail="Invalid cursor")
+        finished = await _finished_lotteries(db, before, need + 1)
+        if len(finished) > need:
+            finished = finished[:need]
+            last = finished[-1]
+            next_key = {"s": "f", "t": last.finished_at.isoformat(), "id": last.id}
+        lts += finished
+    set_next_cursor(response, next_key and encode_cursor(**next_key))
+    return [_lottery_out(l) for l in lts]
 
 class LotteryCreate(BaseModel):
     name: str
@@ -210,8 +326,11 @@ def add_lottery(lottery: LotteryCreate, db: Session = Depends(get_db)):
         tickets_sold=0
     )
     db.add(obj)
+    db.flush()
+    bump_version(db, obj.id)
     db.commit()
     db.refresh(obj)
+    _publish_lottery(obj)
     return {"ok": True, "id": obj.id}
 
 class BuyTicketRequest(BaseModel):
@@ -227,20 +346,11 @@ class WalletUpdateRequest(BaseModel):
 
 # -------------------- Utility endpoints --------------------
 
-def _get_star_usd(db: Session):
-    rec = db.query(Setting).filter_by(key="STAR_USD_PRICE").first()
-    if rec:
-        try:
-            return float(rec.value)
-        except ValueError:
-            pass
-    return float(os.getenv("STAR_USD_PRICE", "0.0223"))
-
 @app.get("/admin/star_price")
 def admin_get_star_price(token: str, db: Session = Depends(get_db)):
     if token != ADMIN_TOKEN:
         raise HTTPException(status_code=401, detail="unauthorized")
-    return {"star_usd_price": _get_star_usd(db)}
+    return {"star_usd_price": _get_star_usd()}
 
 class StarPriceUpdate(BaseModel):
     price: float
@@ -256,58 +366,84 @@ def admin_set_star_price(token: str, data: StarPriceUpdate, db: Session = Depend
     else:
         rec.value = str(data.price)
     db.commit()
-    # clear cache
-    _rate_cache.update({"value": None, "ts": 0})
+    # the rate is derived on read, so dropping the cached setting is enough
+    settings_cache.invalidate("STAR_USD_PRICE")
     return {"ok": True, "star_usd_price": data.price}
 
 
 @app.get("/rates/ton_star")
-def get_ton_star_rate(db: Session = Depends(get_db)):
-    """Return current conversion: how many ⭐ in 1 TON."""
-    import time, requests
-    now = time.time()
-    if _rate_cache["value"] and now - _rate_cache["ts"] < RATE_CACHE_SECONDS:
-        return {"ton_to_star": _rate_cache["value"], "cached": True}
-    try:
-        # Fallback constant if API fails
-        ton_to_star = 25.0
-        resp = requests.get("https://api.coingecko.com/api/v3/simple/price", params={"ids":"the-open-network","vs_currencies":"usd"}, timeout=5)
-        data = resp.json()
-        ton_usd = data.get("the-open-network", {}).get("usd")
-        # Suppose 1 STAR = 0.04 USD (=> 1 TON ≈ 25⭐ when TON≈1 USD)
-        star_usd = _get_star_usd(db)
-        if ton_usd:
-            ton_to_star = round(ton_usd / star_usd, 2)
-    except Exception as ex:
-        print("Rate fetch error:", ex)
-        ton_to_star = 25.0
-    _rate_cache.update({"value": ton_to_star, "ts": now})
-    return {"ton_to_star": ton_to_star, "cached": False}
+def get_ton_star_rate():
+    """Return current conversion: how many ⭐ in 1 TON (refreshed in the background)."""
+    return rate_service.current()
+
+
+@app.get("/admin/outbound")
+def admin_outbound_stats(token: str):
+    """Per-upstream latency/error counters and circuit breaker state."""
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="unauthorized")
+    return {**get_outbound().snapshot(), "wallet_cache": {"size": len(wallet_cache), **wallet_cache.stats}}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(token: str | None = None):
+    """Prometheus text format; see metrics.py for what is recorded."""
+    if METRICS_TOKEN and token != METRICS_TOKEN:
+        raise HTTPException(status_code=401, detail="unauthorized")
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 # ---- Wallet balance endpoint ----
+# one tonapi.io call per address per TTL, shared by concurrent requests
+wallet_cache = AsyncTTLCache(
+    maxsize=int(os.getenv("WALLET_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("WALLET_CACHE_TTL", "30")),
+    stale_ttl=float(os.getenv("WALLET_CACHE_STALE_TTL", "600")),
+)
+
+async def _fetch_wallet_balance(address: str) -> float:
+    resp = await get_outbound().request("tonapi", "GET", f"/accounts/{address}")
+    if resp.status_code != 200:
+        raise RuntimeError(f"tonapi {resp.status_code}: {resp.text[:200]}")
+    balance_nano = int(resp.json().get("balance", 0))
+    return round(balance_nano / 1e9, 3)
+
 @app.get("/wallet_balance/{address}")
-def get_wallet_balance(address: str):
-    """Return wallet balance in TON (approx). Uses tonapi.io."""
-    import requests, math
+async def get_wallet_balance(address: str):
+    """Return wallet balance in TON (approx). Uses tonapi.io.
+
+    ``stale`` is true when tonapi.io failed and the last known balance is returned.
+    """
+    address = address.strip()
     try:
-        resp = requests.get(f"https://tonapi.io/v2/accounts/{address}")
-        data = resp.json()
-        balance_nano = int(data.get("balance", 0))
-        balance_ton = round(balance_nano / 1e9, 3)
-        return {"address": address, "balance_ton": balance_ton}
+        balance_ton, stale = await wallet_cache.get(address, lambda: _fetch_wallet_balance(address))
+        return {"address": address, "balance_ton": balance_ton, "stale": stale}
     except Exception as ex:
         print("wallet balance error", ex)
-        return {"address": address, "balance_ton": None}
+        return {"address": address, "balance_ton": None, "stale": False}
 
 
 @app.get("/users/{user_id}/stats")
-def user_stats(user_id: int, db: Session = Depends(get_db)):
+async def user_stats(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """Return wins, tickets bought, active lotteries count for user."""
-    wins = db.query(func.count(Lottery.id)).filter(Lottery.winner_id == user_id).scalar() or 0
-    tickets = db.query(func.count(Ticket.id)).filter(Ticket.user_id == user_id).scalar() or 0
-    active = db.query(func.count(Lottery.id)).join(Ticket, Ticket.lottery_id == Lottery.id).filter(Ticket.user_id == user_id, Lottery.winner_id == None).scalar() or 0
-    return {"wins": wins, "tickets": tickets, "active_lotteries": active}
+    return await _user_stats(db, user_id)
+
+async def _user_stats(db: AsyncSession, user_id: int) -> dict:
+    # four counts, one round trip; archived lotteries count from archived_user_tickets
+    wins = select(func.count(Lottery.id)).where(Lottery.winner_id == user_id).scalar_subquery()
+    tickets = select(func.count(Ticket.id)).where(Ticket.user_id == user_id).scalar_subquery()
+    archived = select(func.sum(ArchivedUserTickets.tickets)).where(ArchivedUserTickets.user_id == user_id).scalar_subquery()
+    # distinct open lotteries the user holds tickets in, live or archived
+    entered = union(
+        select(Ticket.lottery_id).where(Ticket.user_id == user_id),
+        select(ArchivedUserTickets.lottery_id).where(ArchivedUserTickets.user_id == user_id),
+    )
+    active = (
+        select(func.count(Lottery.id))
+        .where(Lottery.winner_id == None, Lottery.id.in_(entered)).scalar_subquery()
+    )
+    wins, tickets, archived, active = (await db.execute(select(wins, tickets, archived, active))).one()
+    return {"wins": wins or 0, "tickets": (tickets or 0) + (archived or 0), "active_lotteries": active or 0}
 
 @app.get("/users/{user_id}/balance")
 def user_balance(user_id: int, db: Session = Depends(get_db)):
@@ -334,191 +470,221 @@ def finish_lottery(lottery_id: int, data: FinishLotteryReq, db: Session = Depend
         raise HTTPException(404, detail="Lottery not found")
     if lot.winner_id:
         raise HTTPException(400, detail="Already finished")
+    winner_ticket = db.query(Ticket).filter_by(lottery_id=lottery_id, user_id=data.winner_id, ticket_number=data.winner_ticket_number).first()
     lot.winner_id = data.winner_id
     lot.winner_ticket_number = data.winner_ticket_number
+    lot.winner_username = winner_ticket.username if winner_ticket else None
+    lot.winner_first_name = winner_ticket.first_name if winner_ticket else None
+    lot.winner_last_name = winner_ticket.last_name if winner_ticket else None
     lot.finished_at = datetime.utcnow()
+    bump_version(db, lottery_id)
     db.commit()
+    _publish_lottery(lot)
+    _publish_draw(lot)
+    _lifecycle_wake()
     return {"ok": True}
 
 # -------------------- Existing endpoints --------------------
 
+def _tickets_taken(taken: list[int]):
+    """409 listing exactly which of the requested numbers are already sold."""
+    taken = sorted(set(taken))
+    return JSONResponse(status_code=409, content={
+        "detail": "Tickets already sold: " + ", ".join(map(str, taken)),
+        "taken": taken,
+    })
+
 @app.post("/lotteries/{lottery_id}/buy")
-def buy_ticket(lottery_id: int, req: BuyTicketRequest, db: Session = Depends(get_db)):
-    lottery = db.query(Lottery).filter(Lottery.id == lottery_id).first()
+async def buy_ticket(lottery_id: int, req: BuyTicketRequest, db: AsyncSession = Depends(get_async_db)):
+    lottery = await db.get(Lottery, lottery_id)
     if not lottery:
         raise HTTPException(404, detail="Lottery not found")
-    # Ensure user exists (create lazily)
-    user = db.query(User).filter(User.user_id == req.user_id).first()
-    if not user:
-        user = User(
-            user_id=req.user_id,
-            username=req.username,
-            first_name=req.first_name,
-            last_name=req.last_name
-        )
-        db.add(user)
-        db.commit()
-    
-    if not req.ticket_numbers or not isinstance(req.ticket_numbers, list):
+
+    numbers = req.ticket_numbers
+    if not numbers or not isinstance(numbers, list):
         raise HTTPException(400, detail="No tickets selected")
-    if len(req.ticket_numbers) + lottery.tickets_sold > lottery.max_tickets:
+    # bound the list before looking at it: a lottery never has more numbers than max_tickets
+    if len(numbers) > lottery.max_tickets:
+        raise HTTPException(400, detail=f"At most {lottery.max_tickets} tickets can be bought in this lottery")
+    duplicates = sorted(n for n, k in Counter(numbers).items() if k > 1)
+    if duplicates:
+        raise HTTPException(400, detail="Duplicate ticket numbers: " + ", ".join(map(str, duplicates)))
+    out_of_range = sorted(n for n in numbers if n < 1 or n > lottery.max_tickets)
+    if out_of_range:
+        raise HTTPException(400, detail=f"Ticket numbers must be within 1..{lottery.max_tickets}: " + ", ".join(map(str, out_of_range)))
+    if lottery.winner_id is not None:
+        raise HTTPException(400, detail="Lottery already finished")
+    if len(numbers) + lottery.tickets_sold > lottery.max_tickets:
         raise HTTPException(400, detail="Not enough tickets left")
 
-    # Создать или обновить пользователя
-    user = db.query(User).filter(User.user_id == req.user_id).first()
-    if not user:
-        user = User(user_id=req.user_id, username=req.username, first_name=req.first_name, last_name=req.last_name)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    else:
-        # Обновить данные пользователя при необходимости
-        updated = False
-        if req.username and user.username != req.username:
-            user.username = req.username
-            updated = True
-        if req.first_name and user.first_name != req.first_name:
-            user.first_name = req.first_name
-            updated = True
-        if req.last_name and user.last_name != req.last_name:
-            user.last_name = req.last_name
-            updated = True
-        if updated:
-            db.commit()
-
-    # Проверка, что каждый выбранный номер свободен
-    for num in req.ticket_numbers:
-        exists = db.query(Ticket).filter_by(lottery_id=lottery_id, ticket_number=num).first()
-        if exists:
-            raise HTTPException(400, detail=f"Ticket {num} already sold")
-        t = Ticket(
-            lottery_id=lottery_id,
-            user_id=req.user_id,
-            username=req.username,
-            first_name=req.first_name,
-            last_name=req.last_name,
-            ticket_number=num
-        )
-        db.add(t)
-        lottery.tickets_sold += 1
-    db.commit()
-
-    # check completion
-    if lottery.tickets_sold >= lottery.max_tickets and lottery.winner_id is None:
-        choose_winner(lottery_id, db)
-        db.commit()
-
-    return {"ok": True, "tickets": req.ticket_numbers}
-
-
-
-import requests, json, uuid
-
-RANDOM_API_KEY=os.getenv("RANDOM_API_KEY")
+    async with async_write_lock:
+        # Reserve capacity with one conditional UPDATE: it cannot oversell, and it
+        # takes the row/database write lock before anything else in this transaction.
+        # Sales close once a draw is queued: the draw picks among the tickets sold by then.
+        draw_queued = exists().where(DrawJob.lottery_id == Lottery.id, DrawJob.state.in_(ACTIVE_STATES))
+        reserved = (await db.execute(
+            update(Lottery)
+            .where(Lottery.id == lottery_id, Lottery.winner_id == None, ~draw_queued,
+                   Lottery.tickets_sold + len(numbers) <= Lottery.max_tickets)
+            .values(tickets_sold=Lottery.tickets_sold + len(numbers),
+                    revenue=func.coalesce(Lottery.revenue, 0) + len(numbers) * Lottery.ticket_price)
+            .execution_options(synchronize_session=False)
+        )).rowcount
+        if not reserved:
+            closed = (await db.execute(select(exists().where(
+                DrawJob.lottery_id == lottery_id, DrawJob.state.in_(ACTIVE_STATES))))).scalar()
+            await db.rollback()
+            raise HTTPException(400, detail="Draw in progress, sales are closed" if closed else "Not enough tickets left")
+
+        # Создать или обновить пользователя (под блокировкой, в той же транзакции)
+        user = await db.get(User, req.user_id)
+        if not user:
+            db.add(User(user_id=req.user_id, username=req.username, first_name=req.first_name, last_name=req.last_name))
+        else:
+            if req.username and user.username != req.username:
+                user.username = req.username
+            if req.first_name and user.first_name != req.first_name:
+                user.first_name = req.first_name
+            if req.last_name and user.last_name != req.last_name:
+                user.last_name = req.last_name
+
+        await db.flush()  # user row before its tickets
+
+        # Проверка, что выбранные номера свободны — одним запросом
+        taken_q = select(Ticket.ticket_number).where(Ticket.lottery_id == lottery_id, Ticket.ticket_number.in_(numbers))
+        taken = (await db.execute(taken_q)).scalars().all()
+        if taken:
+            await db.rollback()
+            return _tickets_taken(taken)
+
+        # summary counters are updated in the same transaction as the tickets
+        is_new_participant = (await db.execute(
+            select(Ticket.id).where(Ticket.lottery_id == lottery_id, Ticket.user_id == req.user_id).limit(1)
+        )).first() is None
+
+        await db.execute(insert(Ticket), [{
+            "lottery_id": lottery_id,
+            "user_id": req.user_id,
+            "username": req.username,
+            "first_name": req.first_name,
+            "last_name": req.last_name,
+            "ticket_number": num,
+        } for num in numbers])
+        if is_new_participant:
+            await db.execute(
+                update(Lottery)
+                .where(Lottery.id == lottery_id)
+                .values(participants_count=func.coalesce(Lottery.participants_count, 0) + 1)
+                .execution_options(synchronize_session=False)
+            )
+        await bump_version_async(db, lottery_id)
+        # Only the purchase that moves tickets_sold onto max_tickets sees it equal here
+        sold, max_tickets = (await db.execute(
+            select(Lottery.tickets_sold, Lottery.max_tickets).where(Lottery.id == lottery_id)
+        )).one()
+        became_full = sold == max_tickets
+        if became_full:
+            # the draw runs in the background; this purchase only queues it
+            await db.run_sync(enqueue_draw, lottery_id)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # a concurrent buyer got some of the numbers between our check and insert
+            await db.rollback()
+            taken = (await db.execute(taken_q)).scalars().all()
+            if taken:
+                return _tickets_taken(taken)
+            raise HTTPException(409, detail="Purchase conflicted with another request, please retry")
+    broker.publish("tickets", {"lottery_id": lottery_id, "user_id": req.user_id, "ticket_numbers": numbers}, lottery_id=lottery_id)
+    # the counters were changed by UPDATE statements, reload before publishing
+    await db.refresh(lottery)
+    _publish_lottery(lottery)
+
+    if became_full and draw_worker:
+        draw_worker.wake()
+
+    return {"ok": True, "tickets": numbers, "draw_pending": became_full}
+
+
+
+def _draw_notifications(lottery_id: int, lottery_name: str, winner_ticket: Ticket, random_number: int, random_link: str | None, db: Session) -> list[dict]:
+    """Telegram messages for ALL users who bought at least one ticket in this lottery."""
+    if not os.getenv("BOT_TOKEN"):
+        return []
+    ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
+    messages = []
+    # Notify admin if configured
+    if ADMIN_CHAT_ID and int(ADMIN_CHAT_ID) != winner_ticket.user_id:
+        admin_msg = (f"Лотерея '{lottery_name}' завершена. Победитель: "
+                     f"{winner_ticket.username or winner_ticket.first_name or winner_ticket.user_id} "
+                     f"(ID {winner_ticket.user_id}) с билетом №{random_number}." +
+                     (f"\nСсылка на проверку: {random_link}" if random_link else ""))
+        messages.append({"dedup_key": f"draw:{lottery_id}:admin", "lottery_id": lottery_id, "chat_id": ADMIN_CHAT_ID, "text": admin_msg})
+
+    # Получаем всех уникальных пользователей
+    user_ids = [uid for (uid,) in db.query(Ticket.user_id).filter(Ticket.lottery_id == lottery_id).distinct()]
+    winner_name = winner_ticket.username or winner_ticket.first_name or str(winner_ticket.user_id)
+    verify_html = f'<a href="{random_link}">Проверка random.org</a>'
+    for user_id in user_ids:
+        if user_id == winner_ticket.user_id:
+            msg = f"🎉 Поздравляем! Вы выиграли лотерею '{lottery_name}' с билетом №{random_number}.\n{verify_html}"
+        else:
+            msg = f"Лотерея '{lottery_name}' завершена! Победитель: {winner_name}, билет №{random_number}.\n{verify_html}"
+        messages.append({"dedup_key": f"draw:{lottery_id}:{user_id}", "lottery_id": lottery_id, "chat_id": user_id, "text": msg})
+    return messages
 
-def choose_winner(lottery_id: int, db: Session, force: bool=False):
+def _commit_winner(db: Session, job: dict):
+    """Draw step 'randomness_acquired' -> 'winner_committed' (called by DrawWorker)."""
+    lottery_id = job["lottery_id"]
     lottery = db.query(Lottery).filter(Lottery.id==lottery_id).first()
     if not lottery:
-        raise HTTPException(404, detail="Lottery not found")
+        raise DrawError("Lottery not found")
     # Запретить любой повторный розыгрыш, даже с force
     if lottery.winner_id is not None:
-        raise HTTPException(400, detail="Winner already chosen")
-    if not force and lottery.tickets_sold < lottery.max_tickets:
-        raise HTTPException(400, detail="Not enough tickets sold")
-
-    # Try random.org; if it fails or key not set, fallback to Python random()
-    req_id = str(uuid.uuid4())
-    random_number = None
-    verify_url = None
-    use_random_org = bool(RANDOM_API_KEY)
-    try:
-        if not use_random_org:
-            raise Exception("RANDOM_API_KEY not set")
-        payload = {
-            "jsonrpc":"2.0",
-            "method":"generateSignedIntegers",
-            "params":{
-                "apiKey": RANDOM_API_KEY,
-                "n":1,
-                "min":1,
-                "max": lottery.tickets_sold,
-                "replacement":False
-            },
-            "id": req_id
-        }
-        resp = requests.post("https://api.random.org/json-rpc/4/invoke", json=payload, timeout=10)
-        data=resp.json()
-        if "result" not in data or "random" not in data["result"]:
-            raise Exception(f"random.org API error: {data}")
-        random_obj=data["result"]["random"]
-        random_number=random_obj["data"][0]
-        # build verification link (https://api.random.org/verify?random=...&signature=...)
-        import urllib.parse, json as _json
-        random_json=_json.dumps(random_obj,separators=(',',':'))
-        signature = data["result"]["signature"]
-        verify_url="https://api.random.org/sign?random="+urllib.parse.quote(random_json)+"&signature="+urllib.parse.quote(signature)+"&format=html"
-        print("DEBUG random_json:", random_json)
-        print("DEBUG signature:", signature)
-        print("DEBUG verify_url:", verify_url)
-        # Генерация короткой ссылки через is.gd
-        short_url = verify_url
-        try:
-            resp_short = requests.get(f'https://is.gd/create.php?format=simple&url={urllib.parse.quote(verify_url)}', timeout=5)
-            if resp_short.status_code == 200 and resp_short.text.startswith('http'):
-                short_url = resp_short.text.strip()
-                print('DEBUG short_url:', short_url)
-        except Exception as ex:
-            print('Shortlink error:', ex)
-        verify_url = short_url
-    except Exception as e:
-        # Fallback to python's random if random.org unavailable
-        import random as _rnd
-        random_number = _rnd.randint(1, lottery.tickets_sold)
-        verify_url = None
-        print("Fallback random():", random_number, "reason:", e)
-
-    winner_ticket=db.query(Ticket).filter_by(lottery_id=lottery_id, ticket_number=random_number).first()
+        raise DrawError("Winner already chosen")
+
+    # random_number is a position among the sold tickets (1..tickets_sold);
+    # for a full lottery that is the ticket number itself
+    random_number = job["random_number"]
+    verify_url = job["random_link"]
+    winner_ticket = (
+        db.query(Ticket)
+        .filter(Ticket.lottery_id == lottery_id)
+        .order_by(Ticket.ticket_number)
+        .offset(random_number - 1)
+        .first()
+    )
     if not winner_ticket:
-        raise HTTPException(500, detail="Winner ticket not found")
-
-    lottery.winner_id=winner_ticket.user_id
-    lottery.winner_ticket_number=random_number
-    lottery.finished_at = datetime.utcnow()
-    lottery.random_link = verify_url
-    db.add(lottery)
+        raise DrawError("Winner ticket not found")
+
+    # Conditional update: only one draw can ever set the winner
+    won = db.execute(
+        update(Lottery)
+        .where(Lottery.id == lottery_id, Lottery.winner_id == None)
+        .values(
+            winner_id=winner_ticket.user_id,
+            winner_ticket_number=winner_ticket.ticket_number,
+            winner_username=winner_ticket.username,
+            winner_first_name=winner_ticket.first_name,
+            winner_last_name=winner_ticket.last_name,
+            finished_at=datetime.utcnow(),
+            random_link=verify_url,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not won:
+        db.rollback()
+        raise DrawError("Winner already chosen")
+    # Notifications are queued in the draw's transaction and sent in the background
+    enqueue_notifications(db, _draw_notifications(lottery_id, lottery.name, winner_ticket, winner_ticket.ticket_number, verify_url, db))
+    bump_version(db, lottery_id)
+    set_job_state(db, job, "winner_committed", winner_id=winner_ticket.user_id, winner_ticket_number=winner_ticket.ticket_number)
     db.commit()
-
-    # Telegram notifications to ALL users who bought at least one ticket in this lottery
-    BOT_TOKEN = os.getenv("BOT_TOKEN")
-    ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
-    if BOT_TOKEN:
-        def tg_send(chat, text):
-            try:
-                requests.post(f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage", json={"chat_id": chat, "text": text, "parse_mode": "HTML"})
-            except Exception as ex:
-                print(f"Telegram send error: {ex}")
-        # Получаем всех уникальных пользователей
-        users = db.query(Ticket.user_id, Ticket.username, Ticket.first_name, Ticket.last_name).filter(Ticket.lottery_id==lottery_id).distinct().all()
-        # Notify admin if configured
-        if ADMIN_CHAT_ID and int(ADMIN_CHAT_ID) != winner_ticket.user_id:
-            try:
-                admin_msg = (f"Лотерея '{lottery.name}' завершена. Победитель: "
-                             f"{winner_ticket.username or winner_ticket.first_name or winner_ticket.user_id} "
-                             f"(ID {winner_ticket.user_id}) с билетом №{random_number}." +
-                             (f"\nСсылка на проверку: {lottery.random_link}" if lottery.random_link else ""))
-                tg_send(ADMIN_CHAT_ID, admin_msg)
-            except Exception as ex:
-                print('Admin notify error:', ex)
-
-        for u in users:
-            winner_name = winner_ticket.username or winner_ticket.first_name or str(winner_ticket.user_id)
-            verify_html = f'<a href="{lottery.random_link}">Проверка random.org</a>'
-            if u.user_id == winner_ticket.user_id:
-                msg = f"🎉 Поздравляем! Вы выиграли лотерею '{lottery.name}' с билетом №{random_number}.\n{verify_html}"
-            else:
-                msg = f"Лотерея '{lottery.name}' завершена! Победитель: {winner_name}, билет №{random_number}.\n{verify_html}"
-            tg_send(u.user_id, msg)
-    return winner_ticket.user_id, random_number
+    if dispatcher:
+        dispatcher.wake()
+    _publish_lottery(lottery)
+    _publish_draw(lottery)
+    _lifecycle_wake()
 
 class LotteryResult(BaseModel):
     lottery_id: int
@@ -542,7 +708,9 @@ def update_lottery(lottery_id: int, payload: LotteryCreate, db: Session = Depend
     lottery.name = payload.name
     lottery.ticket_price = payload.ticket_price
     lottery.max_tickets = payload.max_tickets
+    bump_version(db, lottery_id)
     db.commit()
+    _publish_lottery(lottery)
     return {"ok": True}
 
 @app.delete("/lotteries/{lottery_id}")
@@ -550,9 +718,13 @@ def delete_lottery(lottery_id: int, db: Session = Depends(get_db)):
     lot = db.query(Lottery).filter(Lottery.id == lottery_id).first()
     if not lot:
         raise HTTPException(404, detail="Lottery not found")
-    db.query(Ticket).filter(Ticket.lottery_id == lottery_id).delete()
+    delete_lottery_rows(db, lottery_id)
     db.delete(lot)
+    # with the lottery's id, so its grid / result snapshots go too
+    bump_version(db, lottery_id)
     db.commit()
+    _publish_deleted(lottery_id)
+    _lifecycle_wake()
     return {"ok": True}
 
 class TicketOut(BaseModel):
@@ -563,29 +735,264 @@ class TicketOut(BaseModel):
     class Config:
         orm_mode = True
 
+def _ticket_key(ticket) -> tuple:
+    return ticket.lottery_id, ticket.ticket_number
+
+async def _ticket_page(db: AsyncSession, response: Response, q, limit: int | None, cursor: str | None,
+                       lottery_id: int | None = None, user_id: int | None = None,
+                       include_archived: bool = False) -> list[Ticket]:
+    """One keyset page of ``q`` ordered by (lottery_id, ticket_number), archived tickets merged in."""
+    size = page_size(limit)
+    after = None
+    if cursor:
+        key = decode_cursor(cursor, "l", "n")
+        after = (key["l"], key["n"])
+        if lottery_id is not None:
+            # pinned to one lottery: a plain range on the unique (lottery_id, ticket_number) index
+            q = q.where(Ticket.ticket_number > key["n"])
+        else:
+            q = q.where(tuple_(Ticket.lottery_id, Ticket.ticket_number) > tuple_(key["l"], key["n"]))
+    rows = (await db.execute(q.order_by(Ticket.lottery_id, Ticket.ticket_number).limit(size + 1))).scalars().all()
+    # a lottery's tickets are either all live or all archived
+    if _wants_archived(lottery_id, include_archived, rows):
+        archived = await archived_tickets(db, lottery_id, user_id, after, size + 1)
+        if archived:
+            rows = list(heapq.merge(rows, archived, key=_ticket_key))[:size + 1]
+    if len(rows) > size:
+        rows = rows[:size]
+        set_next_cursor(response, encode_cursor(l=rows[-1].lottery_id, n=rows[-1].ticket_number))
+    return rows
+
+def _wants_archived(lottery_id: int | None, include_archived: bool, live_rows) -> bool:
+    # one lottery: its blob when it has no live tickets; across lotteries every
+    # archive would be decoded, so only on request
+    if lottery_id is not None:
+        return not live_rows
+    return include_archived
+
 @app.get("/tickets", response_model=list[TicketOut])
-def list_tickets(lottery_id: int | None = None, user_id: int | None = None, db: Session = Depends(get_db)):
-    q = db.query(Ticket)
+async def list_tickets(request: Request, response: Response, lottery_id: int | None = None, user_id: int | None = None,
+                       include_archived: bool = False, limit: int | None = Query(None, ge=1), cursor: str | None = None,
+                       db: AsyncSession = Depends(get_async_db)):
+    """Tickets filtered by lottery and/or user; pages with ``limit``/``cursor``.
+
+    Without ``lottery_id``, archived lotteries are left out unless
+    ``include_archived=true``; GET /bootstrap lists them as per-lottery counts.
+    """
+    not_modified = _etag_or_304(request, response, await _global_etag_async(db))
+    if not_modified:
+        return not_modified
+    q = select(Ticket)
     if lottery_id is not None:
-        q = q.filter(Ticket.lottery_id == lottery_id)
+        q = q.where(Ticket.lottery_id == lottery_id)
     if user_id is not None:
-        q = q.filter(Ticket.user_id == user_id)
-    return q.all()
+        q = q.where(Ticket.user_id == user_id)
+    if limit is not None or cursor is not None:
+        return await _ticket_page(db, response, q, limit, cursor, lottery_id, user_id, include_archived)
+    rows = (await db.execute(q)).scalars().all()
+    if _wants_archived(lottery_id, include_archived, rows):
+        rows += await archived_tickets(db, lottery_id, user_id)
+    return rows
 
 # New helper route for frontend compatibility
 @app.get("/lotteries/{lottery_id}/tickets", response_model=list[TicketOut])
-def list_tickets_by_lottery(lottery_id: int, db: Session = Depends(get_db)):
-    """Return all tickets for a specific lottery (alias of /tickets?lottery_id=)."""
-    return db.query(Ticket).filter(Ticket.lottery_id == lottery_id).all()
+async def list_tickets_by_lottery(lottery_id: int, request: Request, response: Response,
+                                  limit: int | None = Query(None, ge=1), cursor: str | None = None,
+                                  db: AsyncSession = Depends(get_async_db)):
+    """Return the tickets of one lottery (alias of /tickets?lottery_id=)."""
+    etag = await _lottery_etag_async(db, lottery_id)
+    if etag:
+        not_modified = _etag_or_304(request, response, etag)
+        if not_modified:
+            return not_modified
+    q = select(Ticket).where(Ticket.lottery_id == lottery_id)
+    if limit is not None or cursor is not None:
+        return await _ticket_page(db, response, q, limit, cursor, lottery_id)
+    return (await db.execute(q)).scalars().all() or await archived_tickets(db, lottery_id)
+
+class GridOut(BaseModel):
+    lottery_id: int
+    version: int
+    max_tickets: int
+    sold: int
+    format: GridFormat
+    ranges: list[list[int]] | None = None
+    bitmap: str | None = None
+    mine: list[list[int]] = []  # the caller's numbers, always as ranges
+
+async def _build_grid(db: AsyncSession, lottery_id: int, fmt: GridFormat) -> dict:
+    max_tickets = (await db.execute(select(Lottery.max_tickets).where(Lottery.id == lottery_id))).scalar()
+    # plain ints straight from the unique (lottery_id, ticket_number) index
+    numbers = (await db.execute(
+        select(Ticket.ticket_number).where(Ticket.lottery_id == lottery_id).order_by(Ticket.ticket_number)
+    )).scalars().all()
+    if not numbers:
+        numbers = [t.ticket_number for t in await archived_tickets(db, lottery_id)]
+    grid = {"lottery_id": lottery_id, "max_tickets": max_tickets, "sold": len(numbers), "format": fmt}
+    if fmt == "bitmap":
+        grid["bitmap"] = to_bitmap(numbers, max_tickets)
+    else:
+        grid["ranges"] = to_ranges(numbers)
+    return grid
+
+@app.get("/lotteries/{lottery_id}/grid", response_model=GridOut, response_model_exclude_none=True)
+async def get_ticket_grid(lottery_id: int, request: Request, format: GridFormat = "ranges",
+                          user_id: int | None = None, db: AsyncSession = Depends(get_async_db)):
+    """Sold numbers of a lottery for painting the ticket grid (see grid.py for the encodings).
+
+    ``mine`` holds the numbers of ``user_id`` as ranges. The grid is served
+    from a snapshot (see snapshots.py), so unchanged lotteries cost no query.
+    """
+    async def build(version):
+        grid = await _build_grid(db, lottery_id, format)
+        return f'W/"g{lottery_id}.{version}"', {**grid, "version": version, "mine": []}
+    snapshot = await snapshots.get(("grid", lottery_id, format), lottery_id,
+                                   lambda: get_lottery_version_async(db, lottery_id), build)
+    if snapshot is None:
+        raise HTTPException(404, detail="Lottery not found")
+    if user_id is None or is_current(request, snapshot.etag):
+        return snapshot_response(request, snapshot)
+    # sorted here: an ORDER BY makes SQLite walk the whole lottery by ticket number
+    numbers = (await db.execute(
+        select(Ticket.ticket_number).where(Ticket.user_id == user_id, Ticket.lottery_id == lottery_id)
+    )).scalars().all()
+    if not numbers and snapshot.payload["sold"]:
+        numbers = [t.ticket_number for t in await archived_tickets(db, lottery_id, user_id)]
+    mine = to_ranges(sorted(numbers))
+    return snapshot_response(request, snapshot, dumps({**snapshot.payload, "mine": mine}))
+
+class BootstrapOut(BaseModel):
+    version: int
+    user: dict | None = None
+    stars_balance: int | None = None
+    rate: dict
+    stats: dict | None = None
+    lotteries: list[LotteryOut] | None = None
+    tickets: list[TicketOut] | None = None
+    archived_tickets: list[dict] | None = None
+    unchanged: list[str] = []
+
+# parts that only change when DATA_VERSION does; skipped when the client is current
+VERSIONED_PARTS = ("stats", "lotteries", "tickets", "archived_tickets")
+
+async def _in_new_session(fn):
+    # each concurrent part needs its own session: one AsyncSession runs one query at a time
+    async with AsyncSessionLocal() as db:
+        return await fn(db)
+
+async def _bootstrap_user(db: AsyncSession, user_id: int) -> User:
+    """The user's profile; unknown ids are registered on first sight, as in GET /users/{id}."""
+    user = (await db.execute(select(User).where(User.user_id == user_id))).scalar()
+    if user is None:
+        async with async_write_lock:
+            user = User(user_id=user_id)
+            db.add(user)
+            try:
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()  # registered by a concurrent request
+                user = (await db.execute(select(User).where(User.user_id == user_id))).scalar_one()
+    return user
+
+async def _bootstrap_lotteries(db: AsyncSession) -> list[dict]:
+    return [_lottery_out(l) for l in await _active_lotteries(db) + await _finished_lotteries(db)]
+
+async def _bootstrap_tickets(db: AsyncSession, user_id: int) -> list[Ticket]:
+    # live tickets only; archived lotteries come as counts, their blobs stay packed
+    return (await db.execute(select(Ticket).where(Ticket.user_id == user_id))).scalars().all()
+
+async def _bootstrap_archived(db: AsyncSession, user_id: int) -> list[dict]:
+    rows = await db.execute(
+        select(ArchivedUserTickets.lottery_id, ArchivedUserTickets.tickets)
+        .where(ArchivedUserTickets.user_id == user_id).order_by(ArchivedUserTickets.lottery_id)
+    )
+    return [{"lottery_id": lottery_id, "tickets": n} for lottery_id, n in rows]
+
+@app.get("/bootstrap/{user_id}", response_model=BootstrapOut)
+async def bootstrap(user_id: int, version: int | None = None, db: AsyncSession = Depends(get_async_db)):
+    """Everything the Mini App loads on open, in one response.
+
+    Combines /users/{id}, /users/{id}/balance, /rates/ton_star,
+    /users/{id}/stats, /lotteries and /tickets?user_id=. Tickets of archived
+    lotteries come as ``archived_tickets``: a count per lottery. Pass back
+    the returned ``version`` as ``?version=`` (e.g. when polling): while it
+    is current, the versioned parts are left out and listed in
+    ``unchanged``. The parts are read concurrently, each in its own session.
+
+    Like GET /users/{id}, this registers an unknown ``user_id`` (one INSERT on
+    the first visit), so the wallet and purchase endpoints find the user.
+    """
+    current = await get_data_version_async(db)
+    skip = version is not None and version == current
+    parts = {
+        "user": _in_new_session(lambda s: _bootstrap_user(s, user_id)),
+        "rate": run_in_threadpool(rate_service.current),
+    }
+    if not skip:
+        parts["stats"] = _in_new_session(lambda s: _user_stats(s, user_id))
+        parts["lotteries"] = _in_new_session(_bootstrap_lotteries)
+        parts["tickets"] = _in_new_session(lambda s: _bootstrap_tickets(s, user_id))
+        parts["archived_tickets"] = _in_new_session(lambda s: _bootstrap_archived(s, user_id))
+    results = dict(zip(parts, await asyncio.gather(*parts.values())))
+    user = results.pop("user")
+    return {
+        "version": current,
+        "user": _user_out(user),
+        "stars_balance": getattr(user, "stars_balance", 0) or 0,
+        **results,
+        "unchanged": list(VERSIONED_PARTS) if skip else [],
+    }
 
-@app.post("/lotteries/{lottery_id}/draw")
+@app.post("/lotteries/{lottery_id}/draw", status_code=202)
 def manual_draw(lottery_id: int, db: Session = Depends(get_db)):
-    res = choose_winner(lottery_id, db, force=True)
-    db.commit()
-    if res:
-        uid, num = res
-        return {"ok": True, "winner_id": uid, "ticket_number": num}
-    return {"ok": False, "detail": "Unable to draw"}
+    """Queue a forced draw; poll /lotteries/{id}/draw_status for progress."""
+    lottery = db.query(Lottery).filter(Lottery.id == lottery_id).first()
+    if not lottery:
+        raise HTTPException(404, detail="Lottery not found")
+    if lottery.winner_id is not None:
+        raise HTTPException(400, detail="Winner already chosen")
+    if not lottery.tickets_sold:
+        raise HTTPException(400, detail="No tickets sold")
+    job = enqueue_draw(db, lottery_id, force=True)
+    try:
+        db.commit()
+    except IntegrityError:
+        # queued concurrently by the purchase that filled the lottery
+        db.rollback()
+        job = db.query(DrawJob).filter(DrawJob.lottery_id == lottery_id).one()
+    if draw_worker:
+        draw_worker.wake()
+    return {"ok": True, "job_id": job.id, "state": job.state}
+
+class DrawStatusOut(BaseModel):
+    lottery_id: int
+    job_id: int
+    state: str
+    attempts: int
+    last_error: str | None = None
+    winner_id: int | None = None
+    winner_ticket_number: int | None = None
+    random_link: str | None = None
+    created_at: datetime | None = None
+    updated_at: datetime | None = None
+
+@app.get("/lotteries/{lottery_id}/draw_status", response_model=DrawStatusOut)
+def draw_status(lottery_id: int, db: Session = Depends(get_db)):
+    job = db.query(DrawJob).filter(DrawJob.lottery_id == lottery_id).first()
+    if not job:
+        raise HTTPException(404, detail="Draw not scheduled")
+    return DrawStatusOut(
+        lottery_id=job.lottery_id,
+        job_id=job.id,
+        state=job.state,
+        attempts=job.attempts,
+        last_error=job.last_error,
+        winner_id=job.winner_id,
+        winner_ticket_number=job.winner_ticket_number,
+        random_link=job.random_link,
+        created_at=job.created_at,
+        updated_at=job.updated_at,
+    )
 
 class StatsOut(BaseModel):
     tickets_sold: int
@@ -596,48 +1003,62 @@ def lottery_stats(lottery_id: int, db: Session = Depends(get_db)):
     lot = db.query(Lottery).filter(Lottery.id == lottery_id).first()
     if not lot:
         raise HTTPException(404, detail="Lottery not found")
-    return StatsOut(tickets_sold=lot.tickets_sold, revenue=lot.tickets_sold*lot.ticket_price)
-
-from fastapi.responses import StreamingResponse
-import csv, io
+    return StatsOut(tickets_sold=lot.tickets_sold, revenue=lot.revenue or 0)
 
 @app.get("/export/lotteries")
-def export_lotteries(db: Session = Depends(get_db)):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["id","name","ticket_price","max_tickets","tickets_sold","winner_id","winner_ticket_number"])
-    for l in db.query(Lottery).all():
-        writer.writerow([l.id,l.name,l.ticket_price,l.max_tickets,l.tickets_sold,l.winner_id,l.winner_ticket_number])
-    output.seek(0)
-    return StreamingResponse(output, media_type="text/csv", headers={"Content-Disposition":"attachment; filename=lotteries.csv"})
+def export_lotteries(format: ExportFormat = "csv", gzip: bool = False, status: LotteryStatus | None = None,
+                     since: datetime | None = None, until: datetime | None = None):
+    """Stream lotteries, optionally filtered by status and creation time [since, until)."""
+    q = select(Lottery.id, Lottery.name, Lottery.ticket_price, Lottery.max_tickets, Lottery.tickets_sold,
+               Lottery.winner_id, Lottery.winner_ticket_number)
+    if status == "active":
+        q = q.where(Lottery.winner_id == None)
+    elif status == "finished":
+        q = q.where(Lottery.winner_id != None)
+    if since is not None:
+        q = q.where(Lottery.created_at >= since)
+    if until is not None:
+        q = q.where(Lottery.created_at < until)
+    return export_response(SessionLocal, q.order_by(Lottery.id), "lotteries", format, gzip)
 
 @app.get("/export/tickets")
-def export_tickets(db: Session = Depends(get_db)):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["id","lottery_id","user_id","ticket_number"])
-    for t in db.query(Ticket).all():
-        writer.writerow([t.id,t.lottery_id,t.user_id,t.ticket_number])
-    output.seek(0)
-    return StreamingResponse(output, media_type="text/csv", headers={"Content-Disposition":"attachment; filename=tickets.csv"})
+def export_tickets(format: ExportFormat = "csv", gzip: bool = False, lottery_id: int | None = None,
+                   user_id: int | None = None, since: datetime | None = None, until: datetime | None = None):
+    """Stream tickets, optionally filtered by lottery, user and purchase time [since, until).
+
+    Tickets bought before purchase times were recorded have none and are
+    left out of date-filtered exports. Archived tickets follow the live ones.
+    """
+    q = select(Ticket.id, Ticket.lottery_id, Ticket.user_id, Ticket.ticket_number)
+    if lottery_id is not None:
+        q = q.where(Ticket.lottery_id == lottery_id)
+    if user_id is not None:
+        q = q.where(Ticket.user_id == user_id)
+    if since is not None:
+        q = q.where(Ticket.created_at >= since)
+    if until is not None:
+        q = q.where(Ticket.created_at < until)
+    archived = lambda columns: iter_archived_rows(SessionLocal, columns, lottery_id, user_id, since, until)
+    return export_response(SessionLocal, q.order_by(Ticket.id), "tickets", format, gzip, archived)
 
 @app.get("/lotteries/{lottery_id}/result", response_model=LotteryResult)
-def get_lottery_result(lottery_id: int, db: Session = Depends(get_db)):
-    lottery = db.query(Lottery).filter(Lottery.id == lottery_id).first()
-    if not lottery:
+async def get_lottery_result(lottery_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def build(version):
+        lottery = await db.get(Lottery, lottery_id)
+        return f'W/"l{lottery_id}.{version}"', {
+            "lottery_id": lottery.id,
+            "winner_id": lottery.winner_id,
+            "winner_username": lottery.winner_username,
+            "winner_first_name": lottery.winner_first_name,
+            "winner_last_name": lottery.winner_last_name,
+            "winner_ticket_number": lottery.winner_ticket_number,
+            "random_link": lottery.random_link,
+        }
+    snapshot = await snapshots.get(("result", lottery_id), lottery_id,
+                                   lambda: get_lottery_version_async(db, lottery_id), build)
+    if snapshot is None:
         raise HTTPException(404, detail="Lottery not found")
-    winner_ticket = None
-    if lottery.winner_id:
-        winner_ticket = db.query(Ticket).filter_by(lottery_id=lottery.id, user_id=lottery.winner_id, ticket_number=lottery.winner_ticket_number).first()
-    return LotteryResult(
-        lottery_id=lottery.id,
-        winner_id=lottery.winner_id,
-        winner_username=winner_ticket.username if winner_ticket else None,
-        winner_first_name=winner_ticket.first_name if winner_ticket else None,
-        winner_last_name=winner_ticket.last_name if winner_ticket else None,
-        winner_ticket_number=lottery.winner_ticket_number,
-        random_link=lottery.random_link
-    )
+    return snapshot_response(request, snapshot)
 
 
 def _verify_hash(data: dict, bot_token: str) -> bool:
@@ -648,11 +1069,7 @@ def _verify_hash(data: dict, bot_token: str) -> bool:
     return hmac.compare_digest(computed_hash, recv_hash)
 
 
-@app.get("/users/{user_id}")
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        raise HTTPException(404, detail="User not found")
+def _user_out(user: User) -> dict:
     return {
         "user_id": user.user_id,
         "username": user.username,
@@ -661,13 +1078,30 @@ def get_user(user_id: int, db: Session = Depends(get_db)):
         "ton_wallet_address": user.ton_wallet_address
     }
 
+@app.get("/users/{user_id}")
+def get_user(user_id: int, db: Session = Depends(get_db)):
+    """The user's profile; unknown ids are registered on first sight."""
+    user = db.query(User).filter(User.user_id == user_id).first()
+    if not user:
+        user = User(user_id=user_id)
+        db.add(user)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()  # registered by a concurrent request
+            user = db.query(User).filter(User.user_id == user_id).one()
+    return _user_out(user)
+
 @app.post("/users/{user_id}/wallet")
 def update_wallet(user_id: int, req: WalletUpdateRequest, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.user_id == user_id).first()
     if not user:
         raise HTTPException(404, detail="User not found")
+    old_address = user.ton_wallet_address
     user.ton_wallet_address = req.ton_wallet_address
     db.commit()
+    for address in {old_address, req.ton_wallet_address} - {None}:
+        wallet_cache.invalidate(address.strip())
     return {"ok": True, "ton_wallet_address": user.ton_wallet_address}
 
 @app.post("/auth/verify")
@@ -0,0 +1,287 @@
+"""Cold archive for the tickets of long-finished lotteries.
+
+Once a lottery has been finished for ARCHIVE_AFTER_DAYS, ArchiveWorker
+moves its ``tickets`` rows into one ``ticket_archives`` row. The row holds
+a zlib-compressed, column-wise JSON blob in which each distinct buyer name
+is stored once, and ids, numbers and purchase times are delta-coded.
+``archived_user_tickets`` keeps the ticket count per user, which is all
+that user stats need. The winner stays on the lottery row (winner_id,
+winner_ticket_number, winner_* names). The hot table therefore only holds
+the tickets of active and recently finished lotteries.
+
+Readers go through archived_tickets() / iter_archived_rows(). They return
+rows with Ticket's attributes, so /lotteries/{id}/tickets, the grid,
+/tickets?lottery_id= and /export/tickets serve archived lotteries as
+before. Decoded blobs are kept in a small LRU. Listings across lotteries
+(bootstrap, /tickets?user_id=) leave the blobs packed and report
+archived lotteries from ``archived_user_tickets`` instead.
+
+Ticket ids are AUTOINCREMENT on SQLite: otherwise deleting the newest
+tickets here would hand their ids to the next purchase.
+
+Archiving one lottery is a single transaction. It bumps the lottery's
+version, so cached responses move on. Workers racing for the same lottery
+collide on the primary key; one wins and the others skip it.
+"""
+import asyncio
+import json
+import os
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, NamedTuple
+
+from sqlalchemy import delete, exists, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from db import ArchivedUserTickets, DrawJob, Lottery, Ticket, TicketArchive, bump_version
+from draws import ACTIVE_STATES
+from exports import EXPORT_CHUNK_ROWS
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "30"))  # 0 turns the worker off
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "20"))  # lotteries per pass
+ARCHIVE_CACHE_SIZE = int(os.getenv("ARCHIVE_CACHE_SIZE", "32"))  # decoded lotteries kept in memory
+BLOB_FORMAT = 1
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+class ArchivedTicket(NamedTuple):
+    id: int
+    lottery_id: int
+    user_id: int
+    username: str | None
+    first_name: str | None
+    last_name: str | None
+    ticket_number: int
+    created_at: datetime | None
+
+
+# ---- Blob format ----
+
+def pack(rows) -> bytes:
+    """Encode ticket rows (Ticket's attributes) of one lottery."""
+    people: dict[tuple, int] = {}
+    ids, numbers, owners, times = [], [], [], []
+    last_id = last_number = last_time = 0
+    for row in sorted(rows, key=lambda r: r.ticket_number):
+        person = (row.user_id, row.username, row.first_name, row.last_name)
+        owners.append(people.setdefault(person, len(people)))
+        ids.append(row.id - last_id)
+        numbers.append(row.ticket_number - last_number)
+        last_id, last_number = row.id, row.ticket_number
+        if row.created_at is None:
+            times.append(None)
+        else:
+            micros = (row.created_at.replace(tzinfo=None) - EPOCH) // MICROSECOND
+            times.append(micros - last_time)
+            last_time = micros
+    doc = {"v": BLOB_FORMAT, "people": list(people), "id": ids, "n": numbers, "p": owners, "t": times}
+    return zlib.compress(json.dumps(doc, separators=(",", ":"), ensure_ascii=False).encode(), 9)
+
+
+def unpack(lottery_id: int, data: bytes) -> list[ArchivedTicket]:
+    """Decode a blob back into rows, ordered by ticket number."""
+    doc = json.loads(zlib.decompress(data))
+    if doc.get("v") != BLOB_FORMAT:
+        raise ValueError(f"Unknown ticket archive format {doc.get('v')!r} for lottery {lottery_id}")
+    people = doc["people"]
+    rows = []
+    ticket_id = number = micros = 0
+    for id_delta, number_delta, owner, time_delta in zip(doc["id"], doc["n"], doc["p"], doc["t"]):
+        ticket_id += id_delta
+        number += number_delta
+        created_at = None
+        if time_delta is not None:
+            micros += time_delta
+            created_at = EPOCH + micros * MICROSECOND
+        rows.append(ArchivedTicket(ticket_id, lottery_id, *people[owner], number, created_at))
+    return rows
+
+
+# ---- Reading ----
+
+_decoded: OrderedDict = OrderedDict()  # (lottery_id, archived_at) -> rows
+_decoded_lock = threading.Lock()
+
+
+def _cached(key):
+    with _decoded_lock:
+        rows = _decoded.get(key)
+        if rows is not None:
+            _decoded.move_to_end(key)
+        return rows
+
+
+def _remember(key, rows):
+    with _decoded_lock:
+        _decoded[key] = rows
+        while len(_decoded) > ARCHIVE_CACHE_SIZE:
+            _decoded.popitem(last=False)
+
+
+def _archive_index(lottery_id: int | None, user_id: int | None, after: tuple | None):
+    q = select(TicketArchive.lottery_id, TicketArchive.archived_at)
+    if user_id is not None:
+        q = q.join(ArchivedUserTickets, ArchivedUserTickets.lottery_id == TicketArchive.lottery_id) \
+            .where(ArchivedUserTickets.user_id == user_id)
+    if lottery_id is not None:
+        q = q.where(TicketArchive.lottery_id == lottery_id)
+    if after is not None:
+        q = q.where(TicketArchive.lottery_id >= after[0])
+    return q.order_by(TicketArchive.lottery_id)
+
+
+def _naive_utc(value: datetime | None) -> datetime | None:
+    # created_at is stored as naive UTC
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _matching(rows, user_id: int | None, after: tuple | None):
+    for row in rows:
+        if user_id is not None and row.user_id != user_id:
+            continue
+        if after is not None and (row.lottery_id, row.ticket_number) <= after:
+            continue
+        yield row
+
+
+async def archived_tickets(db, lottery_id: int | None = None, user_id: int | None = None,
+                           after: tuple | None = None, limit: int | None = None) -> list[ArchivedTicket]:
+    """Archived tickets ordered by (lottery_id, ticket_number), past the keyset ``after``."""
+    out = []
+    for lid, archived_at in (await db.execute(_archive_index(lottery_id, user_id, after))).all():
+        key = (lid, archived_at)
+        rows = _cached(key)
+        if rows is None:
+            data = (await db.execute(select(TicketArchive.data).where(TicketArchive.lottery_id == lid))).scalar()
+            rows = await asyncio.to_thread(unpack, lid, data)
+            _remember(key, rows)
+        for row in _matching(rows, user_id, after):
+            out.append(row)
+            if limit is not None and len(out) >= limit:
+                return out
+    return out
+
+
+def iter_archived_rows(session_factory, columns: list[str], lottery_id: int | None = None,
+                       user_id: int | None = None, since: datetime | None = None,
+                       until: datetime | None = None) -> Iterator[list]:
+    """Chunks of archived rows as tuples of ``columns`` (for exports), lottery by lottery."""
+    since, until = _naive_utc(since), _naive_utc(until)
+    db = session_factory()
+    try:
+        archives = db.execute(_archive_index(lottery_id, user_id, None)).all()
+        for lid, archived_at in archives:
+            key = (lid, archived_at)
+            rows = _cached(key)
+            if rows is None:
+                data = db.execute(select(TicketArchive.data).where(TicketArchive.lottery_id == lid)).scalar()
+                rows = unpack(lid, data)
+                _remember(key, rows)
+            if since is not None or until is not None:
+                rows = [row for row in rows if row.created_at is not None
+                        and (since is None or row.created_at >= since) and (until is None or row.created_at < until)]
+            matching = [tuple(getattr(row, c) for c in columns) for row in _matching(rows, user_id, None)]
+            for start in range(0, len(matching), EXPORT_CHUNK_ROWS):
+                yield matching[start:start + EXPORT_CHUNK_ROWS]
+    finally:
+        db.close()
+
+
+# ---- Archiving ----
+
+def due_lotteries(db, cutoff: datetime, limit: int) -> list[int]:
+    """Finished before ``cutoff``, not archived yet, no draw step still running."""
+    q = (
+        select(Lottery.id)
+        .where(Lottery.winner_id != None, Lottery.finished_at < cutoff)
+        .where(~exists().where(TicketArchive.lottery_id == Lottery.id))
+        .where(~exists().where(DrawJob.lottery_id == Lottery.id, DrawJob.state.in_(ACTIVE_STATES)))
+        .order_by(Lottery.finished_at, Lottery.id)
+        .limit(limit)
+    )
+    return list(db.execute(q).scalars())
+
+
+def archive_lottery(db, lottery_id: int) -> dict:
+    """Move one lottery's tickets into the archive; the caller commits."""
+    rows = db.execute(
+        select(Ticket.id, Ticket.user_id, Ticket.username, Ticket.first_name, Ticket.last_name,
+               Ticket.ticket_number, Ticket.created_at)
+        .where(Ticket.lottery_id == lottery_id)
+    ).all()
+    data = pack(rows)
+    db.add(TicketArchive(lottery_id=lottery_id, tickets=len(rows), data=data))
+    db.flush()  # the primary key claims the lottery before any ticket is touched
+    counts = Counter(row.user_id for row in rows)
+    if counts:
+        db.execute(insert(ArchivedUserTickets), [
+            {"lottery_id": lottery_id, "user_id": user_id, "tickets": n} for user_id, n in counts.items()
+        ])
+    db.execute(delete(Ticket).where(Ticket.lottery_id == lottery_id))
+    bump_version(db, lottery_id)
+    return {"lottery_id": lottery_id, "tickets": len(rows), "bytes": len(data)}
+
+
+def archive_due(session_factory, older_than: timedelta, limit: int = ARCHIVE_BATCH) -> list[dict]:
+    """Archive up to ``limit`` lotteries finished more than ``older_than`` ago, one transaction each."""
+    db = session_factory()
+    try:
+        lottery_ids = due_lotteries(db, datetime.utcnow() - older_than, limit)
+        db.rollback()
+        done = []
+        for lottery_id in lottery_ids:
+            try:
+                done.append(archive_lottery(db, lottery_id))
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # archived by another worker meanwhile
+        return done
+    finally:
+        db.close()
+
+
+class ArchiveWorker:
+    """Runs archive_due() every ARCHIVE_INTERVAL_SECONDS."""
+
+    def __init__(self, session_factory, after_days: float = ARCHIVE_AFTER_DAYS,
+                 interval: float = ARCHIVE_INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.older_than = timedelta(days=after_days)
+        self.interval = interval
+        self.stats = {"lotteries": 0, "tickets": 0, "bytes": 0}
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def run(self):
+        while True:
+            try:
+                while True:
+                    done = await asyncio.to_thread(archive_due, self.session_factory, self.older_than)
+                    for archived in done:
+                        self.stats["lotteries"] += 1
+                        self.stats["tickets"] += archived["tickets"]
+                        self.stats["bytes"] += archived["bytes"]
+                    if done:
+                        print(f"Archived the tickets of {len(done)} lotteries "
+                              f"({sum(a['tickets'] for a in done)} tickets)")
+                    if len(done) < ARCHIVE_BATCH:
+                        break
+            except Exception as ex:
+                print("Archive worker error:", ex)
+            await asyncio.sleep(self.interval)
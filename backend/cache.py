@@ -0,0 +1,130 @@
+"""Small in-process caches for upstream lookups.
+
+AsyncTTLCache is a bounded LRU with a TTL per entry. Concurrent misses
+for the same key share one fetch (single-flight). When a refresh fails,
+the last good value is served as stale until ``stale_ttl`` runs out.
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class AsyncTTLCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 30.0, stale_ttl: float = 600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (value, stored_at)
+        self._inflight: dict = {}  # key -> asyncio.Future
+        self._generation: dict = {}  # key -> invalidation counter
+        # invalidate() is called from sync endpoints running in the threadpool
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "stale": 0, "errors": 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def _lookup(self, key, max_age: float):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            if time.monotonic() - item[1] > max_age:
+                if max_age >= self.stale_ttl:
+                    del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return item
+
+    def _store(self, key, value, generation: int):
+        with self._lock:
+            if self._generation.get(key, 0) != generation:
+                return  # invalidated while the fetch was running
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drop an entry; a fetch already in flight will not re-store it. Thread-safe."""
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation[key] = self._generation.get(key, 0) + 1
+
+    async def get(self, key, fetch) -> tuple[object, bool]:
+        """Return (value, stale). ``fetch`` is an async callable producing a fresh value.
+
+        Raises the fetch error only when there is nothing stale to fall back on.
+        """
+        item = self._lookup(key, self.ttl)
+        if item is not None:
+            self.stats["hits"] += 1
+            return item[0], False
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            generation = self._generation.get(key, 0)
+            try:
+                value = await fetch()
+            except Exception as ex:
+                self.stats["errors"] += 1
+                future.set_exception(ex)
+                future.exception()  # mark retrieved when nobody else is waiting
+            else:
+                self._store(key, value, generation)
+                future.set_result(value)
+            finally:
+                self._inflight.pop(key, None)
+                if not future.done():
+                    # the leading request was cancelled; let the waiters fall back
+                    future.set_exception(RuntimeError("fetch cancelled"))
+                    future.exception()
+        try:
+            return await asyncio.shield(future), False
+        except Exception:
+            item = self._lookup(key, self.stale_ttl)
+            if item is None:
+                raise
+            self.stats["stale"] += 1
+            return item[0], True
+
+
+class SettingsCache:
+    """Read-through in-process cache of the ``settings`` table.
+
+    Writers in this process call invalidate(); the TTL bounds how long
+    other workers keep serving a value changed elsewhere.
+    """
+
+    def __init__(self, session_factory, ttl: float = 60.0):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._data: dict = {}  # key -> (value or None, loaded_at)
+        self._lock = threading.Lock()
+
+    def get(self, key: str, default: str | None = None) -> str | None:
+        with self._lock:
+            item = self._data.get(key)
+        if item is None or time.monotonic() - item[1] > self.ttl:
+            from db import Setting
+            db = self.session_factory()
+            try:
+                value = db.query(Setting.value).filter(Setting.key == key).scalar()
+            finally:
+                db.close()
+            item = (value, time.monotonic())
+            with self._lock:
+                self._data[key] = item
+        return default if item[0] is None else item[0]
+
+    def invalidate(self, key: str | None = None):
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
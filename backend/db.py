@@ -1,11 +1,179 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Float, DateTime
+from sqlalchemy import create_engine, event, Column, Integer, String, ForeignKey, Float, DateTime, Index, LargeBinary, UniqueConstraint, cast, delete, select, update
+from datetime import datetime
+import asyncio
+import contextlib
+import os
+import time
+from contextvars import ContextVar
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import Session, sessionmaker, relationship
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./lottery.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./lottery.db")
+
+# SQLite: pragmas applied to every new connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+# Server databases (PostgreSQL, ...): connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# statements slower than this are printed with their parameters and route
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# async drivers used by async_url() for the request handlers
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+# called with (pool name, seconds) after every connection checkout; see metrics.py
+checkout_observers: list = []
+
+class _TimedCheckout:
+    """Reports how long pool.connect() took: the wait for a free slot plus connect/pre-ping."""
+    pool_name = "sync"
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            seconds = time.perf_counter() - started
+            for observer in checkout_observers:
+                observer(self.pool_name, seconds)
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pool_name = "async"
+
+# ---- Per-request statement counting ----
+class QueryStats:
+    """Statements and DB time inside one count_queries() block."""
+
+    def __init__(self, label=None):
+        self.count = 0
+        self.seconds = 0.0
+        # a string, or a callable resolved when a slow statement is logged
+        self.label = label
+
+    def where(self) -> str:
+        label = self.label() if callable(self.label) else self.label
+        return label or "-"
+
+_query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+@contextlib.contextmanager
+def count_queries(label=None):
+    """Count the statements run by this task (and threads/tasks started from it).
+
+        with count_queries("GET /lotteries") as stats:
+            ...
+        stats.count, stats.seconds
+    """
+    stats = QueryStats(label)
+    token = _query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _query_stats.reset(token)
+
+# on the Engine class: the sync engine, the async one and any script engines
+@event.listens_for(Engine, "before_cursor_execute")
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info.pop("query_started", time.perf_counter())
+    stats = _query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.seconds += seconds
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        where = stats.where() if stats is not None else "background"
+        print(f"Slow query {seconds * 1000:.0f} ms [{where}]: {' '.join(statement.split())} {repr(parameters)[:500]}")
+
+def make_engine(url: str, asynchronous: bool = False):
+    url_obj = make_url(url)
+    if asynchronous:
+        from sqlalchemy.ext.asyncio import create_async_engine as create
+    else:
+        create = create_engine
+    poolclass = TimedAsyncQueuePool if asynchronous else TimedQueuePool
+    if url_obj.get_backend_name() != "sqlite":
+        return create(
+            url,
+            poolclass=poolclass,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=True,
+        )
+    file_db = url_obj.database not in (None, "", ":memory:")
+    # in-memory databases keep SQLAlchemy's single-connection pools
+    eng = create(url, connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000},
+                 **({"poolclass": poolclass} if file_db else {}))
+
+    @event.listens_for(eng.sync_engine if asynchronous else eng, "connect")
+    def _sqlite_pragmas(dbapi_conn, connection_record):
+        # WAL lets readers run next to the single writer; busy_timeout makes a
+        # second writer (another uvicorn worker, the draw worker) wait instead
+        # of failing with "database is locked".
+        cur = dbapi_conn.cursor()
+        if file_db:
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute("PRAGMA synchronous=NORMAL")
+            cur.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cur.close()
+
+    return eng
+
+def async_url(url: str) -> str:
+    """The same database through its asyncio driver (sqlite -> sqlite+aiosqlite, ...)."""
+    url_obj = make_url(url)
+    backend = url_obj.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend!r} (DATABASE_URL)")
+    return url_obj.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+# Sync engine: migrations, background workers, scripts and the remaining sync endpoints
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# SQLite has a single writer at a time. Async writers queue on this lock,
+# on the event loop, instead of inside SQLite: a transaction holding the
+# database lock must not wait for its turn on a busy loop while other
+# writers burn their busy_timeout. Server databases need no such gate.
+IS_SQLITE = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name() == "sqlite"
+async_write_lock = asyncio.Lock() if IS_SQLITE else contextlib.nullcontext()
+
+# Async engine for the hot request handlers; created on first use so the
+# sync path (scripts) works without the async driver installed
+async_engine = None
+_async_sessionmaker = None
+
+def AsyncSessionLocal():
+    global async_engine, _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        async_engine = make_engine(async_url(SQLALCHEMY_DATABASE_URL), asynchronous=True)
+        # objects stay readable after commit without a lazy (blocking) refresh
+        _async_sessionmaker = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker()
+
+async def dispose_async_engine():
+    global async_engine, _async_sessionmaker
+    if async_engine is not None:
+        await async_engine.dispose()
+    async_engine = _async_sessionmaker = None
 Base = declarative_base()
 
 class User(Base):
@@ -31,14 +199,34 @@ class Lottery(Base):
     code = Column(String, nullable=True, unique=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     finished_at = Column(DateTime(timezone=True), nullable=True)
-    winner_id = Column(Integer, nullable=True)
+    winner_id = Column(Integer, nullable=True, index=True)  # IS NULL = still open
     winner_ticket_number = Column(Integer, nullable=True)
     random_link = Column(String, nullable=True)
+    # Denormalized summary, maintained by buy_ticket / choose_winner
+    participants_count = Column(Integer, default=0)
+    revenue = Column(Integer, default=0)
+    winner_username = Column(String, nullable=True)
+    winner_first_name = Column(String, nullable=True)
+    winner_last_name = Column(String, nullable=True)
+    # Global data version at the lottery's last change (see bump_version)
+    version = Column(Integer, default=0)
+    auto_opened = Column(Integer, default=0)  # 1 = opened by the lifecycle scheduler, which may delete it
 
     tickets = relationship("Ticket", back_populates="lottery")
 
+    # history pages: finished lotteries newest first, keyset on (finished_at, id)
+    __table_args__ = (Index("ix_lotteries_finished_at_id", "finished_at", "id"),)
+
 class Ticket(Base):
     __tablename__ = "tickets"
+    __table_args__ = (
+        UniqueConstraint("lottery_id", "ticket_number", name="uq_tickets_lottery_number"),
+        # participants of a lottery / a user's tickets and lotteries, answered from the index alone
+        Index("ix_tickets_lottery_user", "lottery_id", "user_id"),
+        Index("ix_tickets_user_lottery", "user_id", "lottery_id"),
+        # never reuse an id: archived tickets keep theirs (see archive.py)
+        {"sqlite_autoincrement": True},
+    )
     id = Column(Integer, primary_key=True, index=True)
     lottery_id = Column(Integer, ForeignKey("lotteries.id"))
     user_id = Column(Integer, ForeignKey("users.user_id"), nullable=False)
@@ -46,50 +234,50 @@ class Ticket(Base):
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
     ticket_number = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=True, default=datetime.utcnow)  # NULL for tickets sold before it existed
     lottery = relationship("Lottery", back_populates="tickets")
     user = relationship("User", back_populates="tickets")
 
-def auto_migrate_tickets_table():
-    # Автоматически добавляет новые поля, если их нет (SQLite)
-    import sqlite3
-    conn = sqlite3.connect("lottery.db")
-    cur = conn.cursor()
-    # Lotteries
-    cur.execute("PRAGMA table_info(lotteries);")
-    lot_cols = [row[1] for row in cur.fetchall()]
-    for col_def in [("code", "TEXT"), ("created_at", "DATETIME"), ("finished_at", "DATETIME"), ("prize_ton", "FLOAT")]:
-        if col_def[0] not in lot_cols:
-            cur.execute(f"ALTER TABLE lotteries ADD COLUMN {col_def[0]} {col_def[1]};")
-
-    # Tickets
-    cur.execute("PRAGMA table_info(tickets);")
-    cols = [row[1] for row in cur.fetchall()]
-    for col in ["username", "first_name", "last_name"]:
-        if col not in cols:
-            cur.execute(f"ALTER TABLE tickets ADD COLUMN {col} TEXT;")
-    # Users
-    cur.execute("PRAGMA table_info(users);")
-    user_cols = [row[1] for row in cur.fetchall()]
-    if "ton_wallet_address" not in user_cols and len(user_cols) > 0:
-        cur.execute("ALTER TABLE users ADD COLUMN ton_wallet_address TEXT;")
-    # Payments
-    cur.execute("PRAGMA table_info(payment_logs);")
-    payment_cols = [row[1] for row in cur.fetchall()]
-    if len(payment_cols) == 0:
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS payment_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                lottery_id INTEGER,
-                amount_ton FLOAT,
-                status TEXT,
-                transaction_hash TEXT,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(user_id)
-            )
-        """)
-    conn.commit()
-    conn.close()
+class TicketArchive(Base):
+    """The tickets of a long-finished lottery, packed into one compressed blob (see archive.py)."""
+    __tablename__ = "ticket_archives"
+    lottery_id = Column(Integer, ForeignKey("lotteries.id"), primary_key=True)
+    tickets = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+class ArchivedUserTickets(Base):
+    """Tickets per user in each archived lottery; user stats read these instead of the blobs."""
+    __tablename__ = "archived_user_tickets"
+    __table_args__ = (Index("ix_archived_user_tickets_user", "user_id", "lottery_id"),)
+    lottery_id = Column(Integer, ForeignKey("lotteries.id"), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    tickets = Column(Integer, nullable=False)
+
+# Recomputes the denormalized lottery summary columns from the tickets table.
+# Archived lotteries have no ticket rows left and keep the values they had.
+LOTTERY_SUMMARY_SQL = [
+    """
+    UPDATE lotteries SET
+        participants_count = (SELECT COUNT(DISTINCT t.user_id) FROM tickets t WHERE t.lottery_id = lotteries.id),
+        revenue = COALESCE(tickets_sold, 0) * ticket_price
+    WHERE id NOT IN (SELECT lottery_id FROM ticket_archives)
+    """,
+    """
+    UPDATE lotteries SET
+        winner_username = (SELECT t.username FROM tickets t WHERE t.lottery_id = lotteries.id AND t.user_id = lotteries.winner_id AND t.ticket_number = lotteries.winner_ticket_number LIMIT 1),
+        winner_first_name = (SELECT t.first_name FROM tickets t WHERE t.lottery_id = lotteries.id AND t.user_id = lotteries.winner_id AND t.ticket_number = lotteries.winner_ticket_number LIMIT 1),
+        winner_last_name = (SELECT t.last_name FROM tickets t WHERE t.lottery_id = lotteries.id AND t.user_id = lotteries.winner_id AND t.ticket_number = lotteries.winner_ticket_number LIMIT 1)
+    WHERE winner_id IS NOT NULL AND id NOT IN (SELECT lottery_id FROM ticket_archives)
+    """,
+]
+
+def rebuild_lottery_summaries(db):
+    """Backfill/repair participants_count, revenue and winner names for all lotteries."""
+    from sqlalchemy import text
+    for stmt in LOTTERY_SUMMARY_SQL:
+        db.execute(text(stmt))
+    db.commit()
 
 class Setting(Base):
     __tablename__ = "settings"
@@ -99,6 +287,43 @@ class Setting(Base):
     def __repr__(self):
         return f"<Setting {self.key}={self.value}>"
 
+class NotificationOutbox(Base):
+    """Telegram messages waiting to be delivered by notifier.OutboxDispatcher."""
+    __tablename__ = "notification_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    dedup_key = Column(String, nullable=False, unique=True)
+    lottery_id = Column(Integer, nullable=True, index=True)
+    chat_id = Column(String, nullable=False)
+    text = Column(String, nullable=False)
+    parse_mode = Column(String, nullable=True)
+    status = Column(String, nullable=False, default="pending", index=True)  # pending / sent / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = Column(String, nullable=True, index=True)
+    locked_until = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime, nullable=True)
+
+class DrawJob(Base):
+    """Queued draw: pending -> randomness_acquired -> winner_committed -> notified (or failed)."""
+    __tablename__ = "draw_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    lottery_id = Column(Integer, nullable=False, unique=True)
+    state = Column(String, nullable=False, default="pending", index=True)
+    force = Column(Integer, nullable=False, default=0)
+    random_number = Column(Integer, nullable=True)
+    random_link = Column(String, nullable=True)
+    winner_id = Column(Integer, nullable=True)
+    winner_ticket_number = Column(Integer, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = Column(String, nullable=True, index=True)
+    locked_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class PaymentLog(Base):
     __tablename__ = "payment_logs"
     id = Column(Integer, primary_key=True, index=True)
@@ -110,6 +335,141 @@ class PaymentLog(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     user = relationship("User", back_populates="payments")
 
+def claim_batch(db, model, conditions, limit: int, lease_seconds: float) -> str:
+    """Lease up to ``limit`` due rows of a queue table (outbox, draw jobs) to the caller.
+
+    ``model`` needs ``next_attempt_at``, ``claim_token`` and ``locked_until``
+    columns. Returns the claim token; select rows with it to get the batch.
+    Commits, so concurrent workers never get the same row.
+    """
+    import uuid
+    from datetime import timedelta
+    from sqlalchemy import or_
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    claimable = (
+        *conditions,
+        model.next_attempt_at <= now,
+        or_(model.locked_until == None, model.locked_until < now),
+    )
+    due_ids = select(model.id).where(*claimable).order_by(model.id).limit(limit).scalar_subquery()
+    db.execute(
+        update(model)
+        .where(model.id.in_(due_ids), *claimable)
+        .values(claim_token=token, locked_until=now + timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return token
+
+def delete_lottery_rows(db, lottery_id: int):
+    """Delete everything keyed by a lottery id except the lottery row; the caller commits.
+
+    SQLite hands a deleted lottery's id to the next one, so a leftover draw
+    job (unique per lottery) or outbox dedup key would be taken for its own.
+    """
+    for model in (Ticket, ArchivedUserTickets, TicketArchive, DrawJob, NotificationOutbox):
+        db.execute(delete(model).where(model.lottery_id == lottery_id).execution_options(synchronize_session=False))
+
+DATA_VERSION_KEY = "DATA_VERSION"
+
+def _version_bump_statements(lottery_id: int | None):
+    yield (
+        update(Setting)
+        .where(Setting.key == DATA_VERSION_KEY)
+        .values(value=cast(cast(Setting.value, Integer) + 1, String))
+        .execution_options(synchronize_session=False)
+    )
+    if lottery_id is not None:
+        current = select(cast(Setting.value, Integer)).where(Setting.key == DATA_VERSION_KEY).scalar_subquery()
+        yield (
+            update(Lottery)
+            .where(Lottery.id == lottery_id)
+            .values(version=current)
+            .execution_options(synchronize_session=False)
+        )
+
+# called with the set of bumped lottery ids (None = global only) once the bump is committed
+version_listeners: list = []
+
+def _note_bump(session: Session, lottery_id: int | None):
+    session.info.setdefault("bumped_lotteries", set()).add(lottery_id)
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    bumped = session.info.pop("bumped_lotteries", None)
+    if bumped:
+        for listener in version_listeners:
+            listener(bumped)
+
+@event.listens_for(Session, "after_soft_rollback")
+def _after_rollback(session, previous_transaction):
+    session.info.pop("bumped_lotteries", None)
+
+def bump_version(db, lottery_id: int | None = None):
+    """Advance the global data version inside the caller's transaction.
+
+    The changed lottery is stamped with the new global value, so a lottery's
+    version never repeats even if SQLite later reuses its id.
+    """
+    for stmt in _version_bump_statements(lottery_id):
+        db.execute(stmt)
+    _note_bump(db, lottery_id)
+
+async def bump_version_async(db, lottery_id: int | None = None):
+    """bump_version for an AsyncSession."""
+    for stmt in _version_bump_statements(lottery_id):
+        await db.execute(stmt)
+    _note_bump(db.sync_session, lottery_id)
+
+def get_data_version(db) -> int:
+    value = db.execute(select(Setting.value).where(Setting.key == DATA_VERSION_KEY)).scalar()
+    return int(value or 0)
+
+async def get_data_version_async(db) -> int:
+    value = (await db.execute(select(Setting.value).where(Setting.key == DATA_VERSION_KEY))).scalar()
+    return int(value or 0)
+
+def get_lottery_version(db, lottery_id: int) -> int | None:
+    return db.execute(select(Lottery.version).where(Lottery.id == lottery_id)).scalar()
+
+async def get_lottery_version_async(db, lottery_id: int) -> int | None:
+    return (await db.execute(select(Lottery.version).where(Lottery.id == lottery_id))).scalar()
+
+LOTTERY_SEQ_KEY = "LOTTERY_SEQ"
+
+def next_sequence(db, key: str = LOTTERY_SEQ_KEY) -> int:
+    """Take the next value of a counter kept in ``settings``, inside the caller's transaction.
+
+    A single UPDATE ... RETURNING, so concurrent callers never get the same value.
+    """
+    stmt = (
+        update(Setting)
+        .where(Setting.key == key)
+        .values(value=cast(cast(Setting.value, Integer) + 1, String))
+        .returning(Setting.value)
+        .execution_options(synchronize_session=False)
+    )
+    value = db.execute(stmt).scalar()
+    if value is None:
+        try:
+            with db.begin_nested():
+                db.add(Setting(key=key, value="1"))
+            return 1
+        except IntegrityError:
+            value = db.execute(stmt).scalar()  # created by a concurrent caller
+    return int(value)
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
-    auto_migrate_tickets_table()
+    from migrations import migrate
+    migrate(engine)
+    db = SessionLocal()
+    try:
+        if db.get(Setting, DATA_VERSION_KEY) is None:
+            db.add(Setting(key=DATA_VERSION_KEY, value="1"))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # seeded by another worker booting alongside
+    finally:
+        db.close()
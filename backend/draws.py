@@ -0,0 +1,245 @@
+"""Queued, resumable lottery draws.
+
+A draw is a row in ``draw_jobs`` that moves through
+pending -> randomness_acquired -> winner_committed -> notified
+(or failed). The purchase that fills a lottery only inserts the job.
+DrawWorker advances jobs in the background, and every state is committed
+before the next step starts. After a crash, a job resumes from its last
+state once its lease expires, and the random number already drawn is
+reused, never re-rolled.
+"""
+import asyncio
+import json
+import os
+import random
+import urllib.parse
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+
+from db import DrawJob, Lottery, NotificationOutbox, claim_batch
+from outbound import get_outbound
+
+RANDOM_API_KEY = os.getenv("RANDOM_API_KEY")
+DRAW_STEP_TIMEOUT = float(os.getenv("DRAW_STEP_TIMEOUT", "20"))
+DRAW_MAX_ATTEMPTS = int(os.getenv("DRAW_MAX_ATTEMPTS", "5"))
+DRAW_BATCH_SIZE = 10
+DRAW_IDLE_SECONDS = 1.0
+DRAW_LEASE_SECONDS = 60
+DRAW_NOTIFY_POLL_SECONDS = 2.0
+ACTIVE_STATES = ("pending", "randomness_acquired", "winner_committed")
+
+
+class DrawError(Exception):
+    """A draw that cannot succeed by retrying (lottery gone, already drawn, ...)."""
+
+
+def enqueue_draw(db, lottery_id: int, force: bool = False) -> DrawJob:
+    """Queue a draw in the caller's transaction; a failed job is re-armed."""
+    job = db.query(DrawJob).filter(DrawJob.lottery_id == lottery_id).first()
+    now = datetime.utcnow()
+    if job is None:
+        job = DrawJob(lottery_id=lottery_id, state="pending", force=int(force), attempts=0,
+                      next_attempt_at=now, created_at=now, updated_at=now)
+        db.add(job)
+    elif job.state == "failed":
+        job.state = "pending"
+        job.force = int(force)
+        job.attempts = 0
+        job.last_error = None
+        job.random_number = None
+        job.random_link = None
+        job.next_attempt_at = now
+    return job
+
+
+def set_job_state(db, job: dict, state: str, delay: float = 0, **values):
+    """Record a job transition and release its lease (caller commits)."""
+    db.execute(
+        update(DrawJob)
+        .where(DrawJob.id == job["id"], DrawJob.claim_token == job["token"])
+        .values(state=state, claim_token=None, locked_until=None,
+                next_attempt_at=datetime.utcnow() + timedelta(seconds=delay),
+                updated_at=datetime.utcnow(), **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def acquire_randomness(max_value: int) -> tuple[int, str | None]:
+    """Pick a number in 1..max_value: random.org signed integers, else random()."""
+    http = get_outbound()
+    # Try random.org; if it fails or key not set, fallback to Python random()
+    try:
+        if not RANDOM_API_KEY:
+            raise Exception("RANDOM_API_KEY not set")
+        payload = {
+            "jsonrpc": "2.0",
+            "method": "generateSignedIntegers",
+            "params": {
+                "apiKey": RANDOM_API_KEY,
+                "n": 1,
+                "min": 1,
+                "max": max_value,
+                "replacement": False
+            },
+            "id": str(uuid.uuid4())
+        }
+        resp = await http.request("random_org", "POST", "/invoke", json=payload)
+        data = resp.json()
+        if "result" not in data or "random" not in data["result"]:
+            raise Exception(f"random.org API error: {data}")
+        random_obj = data["result"]["random"]
+        random_number = random_obj["data"][0]
+        # build verification link (https://api.random.org/sign?random=...&signature=...)
+        random_json = json.dumps(random_obj, separators=(',', ':'))
+        signature = data["result"]["signature"]
+        verify_url = "https://api.random.org/sign?random=" + urllib.parse.quote(random_json) + "&signature=" + urllib.parse.quote(signature) + "&format=html"
+        # Генерация короткой ссылки через is.gd
+        short_url = verify_url
+        try:
+            resp_short = await http.request("isgd", "GET", "/create.php", params={"format": "simple", "url": verify_url})
+            if resp_short.status_code == 200 and resp_short.text.startswith('http'):
+                short_url = resp_short.text.strip()
+        except Exception as ex:
+            print('Shortlink error:', ex)
+        return random_number, short_url
+    except Exception as e:
+        # Fallback to python's random if random.org unavailable
+        random_number = random.randint(1, max_value)
+        print("Fallback random():", random_number, "reason:", e)
+        return random_number, None
+
+
+class DrawWorker:
+    """Advances draw jobs one state per step; several workers may run at once."""
+
+    def __init__(self, session_factory, commit_winner, randomness=acquire_randomness):
+        # commit_winner(db, job) must set the winner, call
+        # set_job_state(db, job, "winner_committed", ...) and commit
+        self.session_factory = session_factory
+        self.commit_winner = commit_winner
+        self.randomness = randomness
+        self._loop = None
+        self._wake = None
+        self._task = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def wake(self):
+        """Process jobs now instead of at the next idle tick; thread-safe."""
+        if self._loop and self._wake:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass
+
+    async def run(self):
+        while True:
+            try:
+                handled = await self.process_once()
+            except Exception as ex:
+                print("Draw worker error:", ex)
+                handled = 0
+            if not handled:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), DRAW_IDLE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def process_once(self) -> int:
+        jobs = await asyncio.to_thread(self._claim)
+        await asyncio.gather(*(self._advance(job) for job in jobs))
+        return len(jobs)
+
+    async def _advance(self, job: dict):
+        try:
+            if job["state"] == "pending":
+                max_value = await asyncio.to_thread(self._tickets_sold, job)
+                # non-blocking; a hung upstream only costs this job its deadline
+                number, link = await asyncio.wait_for(self.randomness(max_value), DRAW_STEP_TIMEOUT)
+                await asyncio.to_thread(self._transition, job, "randomness_acquired",
+                                        random_number=number, random_link=link)
+            elif job["state"] == "randomness_acquired":
+                await asyncio.to_thread(self._commit, job)
+            elif job["state"] == "winner_committed":
+                await asyncio.to_thread(self._check_notified, job)
+        except DrawError as ex:
+            print(f"Draw for lottery {job['lottery_id']} failed:", ex)
+            await asyncio.to_thread(self._transition, job, "failed", last_error=str(ex))
+        except Exception as ex:
+            attempts = job["attempts"] + 1
+            print(f"Draw for lottery {job['lottery_id']} step {job['state']} error (attempt {attempts}):", ex)
+            if attempts >= DRAW_MAX_ATTEMPTS:
+                await asyncio.to_thread(self._transition, job, "failed", attempts=attempts, last_error=str(ex))
+            else:
+                await asyncio.to_thread(self._transition, job, job["state"], delay=min(2 ** attempts, 60),
+                                        attempts=attempts, last_error=str(ex))
+
+    # ---- database steps (run in threads) ----
+    def _claim(self) -> list[dict]:
+        db = self.session_factory()
+        try:
+            token = claim_batch(db, DrawJob, [DrawJob.state.in_(ACTIVE_STATES)], DRAW_BATCH_SIZE, DRAW_LEASE_SECONDS)
+            return [{"id": j.id, "lottery_id": j.lottery_id, "state": j.state, "force": bool(j.force),
+                     "random_number": j.random_number, "random_link": j.random_link,
+                     "attempts": j.attempts, "token": token}
+                    for j in db.query(DrawJob).filter(DrawJob.claim_token == token)]
+        finally:
+            db.close()
+
+    def _tickets_sold(self, job: dict) -> int:
+        db = self.session_factory()
+        try:
+            lottery = db.query(Lottery).filter(Lottery.id == job["lottery_id"]).first()
+            if not lottery:
+                raise DrawError("Lottery not found")
+            if lottery.winner_id is not None:
+                raise DrawError("Winner already chosen")
+            if not job["force"] and lottery.tickets_sold < lottery.max_tickets:
+                raise DrawError("Not enough tickets sold")
+            if not lottery.tickets_sold:
+                raise DrawError("No tickets sold")
+            return lottery.tickets_sold
+        finally:
+            db.close()
+
+    def _commit(self, job: dict):
+        db = self.session_factory()
+        try:
+            self.commit_winner(db, job)
+        finally:
+            db.close()
+
+    def _check_notified(self, job: dict):
+        db = self.session_factory()
+        try:
+            pending = db.query(func.count(NotificationOutbox.id)).filter(
+                NotificationOutbox.lottery_id == job["lottery_id"], NotificationOutbox.status == "pending").scalar()
+            if pending:
+                set_job_state(db, job, "winner_committed", delay=DRAW_NOTIFY_POLL_SECONDS)
+            else:
+                set_job_state(db, job, "notified")
+            db.commit()
+        finally:
+            db.close()
+
+    def _transition(self, job: dict, state: str, delay: float = 0, **values):
+        db = self.session_factory()
+        try:
+            set_job_state(db, job, state, delay=delay, **values)
+            db.commit()
+        finally:
+            db.close()
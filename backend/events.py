@@ -0,0 +1,118 @@
+"""In-process fan-out of lottery updates to Server-Sent Events clients.
+
+Handlers publish after they commit; every connected client owns a bounded
+queue on the event loop. A client that cannot keep up has its backlog
+dropped and receives a single ``resync`` event instead, so one slow phone
+never makes the server buffer without limit.
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+
+def format_sse(event: str, data, event_id: int | None = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str))
+    return "\n".join(lines) + "\n\n"
+
+
+RESYNC = format_sse("resync", {"reason": "client too slow, refetch state"})
+
+
+class Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop, lottery_id: int | None, maxsize: int):
+        self.loop = loop
+        self.lottery_id = lottery_id
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize)
+        self.overflowed = False
+        self.dropped = 0
+
+    def wants(self, lottery_id: int | None) -> bool:
+        return self.lottery_id is None or lottery_id is None or self.lottery_id == lottery_id
+
+    def offer(self, message: str):
+        """Enqueue a message; must run on the subscriber's loop."""
+        if self.overflowed:
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # backpressure: forget the backlog and ask the client to refetch
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait(RESYNC)
+            self.overflowed = True
+
+    async def get(self) -> str:
+        message = await self.queue.get()
+        if message is RESYNC:
+            self.overflowed = False
+        return message
+
+
+class EventBroker:
+    def __init__(self, queue_size: int = EVENTS_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: set[Subscriber] = set()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, lottery_id: int | None = None) -> Subscriber:
+        sub = Subscriber(asyncio.get_running_loop(), lottery_id, self.queue_size)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    @property
+    def client_count(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: str, data, lottery_id: int | None = None):
+        """Broadcast an event. Safe to call from sync handlers running in the threadpool."""
+        with self._lock:
+            if not self._subscribers:
+                return
+            subscribers = list(self._subscribers)
+            event_id = next(self._ids)
+        message = format_sse(event, data, event_id)
+        for sub in subscribers:
+            if not sub.wants(lottery_id):
+                continue
+            try:
+                sub.loop.call_soon_threadsafe(sub.offer, message)
+            except RuntimeError:
+                # event loop already closed
+                self.unsubscribe(sub)
+
+    async def stream(self, sub: Subscriber, is_disconnected):
+        """Yield SSE frames for one client until it disconnects."""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(sub.get(), timeout=EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield message
+        finally:
+            self.unsubscribe(sub)
+
+
+broker = EventBroker()
@@ -0,0 +1,93 @@
+"""Streaming CSV / NDJSON exports.
+
+Rows come from one plain column SELECT read through a server-side cursor
+in chunks of EXPORT_CHUNK_ROWS. Each chunk is encoded and handed to the
+response before the next one is fetched. Memory use therefore depends on
+the chunk size, not on the table size. With ``gzip`` the bytes are
+compressed on the fly into a single .gz member.
+
+The generators are synchronous: StreamingResponse runs them in the
+threadpool, so the blocking reads never stall the event loop.
+"""
+import csv
+import io
+import itertools
+import json
+import os
+import zlib
+from datetime import datetime
+from typing import Iterator, Literal
+
+from fastapi.responses import StreamingResponse
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "2000"))
+
+ExportFormat = Literal["csv", "ndjson"]
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def iter_chunks(session_factory, stmt, chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[list]:
+    """Yield lists of up to ``chunk_rows`` result rows of ``stmt``."""
+    db = session_factory()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=chunk_rows))
+        for chunk in result.partitions():
+            yield chunk
+    finally:
+        db.close()
+
+
+def encode_rows(columns: list[str], chunks: Iterator[list], fmt: ExportFormat) -> Iterator[bytes]:
+    if fmt == "ndjson":
+        for chunk in chunks:
+            yield "".join(
+                json.dumps(dict(zip(columns, map(_jsonable, row))), ensure_ascii=False) + "\n" for row in chunk
+            ).encode()
+        return
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns)
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()  # header only: no rows matched
+
+
+def gzip_stream(parts: Iterator[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for part in parts:
+        out = compressor.compress(part)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def export_stream(session_factory, stmt, fmt: ExportFormat = "csv", gzip: bool = False,
+                  more=None) -> Iterator[bytes]:
+    """The encoded bytes of ``stmt``'s rows, one piece per chunk.
+
+    ``more(columns)`` may return further chunks of rows (tuples in column
+    order) to append after the statement's, e.g. archived tickets.
+    """
+    columns = [c.name for c in stmt.selected_columns]
+    chunks = iter_chunks(session_factory, stmt)
+    if more is not None:
+        chunks = itertools.chain(chunks, more(columns))
+    body = encode_rows(columns, chunks, fmt)
+    return gzip_stream(body) if gzip else body
+
+
+def export_response(session_factory, stmt, name: str, fmt: ExportFormat = "csv",
+                    gzip: bool = False, more=None) -> StreamingResponse:
+    """Stream ``stmt`` as ``<name>.csv`` / ``<name>.ndjson``, optionally gzipped."""
+    filename = f"{name}.{fmt}" + (".gz" if gzip else "")
+    media_type = "application/gzip" if gzip else MEDIA_TYPES[fmt]
+    return StreamingResponse(export_stream(session_factory, stmt, fmt, gzip, more), media_type=media_type,
+                             headers={"Content-Disposition": f"attachment; filename={filename}"})
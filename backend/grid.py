@@ -0,0 +1,32 @@
+"""Compact encodings of a lottery's sold ticket numbers for the grid view.
+
+``ranges`` is a list of inclusive ``[first, last]`` runs. It suits a grid
+that fills up in sequence. ``bitmap`` packs one bit per number into
+``ceil(max_tickets / 8)`` bytes, deflates them and base64-encodes the
+result, so it stays small however scattered the sales are. Number ``n``
+is bit ``(n - 1) % 8`` (least significant first) of byte ``(n - 1) // 8``.
+To decode:
+    bits = inflate(base64decode(bitmap)); sold = bits[(n-1) >> 3] >> ((n-1) & 7) & 1
+"""
+import base64
+import zlib
+from typing import Iterable
+
+
+def to_ranges(numbers: Iterable[int]) -> list[list[int]]:
+    """Collapse ascending numbers into inclusive [first, last] runs."""
+    runs: list[list[int]] = []
+    for n in numbers:
+        if runs and n == runs[-1][1] + 1:
+            runs[-1][1] = n
+        else:
+            runs.append([n, n])
+    return runs
+
+
+def to_bitmap(numbers: Iterable[int], max_number: int) -> str:
+    bits = bytearray((max_number + 7) // 8)
+    for n in numbers:
+        if 1 <= n <= max_number:
+            bits[(n - 1) >> 3] |= 1 << ((n - 1) & 7)
+    return base64.b64encode(zlib.compress(bytes(bits), 9)).decode()
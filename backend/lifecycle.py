@@ -0,0 +1,185 @@
+"""Background lottery lifecycle: keeps lotteries open and closes them on a time limit.
+
+LifecycleScheduler calls run_once() every LIFECYCLE_INTERVAL_SECONDS. It
+also runs right away when woken after a draw, a manual finish or a delete.
+One pass does two things:
+  - Active lotteries older than LOTTERY_DURATION_HOURS are closed. If
+    tickets were sold, a forced draw is queued, as POST /lotteries/{id}/draw
+    would. If nobody bought in, a lottery the scheduler opened itself is
+    deleted; an empty one an admin created stays open.
+  - New lotteries are opened until LOTTERY_ACTIVE_COUNT are active. Each
+    comes from the LOTTERY_TEMPLATES entry with the fewest active
+    lotteries. It is named "Лотерея #N", where N is taken from the
+    LOTTERY_SEQ counter (db.next_sequence).
+Passes from all workers are serialized by migration_lock, so two of them
+never both see the same free slot. Read endpoints never create lotteries.
+"""
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from sqlalchemy import delete, exists, func, or_, select
+
+from db import DrawJob, Lottery, bump_version, delete_lottery_rows, next_sequence
+from draws import enqueue_draw
+from migrations import migration_lock
+
+ACTIVE_LOTTERIES = int(os.getenv("LOTTERY_ACTIVE_COUNT", "1"))  # 0: only admins open lotteries
+LOTTERY_TEMPLATES = os.getenv("LOTTERY_TEMPLATES", "1:100")  # price:max_tickets, comma-separated
+LOTTERY_DURATION_HOURS = float(os.getenv("LOTTERY_DURATION_HOURS", "0"))  # 0: no time limit
+LIFECYCLE_INTERVAL_SECONDS = float(os.getenv("LIFECYCLE_INTERVAL_SECONDS", "30"))
+AUTO_LOTTERY_PREFIX = "Лотерея #"
+
+
+class LotteryTemplate(NamedTuple):
+    ticket_price: int
+    max_tickets: int
+
+
+def parse_templates(spec: str) -> list[LotteryTemplate]:
+    """``"1:100,5:50"`` -> [LotteryTemplate(1, 100), LotteryTemplate(5, 50)]."""
+    templates = []
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        price, _, max_tickets = item.partition(":")
+        template = LotteryTemplate(int(price), int(max_tickets))
+        if template.ticket_price < 1 or template.max_tickets < 1:
+            raise ValueError(f"Bad lottery template {item!r}")
+        templates.append(template)
+    if not templates:
+        raise ValueError("LOTTERY_TEMPLATES is empty")
+    return templates
+
+
+def expire_lotteries(db, max_age: timedelta) -> tuple[list[int], list[int]]:
+    """Close active lotteries older than ``max_age``; returns (drawn, deleted) ids. The caller commits.
+
+    Only lotteries opened by open_lotteries() are deleted when empty.
+    """
+    expired = db.execute(
+        select(Lottery.id, Lottery.tickets_sold)
+        .where(Lottery.winner_id == None, Lottery.created_at < datetime.utcnow() - max_age)
+        .where(or_(Lottery.tickets_sold > 0, Lottery.auto_opened == 1))
+        .where(~exists().where(DrawJob.lottery_id == Lottery.id))
+    ).all()
+    drawn, deleted = [], []
+    for lottery_id, sold in expired:
+        if sold:
+            enqueue_draw(db, lottery_id, force=True)
+            drawn.append(lottery_id)
+            continue
+        # a purchase committed meanwhile keeps the lottery alive
+        gone = db.execute(
+            delete(Lottery).where(Lottery.id == lottery_id, Lottery.tickets_sold == 0, Lottery.auto_opened == 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if gone:
+            delete_lottery_rows(db, lottery_id)
+            bump_version(db, lottery_id)
+            deleted.append(lottery_id)
+    return drawn, deleted
+
+
+def open_lotteries(db, target: int, templates: list[LotteryTemplate]) -> list[Lottery]:
+    """Open lotteries until ``target`` are active; the caller commits."""
+    active = Counter({(price, max_tickets): n for price, max_tickets, n in db.execute(
+        select(Lottery.ticket_price, Lottery.max_tickets, func.count())
+        .where(Lottery.winner_id == None)
+        .group_by(Lottery.ticket_price, Lottery.max_tickets)
+    )})
+    created = []
+    for _ in range(target - sum(active.values())):
+        template = min(templates, key=lambda t: active[t])
+        active[template] += 1
+        lottery = Lottery(
+            name=f"{AUTO_LOTTERY_PREFIX}{next_sequence(db)}",
+            ticket_price=template.ticket_price,
+            max_tickets=template.max_tickets,
+            tickets_sold=0,
+            created_at=datetime.utcnow(),
+            auto_opened=1,
+        )
+        db.add(lottery)
+        db.flush()
+        bump_version(db, lottery.id)
+        created.append(lottery)
+    return created
+
+
+class LifecycleScheduler:
+    """Runs the lifecycle pass in the background; several workers may run at once."""
+
+    def __init__(self, session_factory, engine, on_opened=None, on_deleted=None, on_draw_queued=None,
+                 target: int = ACTIVE_LOTTERIES, templates: str = LOTTERY_TEMPLATES,
+                 duration_hours: float = LOTTERY_DURATION_HOURS, interval: float = LIFECYCLE_INTERVAL_SECONDS):
+        # on_opened(lottery) / on_deleted(lottery_id) / on_draw_queued(lottery_id) run after the commit
+        self.session_factory = session_factory
+        self.engine = engine
+        self.on_opened = on_opened
+        self.on_deleted = on_deleted
+        self.on_draw_queued = on_draw_queued
+        self.target = target
+        self.templates = parse_templates(templates)
+        self.max_age = timedelta(hours=duration_hours) if duration_hours > 0 else None
+        self.interval = interval
+        self._loop = None
+        self._wake = None
+        self._task = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def wake(self):
+        """Run a pass now instead of at the next interval; thread-safe."""
+        if self._loop and self._wake:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass
+
+    async def run(self):
+        # the lifespan has already run the first pass
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await asyncio.to_thread(self.run_once)
+            except Exception as ex:
+                print("Lifecycle scheduler error:", ex)
+
+    def run_once(self) -> dict:
+        with migration_lock(self.engine):
+            db = self.session_factory()
+            try:
+                drawn, deleted = expire_lotteries(db, self.max_age) if self.max_age else ([], [])
+                opened = open_lotteries(db, self.target, self.templates) if self.target > 0 else []
+                db.commit()
+                for lottery_id in drawn:
+                    print(f"Lottery {lottery_id} reached its time limit; draw queued")
+                    if self.on_draw_queued:
+                        self.on_draw_queued(lottery_id)
+                for lottery_id in deleted:
+                    print(f"Lottery {lottery_id} reached its time limit with no tickets; deleted")
+                    if self.on_deleted:
+                        self.on_deleted(lottery_id)
+                for lottery in opened:
+                    print(f"Opened lottery {lottery.id} '{lottery.name}'")
+                    if self.on_opened:
+                        self.on_opened(lottery)
+                return {"drawn": drawn, "deleted": deleted, "opened": [lottery.id for lottery in opened]}
+            finally:
+                db.close()
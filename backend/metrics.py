@@ -0,0 +1,254 @@
+"""In-process metrics in the Prometheus text format, served at /metrics.
+
+Recorded on the hot path (one dict lookup, a bisect and a few additions each):
+  http_requests_total, http_request_duration_seconds
+      per method and route template (``/lotteries/{lottery_id}/buy``, not the
+      raw path), from MetricsMiddleware. The error rate is the
+      ``status=~"5.."`` share; unhandled exceptions count as 500.
+  http_request_db_queries
+      statements per request and route (db.count_queries). The count and DB
+      time also go out as X-DB-Queries / X-DB-Time-Ms response headers,
+      unless QUERY_STATS_HEADERS=0. For streamed bodies they cover the
+      statements run before the headers were sent.
+  outbound_request_duration_seconds, outbound_requests_total
+      every attempt to CoinGecko, tonapi, random.org, is.gd and Telegram,
+      from OutboundHTTP.observers
+  db_pool_checkout_seconds
+      time spent in pool.connect() per engine, from db.checkout_observers
+Read when scraped:
+  http_requests_in_progress, threadpool_* (AnyIO's default limiter, which
+  runs the sync endpoints and run_in_threadpool), db_pool_* and
+  outbound_circuit_open.
+
+Values are per process; with several uvicorn workers each one is scraped
+separately.
+"""
+import bisect
+import os
+import threading
+import time
+
+import anyio.to_thread
+
+import db
+from db import count_queries
+from outbound import get_outbound
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+OUTBOUND_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+POOL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+QUERY_STATS_HEADERS = os.getenv("QUERY_STATS_HEADERS", "1") != "0"
+QUERY_COUNT_HEADER = "X-DB-Queries"
+QUERY_TIME_HEADER = "X-DB-Time-Ms"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # optional callable returning [(label values, value)], read at scrape time
+        self.collect = collect
+        self.values: dict = {}
+        self.lock = threading.Lock()
+
+    def samples(self):
+        if self.collect is not None:
+            return list(self.collect())
+        with self.lock:
+            return list(self.values.items())
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.samples():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def add(self, amount: float, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=HTTP_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                # per-bucket counts (the last one is +Inf), then the sum
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+# ---- Collectors read at scrape time ----
+
+def _threadpool(attribute: str):
+    def collect():
+        limiter = anyio.to_thread.current_default_thread_limiter()
+        if attribute == "waiting":
+            return [((), limiter.statistics().tasks_waiting)]
+        return [((), getattr(limiter, attribute))]
+    return collect
+
+
+def _engines():
+    engines = [("sync", db.engine)]
+    if db.async_engine is not None:
+        engines.append(("async", db.async_engine.sync_engine))
+    return [(name, eng.pool) for name, eng in engines if isinstance(eng.pool, db.QueuePool)]
+
+
+def _pool(method: str):
+    return lambda: [((name,), getattr(pool, method)()) for name, pool in _engines()]
+
+
+def _circuits():
+    breakers = get_outbound().breakers
+    return [((name,), int(breaker.state != "closed")) for name, breaker in breakers.items()]
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route template and status.",
+                        ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency, until the last body chunk is sent.",
+                         ("method", "route"), HTTP_BUCKETS)
+HTTP_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being served.")
+HTTP_DB_QUERIES = Histogram("http_request_db_queries", "SQL statements per HTTP request.",
+                            ("method", "route"), QUERY_BUCKETS)
+OUTBOUND_REQUESTS = Counter("outbound_requests_total", "Outbound HTTP attempts by upstream and outcome.",
+                            ("upstream", "outcome"))
+OUTBOUND_LATENCY = Histogram("outbound_request_duration_seconds", "Outbound HTTP attempt latency.",
+                             ("upstream",), OUTBOUND_BUCKETS)
+POOL_CHECKOUT = Histogram("db_pool_checkout_seconds", "Time to check a connection out of the DB pool.",
+                          ("engine",), POOL_BUCKETS)
+
+registry: list[Metric] = [
+    HTTP_REQUESTS,
+    HTTP_LATENCY,
+    HTTP_IN_PROGRESS,
+    HTTP_DB_QUERIES,
+    OUTBOUND_REQUESTS,
+    OUTBOUND_LATENCY,
+    Gauge("outbound_circuit_open", "1 while the upstream's circuit breaker is open or half-open.",
+          ("upstream",), collect=_circuits),
+    Gauge("threadpool_threads_limit", "Worker threads AnyIO may run at once.", collect=_threadpool("total_tokens")),
+    Gauge("threadpool_threads_busy", "Worker threads currently running sync code.",
+          collect=_threadpool("borrowed_tokens")),
+    Gauge("threadpool_tasks_waiting", "Calls queued for a free worker thread.", collect=_threadpool("waiting")),
+    POOL_CHECKOUT,
+    Gauge("db_pool_size", "Configured DB pool size.", ("engine",), collect=_pool("size")),
+    Gauge("db_pool_checked_out", "DB connections currently in use.", ("engine",), collect=_pool("checkedout")),
+    Gauge("db_pool_overflow", "DB connections open beyond the pool size (negative: unused slots).",
+          ("engine",), collect=_pool("overflow")),
+]
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---- Feeds ----
+
+def observe_outbound(upstream: str, seconds: float, status: int | None, error: str | None):
+    OUTBOUND_LATENCY.observe(seconds, upstream)
+    OUTBOUND_REQUESTS.inc(upstream, str(status) if status is not None else "error")
+
+
+def observe_checkout(pool_name: str, seconds: float):
+    POOL_CHECKOUT.observe(seconds, pool_name)
+
+
+def _route_template(scope) -> str:
+    # the router stores the matched route in the scope; unmatched paths share one label
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: counts and times each HTTP request, and its SQL, by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+        method = scope["method"]
+
+        with count_queries(lambda: f"{method} {_route_template(scope)}") as queries:
+            async def send_with_status(message):
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    if QUERY_STATS_HEADERS:
+                        message = {**message, "headers": [
+                            *message.get("headers", ()),
+                            (QUERY_COUNT_HEADER.lower().encode(), str(queries.count).encode()),
+                            (QUERY_TIME_HEADER.lower().encode(), f"{queries.seconds * 1000:.1f}".encode()),
+                        ]}
+                await send(message)
+
+            started = time.perf_counter()
+            HTTP_IN_PROGRESS.add(1)
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                HTTP_IN_PROGRESS.add(-1)
+                template = _route_template(scope)
+                HTTP_LATENCY.observe(time.perf_counter() - started, method, template)
+                HTTP_REQUESTS.inc(method, template, str(status))
+                HTTP_DB_QUERIES.observe(queries.count, method, template)
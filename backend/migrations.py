@@ -0,0 +1,278 @@
+"""Versioned schema migrations.
+
+The applied version lives in the ``schema_version`` table. A fresh
+database is built from the models by ``create_all`` and stamped with the
+latest version. An existing database runs only the migrations it has not
+recorded yet, each in its own transaction, so a boot with nothing to do
+costs a single SELECT. Workers booting side by side take
+``migration_lock`` before changing anything, and the first one does the
+work.
+
+To change the schema, update the model in db.py, then append a
+``(version, description, function)`` entry to MIGRATIONS that brings an
+existing database to the same shape. Use the ``add_column`` /
+``create_index`` helpers, because they are no-ops when the change is
+already there.
+"""
+import contextlib
+import os
+import re
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+
+import db as models
+from archive import unpack
+
+schema_version = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+
+def add_column(conn, model, name: str) -> bool:
+    """ALTER TABLE ... ADD COLUMN for a model column missing in the database."""
+    table = model.__table__
+    if name in {c["name"] for c in inspect(conn).get_columns(table.name)}:
+        return False
+    column = table.c[name]
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {name} {column.type.compile(dialect=conn.dialect)}"
+    if column.default is not None and column.default.is_scalar:
+        ddl += f" DEFAULT {column.default.arg!r}"
+    conn.execute(text(ddl))
+    return True
+
+
+def create_index(conn, model, name: str) -> bool:
+    """Create one of the model's declared indexes if the database lacks it."""
+    table = model.__table__
+    if name in {i["name"] for i in inspect(conn).get_indexes(table.name)}:
+        return False
+    index = next(i for i in table.indexes if i.name == name)
+    index.create(conn)
+    return True
+
+
+def _legacy_columns(conn):
+    """Columns the old auto_migrate_tickets_table used to patch in."""
+    for name in ("username", "first_name", "last_name"):
+        add_column(conn, models.Ticket, name)
+    add_column(conn, models.User, "ton_wallet_address")
+    for name in ("code", "created_at", "finished_at", "prize_ton", "version"):
+        add_column(conn, models.Lottery, name)
+    summary = [add_column(conn, models.Lottery, name) for name in
+               ("participants_count", "revenue", "winner_username", "winner_first_name", "winner_last_name")]
+    if any(summary):
+        # the backfill reads ticket names, so it runs after the ticket columns exist
+        for stmt in models.LOTTERY_SUMMARY_SQL:
+            conn.execute(text(stmt))
+
+
+def _unique_ticket_number(conn):
+    """One ticket number per lottery (tables created before the constraint existed)."""
+    insp = inspect(conn)
+    unique_sets = [sorted(i["column_names"]) for i in insp.get_indexes("tickets") if i["unique"]]
+    unique_sets += [sorted(u["column_names"]) for u in insp.get_unique_constraints("tickets")]
+    if ["lottery_id", "ticket_number"] in unique_sets:
+        return
+    duplicate = conn.execute(text(
+        "SELECT lottery_id, ticket_number FROM tickets GROUP BY lottery_id, ticket_number HAVING COUNT(*) > 1 LIMIT 1"
+    )).first()
+    if duplicate:
+        # recorded anyway: re-running cannot fix the data, remove the duplicates and add the index by hand
+        print("Cannot add unique (lottery_id, ticket_number), duplicate tickets present:", tuple(duplicate))
+        return
+    conn.execute(text("CREATE UNIQUE INDEX uq_tickets_lottery_number ON tickets (lottery_id, ticket_number)"))
+
+
+def _hot_path_indexes(conn):
+    create_index(conn, models.Ticket, "ix_tickets_lottery_user")
+    create_index(conn, models.Ticket, "ix_tickets_user_lottery")
+    create_index(conn, models.Lottery, "ix_lotteries_winner_id")
+    # workers read their claimed batch back by token
+    create_index(conn, models.NotificationOutbox, "ix_notification_outbox_claim_token")
+    create_index(conn, models.DrawJob, "ix_draw_jobs_claim_token")
+
+
+def _history_keyset(conn):
+    if conn.dialect.name == "sqlite":
+        # rows stamped by CURRENT_TIMESTAMP lack the microseconds SQLAlchemy
+        # writes; keyset comparisons need one text format for finished_at
+        conn.execute(text(
+            "UPDATE lotteries SET finished_at = strftime('%Y-%m-%d %H:%M:%f', finished_at) || '000' "
+            "WHERE length(finished_at) = 19"
+        ))
+    create_index(conn, models.Lottery, "ix_lotteries_finished_at_id")
+
+
+def _lottery_dates(conn):
+    """Backfill created_at / finished_at; this used to run on every startup."""
+    conn.execute(
+        models.Lottery.__table__.update().where(models.Lottery.created_at == None)
+        .values(created_at=datetime.utcnow())
+    )
+    conn.execute(
+        models.Lottery.__table__.update()
+        .where(models.Lottery.winner_id != None, models.Lottery.finished_at == None)
+        .values(finished_at=datetime.utcnow())
+    )
+
+
+def _ticket_created_at(conn):
+    # a Python-side default: SQLite cannot ADD COLUMN with CURRENT_TIMESTAMP
+    add_column(conn, models.Ticket, "created_at")
+
+
+def _ticket_archive(conn):
+    tables = [models.TicketArchive.__table__, models.ArchivedUserTickets.__table__]
+    models.Base.metadata.create_all(bind=conn, tables=tables)
+
+
+def _lottery_sequence(conn):
+    """Seed the LOTTERY_SEQ counter past the highest "Лотерея #N"; the last scan of the names."""
+    from lifecycle import AUTO_LOTTERY_PREFIX  # lifecycle imports this module
+    pattern = re.compile(re.escape(AUTO_LOTTERY_PREFIX) + r"(?P<num>\d+)$")
+    lotteries, settings = models.Lottery.__table__, models.Setting.__table__
+    last = 0
+    for (name,) in conn.execute(select(lotteries.c.name).where(lotteries.c.name.like(AUTO_LOTTERY_PREFIX + "%"))):
+        m = pattern.match(name)
+        if m:
+            last = max(last, int(m.group("num")))
+    current = conn.execute(select(settings.c.value).where(settings.c.key == models.LOTTERY_SEQ_KEY)).scalar()
+    if current is None:
+        conn.execute(settings.insert().values(key=models.LOTTERY_SEQ_KEY, value=str(last)))
+    elif int(current) < last:
+        conn.execute(settings.update().where(settings.c.key == models.LOTTERY_SEQ_KEY).values(value=str(last)))
+
+
+def _drop_draw_job_winner_index(conn):
+    """Fresh databases built before version 9 got an index on draw_jobs.winner_id that nothing reads."""
+    if "ix_draw_jobs_winner_id" in {i["name"] for i in inspect(conn).get_indexes("draw_jobs")}:
+        conn.execute(text("DROP INDEX ix_draw_jobs_winner_id"))
+
+
+
+def _ticket_ids_autoincrement(conn):
+    """Rebuild tickets with AUTOINCREMENT so SQLite stops reusing the ids of archived tickets."""
+    if conn.dialect.name != "sqlite":
+        return  # sequences never hand out an id twice
+    ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'tickets'")).scalar()
+    if "AUTOINCREMENT" not in ddl.upper():
+        for index in inspect(conn).get_indexes("tickets"):
+            conn.execute(text(f"DROP INDEX {index['name']}"))
+        conn.execute(text("ALTER TABLE tickets RENAME TO tickets_old"))
+        models.Ticket.__table__.create(conn)
+        old_columns = {c["name"] for c in inspect(conn).get_columns("tickets_old")}
+        columns = ", ".join(c.name for c in models.Ticket.__table__.columns if c.name in old_columns)
+        conn.execute(text(f"INSERT INTO tickets ({columns}) SELECT {columns} FROM tickets_old"))
+        conn.execute(text("DROP TABLE tickets_old"))
+    # the counter starts past every id handed out so far, archived ones included
+    last = conn.execute(select(func.max(models.Ticket.id))).scalar() or 0
+    for lottery_id, data in conn.execute(select(models.TicketArchive.lottery_id, models.TicketArchive.data)):
+        last = max([last] + [row.id for row in unpack(lottery_id, data)])
+    seq = conn.execute(text("SELECT seq FROM sqlite_sequence WHERE name = 'tickets'")).scalar()
+    if seq is None:
+        conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('tickets', :last)"), {"last": last})
+    elif seq < last:
+        conn.execute(text("UPDATE sqlite_sequence SET seq = :last WHERE name = 'tickets'"), {"last": last})
+
+
+def _lottery_auto_opened(conn):
+    # existing rows default to 0: a lottery is only deleted on expiry when we know the scheduler opened it
+    add_column(conn, models.Lottery, "auto_opened")
+
+
+MIGRATIONS = [
+    (1, "columns added by the old auto_migrate_tickets_table", _legacy_columns),
+    (2, "unique (lottery_id, ticket_number) on tickets", _unique_ticket_number),
+    (3, "indexes for tickets by lottery/user, open lotteries and claimed queue rows", _hot_path_indexes),
+    (4, "keyset index for finished lotteries by (finished_at, id)", _history_keyset),
+    (5, "purchase time on tickets", _ticket_created_at),
+    (6, "backfill missing lottery created_at / finished_at", _lottery_dates),
+    (7, "cold archive tables for finished lotteries' tickets", _ticket_archive),
+    (8, "LOTTERY_SEQ counter for auto-named lotteries", _lottery_sequence),
+    (9, "drop the unused index on draw_jobs.winner_id", _drop_draw_job_winner_index),
+    (10, "AUTOINCREMENT ticket ids, past the archived ones", _ticket_ids_autoincrement),
+    (11, "lotteries.auto_opened marks lotteries the scheduler may delete", _lottery_auto_opened),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn) -> int:
+    if not inspect(conn).has_table("schema_version"):
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+MIGRATION_LOCK_ID = 0x4C4F54  # pg_advisory_lock key, any constant shared by all workers
+
+
+@contextlib.contextmanager
+def migration_lock(engine):
+    """Serialize schema changes and other boot-time setup between processes sharing the database.
+
+    Not re-entrant: do not nest it, and do not call migrate() while holding it.
+    """
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_ID})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_ID})
+        return
+    path = engine.url.database if engine.dialect.name == "sqlite" else None
+    try:
+        import fcntl
+    except ImportError:  # Windows: single-process development only
+        fcntl = None
+    if not path or path == ":memory:" or fcntl is None:
+        yield
+        return
+    with open(os.path.abspath(path) + ".migrate-lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def migrate(engine) -> int:
+    """Bring the database to LATEST_VERSION; returns the number of migrations applied."""
+    with engine.connect() as conn:
+        if current_version(conn) >= LATEST_VERSION:
+            return 0
+    with migration_lock(engine):
+        return _migrate_locked(engine)
+
+
+def _migrate_locked(engine) -> int:
+    with engine.connect() as conn:
+        # another worker may have finished while we waited for the lock
+        version = current_version(conn)
+        if version >= LATEST_VERSION:
+            return 0
+        fresh = not inspect(conn).has_table("lotteries")
+    models.Base.metadata.create_all(bind=engine)
+    schema_version.create(bind=engine, checkfirst=True)
+    if fresh:
+        # create_all already built the latest schema
+        with engine.begin() as conn:
+            conn.execute(schema_version.insert(), [{"version": v, "description": d} for v, d, _ in MIGRATIONS])
+        return 0
+    applied = 0
+    for v, description, apply in MIGRATIONS:
+        if v <= version:
+            continue
+        with engine.begin() as conn:
+            if conn.dialect.name == "sqlite":
+                # pysqlite only opens a transaction before DML; without this, DDL
+                # autocommits and a failed migration would be left half-applied
+                conn.exec_driver_sql("BEGIN")
+            apply(conn)
+            conn.execute(schema_version.insert().values(version=v, description=description))
+        print(f"Applied migration {v}: {description}")
+        applied += 1
+    return applied
@@ -0,0 +1,232 @@
+"""Telegram notifications through a persistent outbox.
+
+The draw writes its messages to ``notification_outbox`` in the same
+transaction as the draw. OutboxDispatcher drains the table in the
+background: bounded concurrency, one global token bucket for the Bot API
+rate limit, retries with backoff on 429/5xx and exactly-once claiming of
+rows, so several app workers can run a dispatcher side by side.
+"""
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from db import NotificationOutbox, claim_batch
+from outbound import OutboundHTTP, UpstreamError
+
+NOTIFY_RATE_PER_SEC = float(os.getenv("NOTIFY_RATE_PER_SEC", "25"))
+NOTIFY_CONCURRENCY = int(os.getenv("NOTIFY_CONCURRENCY", "8"))
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", "8"))
+NOTIFY_BATCH_SIZE = 100
+NOTIFY_IDLE_SECONDS = 2.0
+NOTIFY_LEASE_SECONDS = 120
+NOTIFY_BACKOFF_BASE = 1.0
+NOTIFY_BACKOFF_MAX = 300.0
+
+
+def enqueue_notifications(db, messages: list[dict]) -> int:
+    """Add messages to the outbox in the caller's transaction.
+
+    Each message is a dict with dedup_key, chat_id, text and optionally
+    lottery_id / parse_mode. Keys that are already queued are skipped.
+    """
+    if not messages:
+        return 0
+    keys = [m["dedup_key"] for m in messages]
+    existing = {k for (k,) in db.query(NotificationOutbox.dedup_key).filter(NotificationOutbox.dedup_key.in_(keys))}
+    added = 0
+    for m in messages:
+        if m["dedup_key"] in existing:
+            continue
+        existing.add(m["dedup_key"])
+        db.add(NotificationOutbox(
+            dedup_key=m["dedup_key"],
+            lottery_id=m.get("lottery_id"),
+            chat_id=str(m["chat_id"]),
+            text=m["text"],
+            parse_mode=m.get("parse_mode", "HTML"),
+            status="pending",
+            attempts=0,
+            next_attempt_at=datetime.utcnow(),
+        ))
+        added += 1
+    return added
+
+
+class TokenBucket:
+    """Async token bucket shared by all senders; pause() honours 429 retry_after."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        # refill from the end of the pause, not across it
+        self.updated = self.blocked_until
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboxDispatcher:
+    def __init__(self, session_factory, bot_token: str, http: OutboundHTTP,
+                 rate: float = NOTIFY_RATE_PER_SEC, concurrency: int = NOTIFY_CONCURRENCY,
+                 max_attempts: int = NOTIFY_MAX_ATTEMPTS):
+        self.session_factory = session_factory
+        self.bot_token = bot_token
+        self.http = http
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.bucket = TokenBucket(rate)
+        self.stats = {"sent": 0, "retried": 0, "failed": 0}
+        self._loop = None
+        self._wake = None
+        self._task = None
+
+    # ---- lifecycle ----
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def wake(self):
+        """Start draining now instead of at the next idle tick; thread-safe."""
+        if self._loop and self._wake:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:
+                pass
+
+    async def run(self):
+        while True:
+            try:
+                handled = await self.drain_once()
+            except Exception as ex:
+                print("Notifier error:", ex)
+                handled = 0
+            if not handled:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), NOTIFY_IDLE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def drain_once(self) -> int:
+        """Claim one batch of due messages and deliver it; returns the batch size."""
+        rows = await asyncio.to_thread(self._claim)
+        if not rows:
+            return 0
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def deliver(row):
+            async with sem:
+                await self.bucket.acquire()
+                await self._deliver(row)
+
+        await asyncio.gather(*(deliver(r) for r in rows))
+        return len(rows)
+
+    # ---- delivery ----
+    async def _deliver(self, row: dict):
+        payload = {"chat_id": row["chat_id"], "text": row["text"]}
+        if row["parse_mode"]:
+            payload["parse_mode"] = row["parse_mode"]
+        try:
+            resp = await self.http.request("telegram", "POST", f"/bot{self.bot_token}/sendMessage", json=payload)
+        except UpstreamError as ex:
+            # network error or open circuit breaker
+            await asyncio.to_thread(self._retry_later, row, str(ex), None)
+            return
+        if resp.status_code == 200:
+            await asyncio.to_thread(self._finish, row, "sent", None)
+        elif resp.status_code == 429:
+            try:
+                retry_after = float(resp.json().get("parameters", {}).get("retry_after", 1))
+            except ValueError:
+                retry_after = 1.0
+            # the limit is global for the bot, so every sender waits
+            self.bucket.pause(retry_after)
+            await asyncio.to_thread(self._retry_later, row, "429 Too Many Requests", retry_after)
+        elif resp.status_code >= 500:
+            await asyncio.to_thread(self._retry_later, row, f"{resp.status_code}: {resp.text[:200]}", None)
+        else:
+            # 400 chat not found, 403 bot blocked by user, ... — retrying will not help
+            await asyncio.to_thread(self._finish, row, "failed", f"{resp.status_code}: {resp.text[:200]}")
+
+    # ---- outbox bookkeeping (run in threads) ----
+    def _claim(self) -> list[dict]:
+        db = self.session_factory()
+        try:
+            token = claim_batch(db, NotificationOutbox, [NotificationOutbox.status == "pending"],
+                                NOTIFY_BATCH_SIZE, NOTIFY_LEASE_SECONDS)
+            rows = db.query(
+                NotificationOutbox.id, NotificationOutbox.chat_id, NotificationOutbox.text,
+                NotificationOutbox.parse_mode, NotificationOutbox.attempts,
+            ).filter(NotificationOutbox.claim_token == token).all()
+            return [{"id": r.id, "chat_id": r.chat_id, "text": r.text, "parse_mode": r.parse_mode,
+                     "attempts": r.attempts, "token": token} for r in rows]
+        finally:
+            db.close()
+
+    def _finish(self, row: dict, status: str, error: str | None, next_attempt_at: datetime | None = None):
+        values = {
+            "status": status,
+            "attempts": NotificationOutbox.attempts + 1,
+            "claim_token": None,
+            "locked_until": None,
+            "last_error": error,
+        }
+        if status == "sent":
+            values["sent_at"] = datetime.utcnow()
+        if next_attempt_at is not None:
+            values["next_attempt_at"] = next_attempt_at
+        db = self.session_factory()
+        try:
+            db.execute(
+                update(NotificationOutbox)
+                .where(NotificationOutbox.id == row["id"], NotificationOutbox.claim_token == row["token"])
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        finally:
+            db.close()
+        key = {"sent": "sent", "failed": "failed", "pending": "retried"}[status]
+        self.stats[key] += 1
+
+    def _retry_later(self, row: dict, error: str, delay: float | None):
+        if row["attempts"] + 1 >= self.max_attempts:
+            self._finish(row, "failed", error)
+            return
+        if delay is None:
+            delay = min(NOTIFY_BACKOFF_BASE * 2 ** row["attempts"], NOTIFY_BACKOFF_MAX)
+            delay *= 0.5 + random.random() / 2
+        self._finish(row, "pending", error, datetime.utcnow() + timedelta(seconds=delay))
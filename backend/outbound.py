@@ -0,0 +1,219 @@
+"""Shared outbound HTTP layer for CoinGecko, tonapi.io, random.org, is.gd and Telegram.
+
+One ``OutboundHTTP`` is created on app startup. It keeps one pooled
+``httpx.AsyncClient`` per upstream, with keep-alive and HTTP/2 when ``h2``
+is installed and the host negotiates it. Every upstream has its own
+timeouts, retry policy and circuit breaker, plus latency/error counters
+exposed through ``snapshot()``. Callables in ``observers`` see every
+attempt as well (metrics.py feeds /metrics from them).
+
+Base URLs can be overridden with environment variables (e.g. pointing
+them at scripts/stub_upstreams.py). Tests can also pass an httpx transport
+such as ``httpx.MockTransport`` to replace the network entirely.
+"""
+import asyncio
+import importlib.util
+import os
+import random
+import time
+
+import httpx
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class UpstreamError(Exception):
+    def __init__(self, upstream: str, message: str):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class Upstream:
+    """Static settings of one integration."""
+
+    def __init__(self, name: str, base_url: str, timeout: float = 5.0, connect_timeout: float = 3.0,
+                 retries: int = 1, max_connections: int = 10, failure_threshold: int = 5,
+                 reset_timeout: float = 30.0):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.max_connections = max_connections
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+
+def default_upstreams() -> dict[str, Upstream]:
+    return {u.name: u for u in [
+        Upstream("coingecko", os.getenv("COINGECKO_API_URL", "https://api.coingecko.com/api/v3"), timeout=5, retries=1),
+        Upstream("tonapi", os.getenv("TONAPI_URL", "https://tonapi.io/v2"), timeout=5, retries=1),
+        # generateSignedIntegers is not idempotent, never replay it
+        Upstream("random_org", os.getenv("RANDOM_ORG_URL", "https://api.random.org/json-rpc/4"), timeout=10, retries=0),
+        Upstream("isgd", os.getenv("ISGD_URL", "https://is.gd"), timeout=5, retries=1),
+        # the notification dispatcher has its own retry/backoff
+        Upstream("telegram", os.getenv("TELEGRAM_API_URL", "https://api.telegram.org"), timeout=10, retries=0,
+                 max_connections=int(os.getenv("NOTIFY_CONCURRENCY", "8")), failure_threshold=20, reset_timeout=10),
+    ]}
+
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half-open after reset_timeout."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold or self.state == "half-open":
+            self.opened_at = time.monotonic()
+
+
+class UpstreamStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.status_counts: dict[int, int] = {}
+        self.last_error: str | None = None
+
+    def observe(self, seconds: float, status: int | None, error: str | None = None):
+        self.requests += 1
+        self.latency_total += seconds
+        self.latency_max = max(self.latency_max, seconds)
+        if status is not None:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if error:
+            self.errors += 1
+            self.last_error = error
+
+
+class OutboundHTTP:
+    def __init__(self, upstreams: dict[str, Upstream] | None = None, transport: httpx.AsyncBaseTransport | None = None):
+        self.upstreams = upstreams or default_upstreams()
+        self.transport = transport
+        self.clients: dict[str, httpx.AsyncClient] = {}
+        self.breakers = {n: CircuitBreaker(u.failure_threshold, u.reset_timeout) for n, u in self.upstreams.items()}
+        self.stats = {n: UpstreamStats() for n in self.upstreams}
+        # called with (upstream, seconds, status, error) after every attempt
+        self.observers: list = []
+
+    def _client(self, name: str) -> httpx.AsyncClient:
+        client = self.clients.get(name)
+        if client is None:
+            u = self.upstreams[name]
+            client = httpx.AsyncClient(
+                base_url=u.base_url,
+                timeout=httpx.Timeout(u.timeout, connect=u.connect_timeout),
+                limits=httpx.Limits(max_connections=u.max_connections, max_keepalive_connections=u.max_connections),
+                http2=HTTP2_AVAILABLE and self.transport is None,
+                transport=self.transport,
+            )
+            self.clients[name] = client
+        return client
+
+    async def aclose(self):
+        clients, self.clients = self.clients, {}
+        await asyncio.gather(*(c.aclose() for c in clients.values()), return_exceptions=True)
+
+    async def request(self, upstream: str, method: str, url: str, retries: int | None = None, **kwargs) -> httpx.Response:
+        """Send a request to an upstream; retries transport errors, 429 and 5xx.
+
+        Returns the last response (which may still be an error status).
+        Raises CircuitOpenError while the upstream's breaker is open, and
+        UpstreamError when every attempt failed at the transport level.
+        """
+        u = self.upstreams[upstream]
+        breaker = self.breakers[upstream]
+        stats = self.stats[upstream]
+        if not breaker.allow():
+            stats.rejected += 1
+            raise CircuitOpenError(upstream, "circuit open")
+        attempts = 1 + (u.retries if retries is None else retries)
+        client = self._client(upstream)
+        for attempt in range(attempts):
+            started = time.perf_counter()
+            try:
+                resp = await client.request(method, url, **kwargs)
+            except httpx.HTTPError as ex:
+                self._observe(upstream, time.perf_counter() - started, None, f"{type(ex).__name__}: {ex}")
+                breaker.failure()
+                if attempt + 1 >= attempts or not breaker.allow():
+                    raise UpstreamError(upstream, f"{type(ex).__name__}: {ex}") from ex
+            else:
+                failed = resp.status_code == 429 or resp.status_code >= 500
+                self._observe(upstream, time.perf_counter() - started, resp.status_code,
+                              f"HTTP {resp.status_code}" if failed else None)
+                if not failed:
+                    breaker.success()
+                    return resp
+                breaker.failure()
+                if attempt + 1 >= attempts or not breaker.allow():
+                    return resp
+            stats.retries += 1
+            await asyncio.sleep(min(0.2 * 2 ** attempt, 2.0) * (0.5 + random.random() / 2))
+        raise UpstreamError(upstream, "no attempts made")
+
+    def _observe(self, upstream: str, seconds: float, status: int | None, error: str | None):
+        self.stats[upstream].observe(seconds, status, error)
+        for observer in self.observers:
+            observer(upstream, seconds, status, error)
+
+    def snapshot(self) -> dict:
+        out = {}
+        for name, s in self.stats.items():
+            out[name] = {
+                "base_url": self.upstreams[name].base_url,
+                "circuit": self.breakers[name].state,
+                "requests": s.requests,
+                "errors": s.errors,
+                "retries": s.retries,
+                "rejected_open_circuit": s.rejected,
+                "latency_avg_ms": round(s.latency_total / s.requests * 1000, 1) if s.requests else None,
+                "latency_max_ms": round(s.latency_max * 1000, 1),
+                "status_counts": dict(s.status_counts),
+                "last_error": s.last_error,
+            }
+        return out
+
+
+_outbound: OutboundHTTP | None = None
+
+
+def get_outbound() -> OutboundHTTP:
+    """The process-wide instance (created on app startup, or lazily by scripts)."""
+    global _outbound
+    if _outbound is None:
+        _outbound = OutboundHTTP()
+    return _outbound
+
+
+def set_outbound(instance: OutboundHTTP | None):
+    """Install an instance, e.g. one built on a fake transport in tests."""
+    global _outbound
+    _outbound = instance
@@ -0,0 +1,42 @@
+"""Keyset (cursor) pagination helpers for the listing endpoints.
+
+A cursor is an opaque, URL-safe token that holds the sort key of the last
+row on the previous page. The next page starts right after that key, so
+each page costs one index range scan, however deep the client has paged.
+The cursor for the next page is returned in the ``X-Next-Cursor`` header.
+The header is absent on the last page.
+"""
+import base64
+import json
+import os
+
+from fastapi import HTTPException, Response
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "50"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "500"))
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def page_size(limit: int | None) -> int:
+    return min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+
+def encode_cursor(**key) -> str:
+    raw = json.dumps(key, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, *fields: str) -> dict:
+    """Decode a cursor and check it carries ``fields``; 400 on anything malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        key = None
+    if not isinstance(key, dict) or any(f not in key for f in fields):
+        raise HTTPException(400, detail="Invalid cursor")
+    return key
+
+
+def set_next_cursor(response: Response, cursor: str | None):
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
@@ -0,0 +1,110 @@
+"""TON → ⭐ conversion rate kept warm in the background.
+
+RateService polls CoinGecko for the TON/USD price on a timer that fires
+before the TTL runs out, so requests only ever read memory. The ⭐ price
+is applied at read time, which means a new STAR_USD_PRICE shows up on the
+next request. Refreshes are coalesced: a timer tick, a kick from a request
+seeing an expired value and an admin change all share one CoinGecko call.
+"""
+import asyncio
+import os
+import random
+import time
+
+from outbound import get_outbound
+
+RATE_TTL_SECONDS = float(os.getenv("RATE_TTL_SECONDS", "300"))
+RATE_REFRESH_SECONDS = float(os.getenv("RATE_REFRESH_SECONDS", str(RATE_TTL_SECONDS * 0.8)))
+RATE_RETRY_SECONDS = 15.0
+FALLBACK_TON_TO_STAR = 25.0
+
+
+class RateService:
+    def __init__(self, star_usd, ttl: float = RATE_TTL_SECONDS, refresh_every: float = RATE_REFRESH_SECONDS):
+        # star_usd() -> float, called on every read; keep it cheap (settings cache)
+        self.star_usd = star_usd
+        self.ttl = ttl
+        self.refresh_every = refresh_every
+        self.ton_usd: float | None = None
+        self.updated_at: float | None = None  # time.monotonic() of the last good fetch
+        self.last_error: str | None = None
+        self.stats = {"refreshes": 0, "errors": 0, "coalesced": 0}
+        self._loop = None
+        self._task = None
+        self._inflight = None
+
+    # ---- lifecycle ----
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def wake(self):
+        """Schedule a refresh without waiting for it; thread-safe."""
+        if self._loop:
+            try:
+                self._loop.call_soon_threadsafe(self._kick)
+            except RuntimeError:
+                pass
+
+    def _kick(self):
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+
+    async def run(self):
+        while True:
+            ok = await self.refresh()
+            delay = self.refresh_every if ok else RATE_RETRY_SECONDS
+            await asyncio.sleep(delay * (0.9 + random.random() / 5))
+
+    # ---- refresh ----
+    async def refresh(self) -> bool:
+        """Fetch now, or join the fetch that is already running."""
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._refresh())
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(self._inflight)
+
+    async def _refresh(self) -> bool:
+        try:
+            resp = await get_outbound().request("coingecko", "GET", "/simple/price",
+                                              params={"ids": "the-open-network", "vs_currencies": "usd"})
+            ton_usd = resp.json().get("the-open-network", {}).get("usd")
+            if not ton_usd:
+                raise ValueError(f"no price in CoinGecko answer ({resp.status_code})")
+            self.ton_usd = float(ton_usd)
+            self.updated_at = time.monotonic()
+            self.last_error = None
+            self.stats["refreshes"] += 1
+            return True
+        except Exception as ex:
+            print("Rate fetch error:", ex)
+            self.last_error = str(ex)
+            self.stats["errors"] += 1
+            return False
+        finally:
+            self._inflight = None
+
+    # ---- reads (any thread) ----
+    def current(self) -> dict:
+        """The rate from memory; never waits on CoinGecko."""
+        age = None if self.updated_at is None else time.monotonic() - self.updated_at
+        stale = age is None or age > self.ttl
+        if stale:
+            self.wake()
+        if self.ton_usd is None:
+            return {"ton_to_star": FALLBACK_TON_TO_STAR, "cached": False, "stale": True, "age_seconds": None}
+        return {
+            "ton_to_star": round(self.ton_usd / self.star_usd(), 2),
+            "cached": True,
+            "stale": stale,
+            "age_seconds": round(age),
+        }
@@ -0,0 +1,194 @@
+"""Throughput / latency benchmark for the hot endpoints under concurrent load.
+
+Starts the backend with uvicorn in a scratch directory, seeds a few
+lotteries and buyers, then runs a closed-loop load: ``--concurrency``
+clients send a mix of /lotteries, /buy, /tickets, /lotteries/{id}/tickets
+and /users/{id}/stats for ``--duration`` seconds. A separate probe calls
+/ping every 50 ms while the load runs, which shows whether cheap requests
+are being starved. The report gives requests/s plus p50/p99 per endpoint.
+
+To compare before/after a change, run it against two checkouts:
+    git worktree add /tmp/before HEAD~1
+    python scripts/bench_endpoints.py --backend-dir /tmp/before/backend --json before.json
+    python scripts/bench_endpoints.py --json after.json
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(samples: dict[str, list[float]], errors: dict[str, int], elapsed: float,
+              percentiles: tuple[int, ...] = (50, 99), digits: int = 1) -> dict:
+    out = {}
+    for name in sorted(set(samples) | set(errors)):
+        lat = samples.get(name, [])
+        row = {"requests": len(lat), "errors": errors.get(name, 0), "rps": round(len(lat) / elapsed, 1)}
+        for pct in percentiles:
+            row[f"p{pct}_ms"] = round(percentile(lat, pct) * 1000, digits) if lat else None
+        out[name] = row
+    return out
+
+
+def recorder(client: httpx.AsyncClient, samples: dict[str, list[float]], errors: dict[str, int],
+             error_status: int = 500):
+    """record(name, method, path, body): one timed request; a status >= ``error_status`` counts as an error."""
+    async def record(name, method, path, body):
+        started = time.perf_counter()
+        try:
+            resp = await client.request(method, path, json=body)
+            ok = resp.status_code < error_status
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            samples.setdefault(name, []).append(time.perf_counter() - started)
+        else:
+            errors[name] = errors.get(name, 0) + 1
+    return record
+
+
+async def closed_loop(record, pick, concurrency: int, duration: float, side_tasks=()) -> float:
+    """``concurrency`` clients each send pick() requests back to back for ``duration`` seconds.
+
+    ``side_tasks`` are called with the deadline and run alongside. Returns the elapsed time.
+    """
+    deadline = time.monotonic() + duration
+
+    async def worker():
+        while time.monotonic() < deadline:
+            await record(*pick())
+
+    started = time.monotonic()
+    await asyncio.gather(*(task(deadline) for task in side_tasks), *(worker() for _ in range(concurrency)))
+    return time.monotonic() - started
+
+
+def wait_until_up(base: str, server: subprocess.Popen, tries: int = 100) -> bool:
+    """Poll /ping until the server answers; False if it exits first."""
+    for _ in range(tries):
+        if server.poll() is not None:
+            return False
+        try:
+            if httpx.get(base + "/ping", timeout=1).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+async def run_load(base: str, args) -> dict:
+    rnd = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.concurrency + 5, max_keepalive_connections=args.concurrency + 5)
+    async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as client:
+        lottery_ids = []
+        for i in range(args.lotteries):
+            resp = await client.post("/lotteries/add", json={"name": f"bench {i}", "ticket_price": 1, "max_tickets": 1_000_000})
+            lottery_ids.append(resp.json()["id"])
+        next_number = {lid: itertools.count(1) for lid in lottery_ids}
+        for user_id in range(1, args.users + 1):
+            lid = rnd.choice(lottery_ids)
+            await client.post(f"/lotteries/{lid}/buy", json={"user_id": user_id, "ticket_numbers": [next(next_number[lid])]})
+
+        def pick():
+            lid = rnd.choice(lottery_ids)
+            user_id = rnd.randint(1, args.users)
+            return rnd.choices([
+                ("GET /lotteries", "GET", "/lotteries", None),
+                ("POST /buy", "POST", f"/lotteries/{lid}/buy",
+                 {"user_id": user_id, "ticket_numbers": [next(next_number[lid]) for _ in range(rnd.randint(1, 3))]}),
+                ("GET /tickets?user_id", "GET", f"/tickets?user_id={user_id}", None),
+                ("GET /lotteries/{id}/tickets", "GET", f"/lotteries/{lid}/tickets", None),
+                ("GET /users/{id}/stats", "GET", f"/users/{user_id}/stats", None),
+            ], weights=[4, 2, 1, 1, 2])[0]
+
+        samples: dict[str, list[float]] = {}
+        errors: dict[str, int] = {}
+        record = recorder(client, samples, errors)
+
+        async def probe(deadline):
+            while time.monotonic() < deadline:
+                await record("GET /ping (probe)", "GET", "/ping", None)
+                await asyncio.sleep(0.05)
+
+        elapsed = await closed_loop(record, pick, args.concurrency, args.duration, side_tasks=(probe,))
+    load = {k: v for k, v in samples.items() if not k.endswith("(probe)")}
+    total = sum(len(v) for v in load.values())
+    return {
+        "backend_dir": str(args.backend_dir),
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 1),
+        "total_rps": round(total / elapsed, 1),
+        "p99_ms": round(percentile([x for v in load.values() for x in v], 99) * 1000, 1) if total else None,
+        "endpoints": summarize(samples, errors, elapsed),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend-dir", type=Path, default=BACKEND_DIR)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--lotteries", type=int, default=5)
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="lottery-bench-")
+    env = {k: v for k, v in os.environ.items() if k not in ("BOT_TOKEN", "RANDOM_API_KEY", "DATABASE_URL")}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--app-dir", str(args.backend_dir.resolve()),
+         "--port", str(port), "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        if not wait_until_up(base, server):
+            print("server did not come up")
+            return 1
+        result = asyncio.run(run_load(base, args))
+    finally:
+        server.terminate()
+        server.wait(10)
+
+    print(f"{args.backend_dir}: {result['total_rps']} req/s, p99 {result['p99_ms']} ms "
+          f"(concurrency {args.concurrency}, {result['duration_s']} s)")
+    print(f"{'endpoint':32} {'req':>7} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, row in result["endpoints"].items():
+        print(f"{name:32} {row['requests']:7} {row['errors']:5} {row['rps']:8} {row['p50_ms']!s:>8} {row['p99_ms']!s:>8}")
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Peak-memory benchmark for the streaming ticket export.
+
+Fills a scratch SQLite database with tickets in steps (``--sizes``). At
+each step it streams the whole tickets table through the same pipeline
+/export/tickets uses, then records the tracemalloc peak and the
+throughput. With ``--legacy``, each step also runs the old approach for
+contrast: every row is loaded through the ORM and written into one
+StringIO.
+
+Run from the backend directory:
+    python scripts/bench_export_memory.py [--sizes 10000,100000,1000000] [--gzip] [--legacy]
+Exits with status 1 if the streaming peak at the largest size is more
+than ``--max-growth`` times the peak at the smallest.
+"""
+from __future__ import annotations
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def measure(run) -> tuple[float, int, float]:
+    """(peak MiB, bytes produced, seconds) of one export run."""
+    tracemalloc.start()
+    started = time.perf_counter()
+    produced = run()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2**20, produced, elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="ticket counts to measure at")
+    parser.add_argument("--format", choices=["csv", "ndjson"], default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--legacy", action="store_true", help="also measure the load-everything export")
+    parser.add_argument("--max-growth", type=float, default=2.0)
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.sizes.split(","))
+
+    workdir = tempfile.mkdtemp(prefix="lottery-export-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/export.db"
+    from sqlalchemy import insert, select
+    from db import SessionLocal, Ticket, engine, init_db
+    from exports import export_stream
+
+    init_db()
+    stmt = select(Ticket.id, Ticket.lottery_id, Ticket.user_id, Ticket.ticket_number).order_by(Ticket.id)
+
+    def streaming() -> int:
+        return sum(len(part) for part in export_stream(SessionLocal, stmt, args.format, args.gzip))
+
+    def legacy() -> int:
+        db = SessionLocal()
+        try:
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(["id", "lottery_id", "user_id", "ticket_number"])
+            for t in db.query(Ticket).all():
+                writer.writerow([t.id, t.lottery_id, t.user_id, t.ticket_number])
+            return len(output.getvalue().encode())
+        finally:
+            db.close()
+
+    print(f"{'tickets':>10} {'mode':>9} {'peak MiB':>9} {'MB out':>8} {'rows/s':>10}")
+    peaks = []
+    have = 0
+    for size in sizes:
+        with engine.begin() as conn:
+            while have < size:
+                batch = min(50_000, size - have)
+                conn.execute(insert(Ticket), [
+                    {"lottery_id": 1 + n // 10_000, "user_id": 1 + n % 997, "ticket_number": 1 + n % 10_000}
+                    for n in range(have, have + batch)
+                ])
+                have += batch
+        modes = [("stream", streaming)] + ([("legacy", legacy)] if args.legacy else [])
+        for mode, run in modes:
+            peak, produced, elapsed = measure(run)
+            if mode == "stream":
+                peaks.append(peak)
+            print(f"{size:10} {mode:>9} {peak:9.2f} {produced / 1e6:8.1f} {size / elapsed:10.0f}")
+
+    growth = peaks[-1] / peaks[0]
+    print(f"streaming peak grew {growth:.2f}x from {sizes[0]} to {sizes[-1]} tickets")
+    if growth > args.max_growth:
+        print(f"FAILED: more than {args.max_growth}x")
+        return 1
+    print("OK: export memory is flat")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Startup-time benchmark: import time, time to first response, first-request latency.
+
+Each run boots the backend in a fresh process and measures:
+  import       ``import app`` on its own, in a separate interpreter
+  ready        from spawning uvicorn until /ping first answers 200
+  first /lotteries, second /lotteries   the cold and the warm request
+The ``fresh`` scenario boots on an empty directory, so the schema is
+created. The ``current`` scenario re-boots on the database the fresh
+run left behind, which is what every restart and new worker sees. With
+``--db`` it boots on a copy of that file instead, which exercises
+pending migrations.
+
+Run from the backend directory:
+    python scripts/bench_startup.py [--runs 5] [--backend-dir DIR] [--db lottery.db] [--json out.json]
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from bench_endpoints import BACKEND_DIR, free_port
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+def clean_env() -> dict:
+    return {k: v for k, v in os.environ.items() if k not in ("BOT_TOKEN", "RANDOM_API_KEY", "DATABASE_URL")}
+
+
+def measure_import(backend_dir: Path, workdir: str) -> float:
+    env = {**clean_env(), "PYTHONPATH": str(backend_dir)}
+    out = subprocess.run([sys.executable, "-W", "ignore", "-c", IMPORT_SNIPPET], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_boot(backend_dir: Path, workdir: str) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-W", "ignore", "-m", "uvicorn", "app:app", "--app-dir", str(backend_dir),
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=clean_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        with httpx.Client(base_url=base, timeout=30) as client:
+            while True:
+                if server.poll() is not None:
+                    raise SystemExit("server exited during startup")
+                try:
+                    if client.get("/ping").status_code == 200:
+                        break
+                except httpx.TransportError:
+                    time.sleep(0.01)
+            ready = time.perf_counter() - started
+            latencies = []
+            for _ in range(2):
+                t = time.perf_counter()
+                client.get("/lotteries").raise_for_status()
+                latencies.append(time.perf_counter() - t)
+    finally:
+        server.terminate()
+        server.wait(10)
+    return {"ready": ready, "first_lotteries": latencies[0], "second_lotteries": latencies[1]}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend-dir", type=Path, default=BACKEND_DIR)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--db", type=Path, help="boot the 'current' scenario on a copy of this database")
+    parser.add_argument("--json", type=Path, help="also write the results to this file")
+    args = parser.parse_args()
+    backend_dir = args.backend_dir.resolve()
+
+    samples: dict[str, dict[str, list[float]]] = {"fresh": {}, "current": {}}
+    for _ in range(args.runs):
+        workdir = tempfile.mkdtemp(prefix="lottery-boot-")
+        for name, value in measure_boot(backend_dir, workdir).items():
+            samples["fresh"].setdefault(name, []).append(value)
+        if args.db:
+            shutil.copy(args.db, Path(workdir) / "lottery.db")
+        samples["current"].setdefault("import", []).append(measure_import(backend_dir, workdir))
+        for name, value in measure_boot(backend_dir, workdir).items():
+            samples["current"].setdefault(name, []).append(value)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result = {
+        scenario: {name: round(statistics.median(values) * 1000, 1) for name, values in metrics.items()}
+        for scenario, metrics in samples.items()
+    }
+    print(f"{backend_dir}: median of {args.runs} runs, ms")
+    columns = ["import", "ready", "first_lotteries", "second_lotteries"]
+    print(f"{'scenario':10}" + "".join(f"{c:>18}" for c in columns))
+    for scenario, row in result.items():
+        print(f"{scenario:10}" + "".join(f"{row.get(c, '-')!s:>18}" for c in columns))
+    if args.json:
+        args.json.write_text(json.dumps({"backend_dir": str(backend_dir), "runs": args.runs, **result}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""Endpoint benchmark suite: seeded data, local upstreams, in-process and uvicorn runs.
+
+1. Seeds a scratch database with seed_data.py (``--lotteries --tickets
+   --users --finished``), or copies ``--db``. Each mode gets its own copy,
+   so purchases made in one run do not leak into the next.
+2. Starts UpstreamStubs (stub_upstreams.py) in place of CoinGecko, tonapi,
+   random.org, is.gd and the Telegram Bot API. BOT_TOKEN and RANDOM_API_KEY
+   are set, so the notifier and the signed-draw path run for real.
+3. Drives the app with ``--concurrency`` closed-loop clients for
+   ``--duration`` seconds, with a weighted mix of the read endpoints plus
+   purchases:
+     inprocess  httpx ASGITransport inside the app's lifespan; no sockets,
+                so it measures the handlers themselves
+     uvicorn    a real server in a subprocess, over HTTP
+4. Draw phase: runs ``--draws`` forced draws one after another. Each one is
+   timed from POST /lotteries/{id}/draw until draw_status reports "notified".
+
+The report gives req/s and p50/p95/p99 per endpoint. ``--json`` writes it
+to a file. ``--baseline`` compares against an earlier file and exits 1 when
+an endpoint's p95 grew, or its req/s fell, by more than ``--tolerance``:
+    python scripts/bench_suite.py --json baseline.json
+    ... change something ...
+    python scripts/bench_suite.py --baseline baseline.json
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from bench_endpoints import BACKEND_DIR, closed_loop, free_port, percentile, recorder, summarize, wait_until_up
+from seed_data import wallet_address
+from stub_upstreams import UpstreamStubs
+
+# name -> weight; names are the route templates
+MIX = {
+    "GET /lotteries": 8,
+    "GET /bootstrap/{user_id}": 4,
+    "GET /lotteries/{id}/grid": 3,
+    "GET /tickets": 2,
+    "GET /users/{user_id}/stats": 2,
+    "GET /rates/ton_star": 1,
+    "GET /wallet_balance/{address}": 1,
+    "GET /lotteries/{id}/result": 1,
+    "POST /lotteries/{id}/buy": 2,
+}
+REGRESSION_METRICS = ("p95_ms", "rps")
+
+
+def bench_env(db_path: Path, stubs: UpstreamStubs) -> dict:
+    return {
+        **os.environ,
+        **stubs.env(),
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "BOT_TOKEN": "123:stub",
+        "RANDOM_API_KEY": "stub",
+        "NOTIFY_RATE_PER_SEC": "1000",
+    }
+
+
+def copy_db(src: Path, dst: Path):
+    """Copy a SQLite database including what is still in its WAL, which a plain file copy misses."""
+    with sqlite3.connect(src) as source, sqlite3.connect(dst) as target:
+        source.backup(target)
+    source.close()
+    target.close()
+
+
+class Workload:
+    """Picks requests from MIX against the lotteries the seeded database has."""
+
+    def __init__(self, active: list[dict], finished: list[int], users: list[int], seed: int):
+        self.rnd = random.Random(seed)
+        self.active = [lot["id"] for lot in active]
+        self.finished = finished
+        self.users = users
+        # buys take fresh numbers above what is already sold
+        self.next_number = {lot["id"]: lot["tickets_sold"] + 1 for lot in active}
+        self.names = list(MIX)
+        self.weights = list(MIX.values())
+
+    def pick(self) -> tuple[str, str, str, dict | None]:
+        name = self.rnd.choices(self.names, self.weights)[0]
+        user_id = self.rnd.choice(self.users)
+        lottery_id = self.rnd.choice(self.active)
+        if name == "GET /lotteries":
+            return name, "GET", "/lotteries", None
+        if name == "GET /bootstrap/{user_id}":
+            return name, "GET", f"/bootstrap/{user_id}", None
+        if name == "GET /lotteries/{id}/grid":
+            return name, "GET", f"/lotteries/{lottery_id}/grid?user_id={user_id}", None
+        if name == "GET /tickets":
+            return name, "GET", f"/tickets?user_id={user_id}&limit=50", None
+        if name == "GET /users/{user_id}/stats":
+            return name, "GET", f"/users/{user_id}/stats", None
+        if name == "GET /rates/ton_star":
+            return name, "GET", "/rates/ton_star", None
+        if name == "GET /wallet_balance/{address}":
+            return name, "GET", f"/wallet_balance/{wallet_address(user_id)}", None
+        if name == "GET /lotteries/{id}/result":
+            return name, "GET", f"/lotteries/{self.rnd.choice(self.finished or self.active)}/result", None
+        count = self.rnd.randint(1, 3)
+        start = self.next_number[lottery_id]
+        self.next_number[lottery_id] += count
+        return name, "POST", f"/lotteries/{lottery_id}/buy", {"user_id": user_id, "ticket_numbers": list(range(start, start + count))}
+
+
+async def _all_lotteries(client: httpx.AsyncClient, status: str) -> list[dict]:
+    resp = await client.get("/lotteries", params={"status": status})
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def run_mode(client: httpx.AsyncClient, args, users: list[int]) -> dict:
+    active = await _all_lotteries(client, "active")
+    finished = [lot["id"] for lot in await _all_lotteries(client, "finished")]
+    # the draw phase needs lotteries the load does not buy into
+    drawable = [lot for lot in active if lot["tickets_sold"]][:args.draws]
+    active = [lot for lot in active if lot not in drawable] or active
+    workload = Workload(active, finished, users, args.seed)
+
+    samples: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    # a 4xx here means the workload picked a bad request, so it counts too
+    record = recorder(client, samples, errors, error_status=400)
+
+    await closed_loop(record, workload.pick, 1, args.warmup)
+    samples.clear()
+    errors.clear()
+
+    elapsed = await closed_loop(record, workload.pick, args.concurrency, args.duration)
+    total = sum(len(v) for v in samples.values())
+    result = {
+        "duration_s": round(elapsed, 1),
+        "total_rps": round(total / elapsed, 1),
+        "endpoints": summarize(samples, errors, elapsed, percentiles=(50, 95, 99), digits=2),
+    }
+    if drawable:
+        result["draw"] = await run_draws(client, drawable, args.draw_timeout)
+    return result
+
+
+async def run_draws(client: httpx.AsyncClient, lotteries: list[dict], timeout: float) -> dict:
+    """Time each forced draw from the request until every winner message went out."""
+    times, failed = [], 0
+    for lot in lotteries:
+        started = time.perf_counter()
+        resp = await client.post(f"/lotteries/{lot['id']}/draw")
+        if resp.status_code != 202:
+            failed += 1
+            continue
+        state = None
+        while time.perf_counter() - started < timeout:
+            state = (await client.get(f"/lotteries/{lot['id']}/draw_status")).json().get("state")
+            if state in ("notified", "failed"):
+                break
+            await asyncio.sleep(0.05)
+        if state == "notified":
+            times.append(time.perf_counter() - started)
+        else:
+            failed += 1
+    return {
+        "draws": len(times),
+        "failed": failed,
+        "p50_ms": round(percentile(times, 50) * 1000, 1) if times else None,
+        "max_ms": round(max(times) * 1000, 1) if times else None,
+    }
+
+
+async def run_inprocess(args, env: dict, users: list[int]) -> dict:
+    os.environ.update(env)
+    sys.path.insert(0, str(args.backend_dir))
+    from app import app
+
+    limits = httpx.Limits(max_connections=None)
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits, timeout=60) as client:
+            return await run_mode(client, args, users)
+
+
+def run_uvicorn(args, env: dict, workdir: Path, users: list[int]) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, "-W", "ignore", "-m", "uvicorn", "app:app", "--app-dir", str(args.backend_dir),
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        if not wait_until_up(base, server, tries=300):
+            raise SystemExit("server did not come up")
+
+        async def drive():
+            limits = httpx.Limits(max_connections=args.concurrency + 5, max_keepalive_connections=args.concurrency + 5)
+            async with httpx.AsyncClient(base_url=base, limits=limits, timeout=60) as client:
+                return await run_mode(client, args, users)
+
+        return asyncio.run(drive())
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Lines describing every endpoint that got worse than ``baseline`` by more than ``tolerance``."""
+    regressions = []
+    for mode, current in result["modes"].items():
+        before = baseline.get("modes", {}).get(mode)
+        if not before:
+            continue
+        for name, row in current["endpoints"].items():
+            old = before["endpoints"].get(name)
+            if not old:
+                continue
+            for metric in REGRESSION_METRICS:
+                new_value, old_value = row.get(metric), old.get(metric)
+                if not new_value or not old_value:
+                    continue
+                change = new_value / old_value - 1
+                worse = change > tolerance if metric.endswith("_ms") else change < -tolerance
+                print(f"{mode:10} {name:32} {metric:7} {old_value!s:>9} -> {new_value!s:>9} {change:+7.1%}"
+                      + ("  REGRESSION" if worse else ""))
+                if worse:
+                    regressions.append(f"{mode} {name} {metric} {old_value} -> {new_value}")
+    return regressions
+
+
+def print_report(result: dict):
+    for mode, run in result["modes"].items():
+        print(f"\n{mode}: {run['total_rps']} req/s over {run['duration_s']} s, concurrency {result['concurrency']}")
+        print(f"{'endpoint':32} {'req':>7} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+        for name, row in run["endpoints"].items():
+            print(f"{name:32} {row['requests']:7} {row['errors']:5} {row['rps']:8} "
+                  f"{row['p50_ms']!s:>8} {row['p95_ms']!s:>8} {row['p99_ms']!s:>8}")
+        if "draw" in run:
+            draw = run["draw"]
+            print(f"draw -> notified: {draw['draws']} ok, {draw['failed']} failed, "
+                  f"p50 {draw['p50_ms']} ms, max {draw['max_ms']} ms")
+    print(f"\nupstream calls: {result['upstream_calls']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend-dir", type=Path, default=BACKEND_DIR)
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="both")
+    parser.add_argument("--db", type=Path, help="benchmark a copy of this database instead of seeding one")
+    parser.add_argument("--lotteries", type=int, default=50)
+    parser.add_argument("--tickets", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--finished", type=float, default=0.5, help="share of seeded lotteries already drawn")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--draws", type=int, default=3)
+    parser.add_argument("--draw-timeout", type=float, default=60)
+    parser.add_argument("--upstream-latency", type=float, default=0.0, help="seconds added to each stubbed API call")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    parser.add_argument("--baseline", type=Path, help="compare against an earlier --json file")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change before it counts as a regression")
+    args = parser.parse_args()
+    args.backend_dir = args.backend_dir.resolve()
+
+    workdir = Path(tempfile.mkdtemp(prefix="lottery-suite-"))
+    template = workdir / "template.db"
+    try:
+        if args.db:
+            copy_db(args.db, template)
+        else:
+            subprocess.run([sys.executable, "-W", "ignore", str(Path(__file__).with_name("seed_data.py")),
+                            "--db", str(template), "--lotteries", str(args.lotteries), "--tickets", str(args.tickets),
+                            "--users", str(args.users), "--finished", str(args.finished), "--seed", str(args.seed)],
+                           check=True)
+        with sqlite3.connect(template) as conn:
+            users = [row[0] for row in conn.execute("SELECT user_id FROM users")]
+
+        stubs = UpstreamStubs(upstream_latency=args.upstream_latency).start()
+        result = {
+            "backend_dir": str(args.backend_dir),
+            "scale": {"lotteries": args.lotteries, "tickets": args.tickets, "users": args.users,
+                      "finished": args.finished} if not args.db else {"db": str(args.db)},
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "modes": {},
+        }
+        modes = ["inprocess", "uvicorn"] if args.mode == "both" else [args.mode]
+        # uvicorn first: in-process imports the app into this process for good
+        for mode in sorted(modes, key=lambda m: m != "uvicorn"):
+            mode_dir = workdir / mode
+            mode_dir.mkdir()
+            db_path = mode_dir / "lottery.db"
+            copy_db(template, db_path)
+            env = bench_env(db_path, stubs)
+            if mode == "uvicorn":
+                result["modes"][mode] = run_uvicorn(args, env, mode_dir, users)
+            else:
+                result["modes"][mode] = asyncio.run(run_inprocess(args, env, users))
+        result["upstream_calls"] = dict(stubs.calls)
+        stubs.stop()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2))
+    if args.baseline:
+        print(f"\ncompared with {args.baseline} (tolerance {args.tolerance:.0%}):")
+        regressions = compare(result, json.loads(args.baseline.read_text()), args.tolerance)
+        if regressions:
+            print(f"FAIL: {len(regressions)} regression(s)")
+            return 1
+        print("OK: no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""End-to-end check of the Telegram outbox against a local Bot API stub.
+
+Fills a lottery with many distinct buyers in a scratch SQLite database so
+the draw queues one message per participant. The app's background
+dispatcher then delivers them to TelegramStub, which enforces a
+per-second limit (429 + retry_after) and fails every Nth call with a 502.
+The script checks that:
+
+* the purchase that triggers the draw waits for neither the draw nor Telegram;
+* every participant gets exactly one message, and nothing ends up failed;
+* queueing the same draw notifications again is a no-op.
+
+Run from the backend directory:
+    python scripts/check_notifier.py [--participants 150] [--stub-rate 20]
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stub_upstreams import TelegramStub  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--participants", type=int, default=150)
+    parser.add_argument("--stub-rate", type=int, default=20, help="stub's messages/second before 429")
+    parser.add_argument("--fail-every", type=int, default=11, help="stub answers every Nth call with 502")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    stub = TelegramStub(rate_limit=args.stub_rate, fail_every=args.fail_every).start()
+    os.chdir(tempfile.mkdtemp(prefix="lottery-notify-"))
+    os.environ.update({
+        "BOT_TOKEN": "123:stub",
+        "TELEGRAM_API_URL": stub.url,
+        "NOTIFY_RATE_PER_SEC": str(args.stub_rate + 10),  # deliberately above the stub limit
+    })
+    os.environ.pop("ADMIN_CHAT_ID", None)
+    os.environ.pop("RANDOM_API_KEY", None)
+
+    import app as app_module
+    from db import SessionLocal, NotificationOutbox, Ticket, Lottery
+    from notifier import enqueue_notifications
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func
+
+    failures = []
+    with TestClient(app_module.app) as client:
+        lottery_id = client.post("/lotteries/add", json={
+            "name": "notify", "ticket_price": 1, "max_tickets": args.participants,
+        }).json()["id"]
+        for user_id in range(1, args.participants):
+            client.post(f"/lotteries/{lottery_id}/buy", json={"user_id": 5000 + user_id, "ticket_numbers": [user_id]})
+        started = time.perf_counter()
+        resp = client.post(f"/lotteries/{lottery_id}/buy", json={"user_id": 5000 + args.participants,
+                                                                 "ticket_numbers": [args.participants]})
+        fill_ms = (time.perf_counter() - started) * 1000
+        if resp.status_code != 200:
+            failures.append(f"final purchase failed: {resp.status_code} {resp.text}")
+
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            db = SessionLocal()
+            try:
+                drawn = db.query(Lottery.winner_id).filter(Lottery.id == lottery_id).scalar() is not None
+                pending = db.query(func.count(NotificationOutbox.id)).filter(NotificationOutbox.status == "pending").scalar()
+            finally:
+                db.close()
+            if drawn and not pending:
+                break
+            time.sleep(0.5)
+        drain_s = time.monotonic() - (deadline - args.timeout)
+
+        db = SessionLocal()
+        try:
+            statuses = dict(db.query(NotificationOutbox.status, func.count(NotificationOutbox.id)).group_by(NotificationOutbox.status).all())
+            winner_ticket = (
+                db.query(Ticket).join(Lottery, Lottery.id == Ticket.lottery_id)
+                .filter(Ticket.lottery_id == lottery_id, Ticket.ticket_number == Lottery.winner_ticket_number).one()
+            )
+            again = enqueue_notifications(db, app_module._draw_notifications(
+                lottery_id, "notify", winner_ticket, winner_ticket.ticket_number, None, db))
+            db.rollback()
+        finally:
+            db.close()
+        dispatcher_stats = dict(app_module.dispatcher.stats)
+    stub.stop()
+
+    per_chat = Counter(str(m["chat_id"]) for m in stub.messages)
+    expected = {str(5000 + i) for i in range(1, args.participants + 1)}
+    if set(per_chat) != expected:
+        failures.append(f"{len(expected - set(per_chat))} participants got no message")
+    duplicates = {chat: n for chat, n in per_chat.items() if n > 1}
+    if duplicates:
+        failures.append(f"{len(duplicates)} chats got duplicate messages")
+    if statuses.get("failed") or statuses.get("pending"):
+        failures.append(f"outbox not drained cleanly: {statuses}")
+    if again:
+        failures.append(f"re-queueing the draw added {again} duplicate rows")
+    if fill_ms > 1000:
+        failures.append(f"purchase that triggered the draw took {fill_ms:.0f} ms")
+
+    print(f"filling purchase: {fill_ms:.0f} ms; outbox drained in {drain_s:.1f} s")
+    print(f"outbox: {statuses}; dispatcher: {dispatcher_stats}")
+    print(f"stub: {len(stub.messages)} delivered, {stub.rejected_429} x 429, {stub.failed_5xx} x 5xx")
+    if failures:
+        print("FAILED:\n  " + "\n  ".join(failures))
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
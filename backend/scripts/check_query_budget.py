@@ -0,0 +1,138 @@
+"""Per-endpoint SQL query budget check (an N+1 guard).
+
+Calls the hot endpoints against a scratch SQLite database twice. The first
+round runs on a lottery with a few buyers, and purchases take one ticket.
+The second runs after many more buyers joined, and purchases take several
+tickets. The statement count of each call comes from the X-DB-Queries
+header (db.count_queries, set by metrics.MetricsMiddleware). The check
+fails when an endpoint
+  - runs more statements than its entry in BUDGETS, or
+  - runs more statements in the second round than in the first, i.e. its
+    query count grows with rows or with tickets per purchase.
+Snapshots are rechecked on every call (SNAPSHOT_RECHECK_SECONDS=0), so
+cached endpoints are counted the same way in both rounds.
+
+Run from the backend directory:
+    python scripts/check_query_budget.py [-v]
+Exits with status 1 on any failure.
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# endpoint label -> most statements one call may run
+BUDGETS = {
+    # lottery, reserve, user, taken check, first-ticket check, insert, summary, version x2, reload x2
+    "POST /lotteries/{id}/buy": 12,
+    "GET /lotteries": 3,
+    "GET /lotteries?status": 2,
+    "GET /lotteries?limit": 3,
+    # settings, tickets; archived lotteries only with include_archived
+    "GET /tickets?user_id": 2,
+    "GET /tickets?lottery_id": 2,
+    "GET /lotteries/{id}/tickets": 2,
+    "GET /lotteries/{id}/stats": 1,
+    "GET /lotteries/{id}/grid": 4,
+    "GET /users/{id}/stats": 1,
+    "GET /users/{id}": 1,
+    "GET /bootstrap/{id}": 7,
+    "GET /bootstrap/{id}?version": 2,
+}
+SMALL_BUYERS, LARGE_BUYERS = 3, 40
+
+
+def run_round(client, count, lid: int, buyer: int, tickets_per_buy: int) -> dict[str, int]:
+    """Statements per BUDGETS endpoint; ``count(method, path, **kwargs)`` makes one call and returns its count."""
+    numbers = list(range(200 + buyer * 10, 200 + buyer * 10 + tickets_per_buy))
+    counts = {
+        "POST /lotteries/{id}/buy": count("POST", f"/lotteries/{lid}/buy",
+                                          json={"user_id": 1000 + buyer, "ticket_numbers": numbers}),
+        "GET /lotteries": count("GET", "/lotteries"),
+        "GET /lotteries?status": count("GET", "/lotteries?status=active"),
+        "GET /lotteries?limit": count("GET", "/lotteries?limit=5"),
+        "GET /tickets?user_id": count("GET", "/tickets?user_id=3"),
+        "GET /tickets?lottery_id": count("GET", f"/tickets?lottery_id={lid}&limit=50"),
+        "GET /lotteries/{id}/tickets": count("GET", f"/lotteries/{lid}/tickets"),
+        "GET /lotteries/{id}/stats": count("GET", f"/lotteries/{lid}/stats"),
+        "GET /lotteries/{id}/grid": count("GET", f"/lotteries/{lid}/grid?user_id=3"),
+        "GET /users/{id}/stats": count("GET", "/users/3/stats"),
+        "GET /users/{id}": count("GET", "/users/3"),
+        "GET /bootstrap/{id}": count("GET", "/bootstrap/3"),
+    }
+    version = client.get("/bootstrap/3").json()["version"]
+    counts["GET /bootstrap/{id}?version"] = count("GET", f"/bootstrap/3?version={version}")
+    return counts
+
+
+def measure(client, count) -> tuple[dict[str, int], dict[str, int]]:
+    """The small and the large round, on a lottery of their own."""
+    lid = client.post("/lotteries/add", json={"name": "budget", "ticket_price": 2, "max_tickets": 1000}).json()["id"]
+
+    def buy(user_id: int):
+        count("POST", f"/lotteries/{lid}/buy", json={"user_id": user_id, "ticket_numbers": [user_id * 2, user_id * 2 + 1]})
+
+    for user_id in range(1, SMALL_BUYERS + 1):
+        buy(user_id)
+    small = run_round(client, count, lid, 1, 1)
+    for user_id in range(SMALL_BUYERS + 1, LARGE_BUYERS + 1):
+        buy(user_id)
+    large = run_round(client, count, lid, 2, 5)
+    return small, large
+
+
+def budget_problems(name: str, small: dict[str, int], large: dict[str, int]) -> list[str]:
+    problems = []
+    budget = BUDGETS[name]
+    if max(small[name], large[name]) > budget:
+        problems.append(f"over budget ({max(small[name], large[name])} > {budget})")
+    if large[name] > small[name]:
+        problems.append(f"grows with rows ({small[name]} -> {large[name]})")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every count")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix="lottery-budget-"))
+    for name in ("BOT_TOKEN", "ADMIN_CHAT_ID", "RANDOM_API_KEY"):
+        os.environ.pop(name, None)
+    os.environ.update({"SNAPSHOT_RECHECK_SECONDS": "0", "QUERY_STATS_HEADERS": "1"})
+
+    import app as app_module
+    from fastapi.testclient import TestClient
+    from metrics import QUERY_COUNT_HEADER
+
+    def count(method: str, path: str, **kwargs) -> int:
+        resp = client.request(method, path, **kwargs)
+        if resp.status_code >= 400:
+            raise SystemExit(f"{method} {path} -> {resp.status_code}: {resp.text}")
+        return int(resp.headers[QUERY_COUNT_HEADER])
+
+    with TestClient(app_module.app) as client:
+        small, large = measure(client, count)
+
+    failures = []
+    print(f"{'endpoint':32} {'budget':>6} {'small':>6} {'large':>6}")
+    for name, budget in BUDGETS.items():
+        problems = budget_problems(name, small, large)
+        if args.verbose or problems:
+            print(f"{name:32} {budget:6} {small[name]:6} {large[name]:6}  {'; '.join(problems)}")
+        failures.extend(f"{name}: {p}" for p in problems)
+
+    print(f"checked {len(BUDGETS)} endpoints")
+    if failures:
+        print("FAILED:\n  " + "\n  ".join(failures))
+        return 1
+    print("OK: every endpoint within its query budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
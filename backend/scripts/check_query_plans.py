@@ -0,0 +1,161 @@
+"""Query-plan regression check for the hot endpoints.
+
+Drives the main endpoints against a scratch SQLite database and records
+every statement they send, then archives the drawn lottery (archive.py)
+and reads it again. Each distinct SELECT/UPDATE/DELETE is then run
+through ``EXPLAIN QUERY PLAN`` with its real parameters. The check fails
+if any of them reads a whole table (a plain ``SCAN <table>``) without
+being on the ALLOWED_FULL_SCANS list. That list covers endpoints that
+return every row by design.
+
+Run from the backend directory:
+    python scripts/check_query_plans.py [-v]
+Exits with status 1 if a hot query falls back to a full table scan.
+"""
+from __future__ import annotations
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stub_upstreams import TelegramStub  # noqa: E402
+
+# (endpoint label, table): whole-table reads that are the point of the endpoint
+ALLOWED_FULL_SCANS = {
+    ("GET /lotteries", "lotteries"),
+    ("GET /export/lotteries", "lotteries"),
+    ("GET /export/tickets", "tickets"),
+    ("GET /export/tickets", "ticket_archives"),
+    ("GET /tickets", "tickets"),
+    ("GET /tickets", "ticket_archives"),
+    ("GET /bootstrap/{id}", "lotteries"),  # the /lotteries part
+}
+FULL_SCAN_RE = re.compile(r"^SCAN (\w+)$")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every plan")
+    args = parser.parse_args()
+
+    # a Telegram stub, so the draw also exercises the notification outbox
+    stub = TelegramStub().start()
+    os.chdir(tempfile.mkdtemp(prefix="lottery-plans-"))
+    os.environ.update({"BOT_TOKEN": "123:stub", "TELEGRAM_API_URL": stub.url})
+    os.environ.pop("ADMIN_CHAT_ID", None)
+    os.environ.pop("RANDOM_API_KEY", None)
+
+    import app as app_module
+    from archive import archive_due
+    from db import SessionLocal, Lottery, engine
+    from fastapi.testclient import TestClient
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    label = {"current": "startup"}
+    recorded: dict[tuple[str, str], tuple] = {}
+
+    # every engine: the sync one and the async one behind the hot endpoints
+    @event.listens_for(Engine, "before_cursor_execute")
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        if verb in ("SELECT", "UPDATE", "DELETE") and not executemany:
+            recorded.setdefault((label["current"], statement), parameters)
+
+    def call(method: str, path: str, name: str | None = None, **kwargs):
+        label["current"] = name or f"{method} {path}"
+        resp = client.request(method, path, **kwargs)
+        if resp.status_code >= 500:
+            raise SystemExit(f"{method} {path} -> {resp.status_code}: {resp.text}")
+        return resp
+
+    with TestClient(app_module.app) as client:
+        lid = call("POST", "/lotteries/add", json={"name": "plans", "ticket_price": 2, "max_tickets": 40}).json()["id"]
+        for user_id in range(1, 9):
+            call("POST", f"/lotteries/{lid}/buy", "POST /lotteries/{id}/buy",
+                 json={"user_id": user_id, "ticket_numbers": [user_id * 2, user_id * 2 + 1]})
+        call("POST", f"/lotteries/{lid}/buy", "POST /lotteries/{id}/buy", json={"user_id": 1, "ticket_numbers": [2]})
+        call("GET", "/lotteries")
+        call("GET", "/tickets")
+        call("GET", f"/tickets?lottery_id={lid}", "GET /tickets?lottery_id")
+        call("GET", "/tickets?user_id=3", "GET /tickets?user_id")
+        call("GET", f"/lotteries/{lid}/tickets", "GET /lotteries/{id}/tickets")
+        call("GET", f"/lotteries/{lid}/stats", "GET /lotteries/{id}/stats")
+        call("GET", f"/lotteries/{lid}/grid?user_id=3", "GET /lotteries/{id}/grid")
+        call("GET", f"/lotteries/{lid}/grid?format=bitmap", "GET /lotteries/{id}/grid")
+        call("GET", "/users/3/stats", "GET /users/{id}/stats")
+        call("GET", "/users/3", "GET /users/{id}")
+        call("GET", "/bootstrap/3", "GET /bootstrap/{id}")
+        call("POST", f"/lotteries/{lid}/draw", "POST /lotteries/{id}/draw")
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            db = SessionLocal()
+            try:
+                if db.query(Lottery.winner_id).filter(Lottery.id == lid).scalar() is not None:
+                    break
+            finally:
+                db.close()
+            time.sleep(0.2)
+        call("GET", f"/lotteries/{lid}/draw_status", "GET /lotteries/{id}/draw_status")
+        call("GET", f"/lotteries/{lid}/result", "GET /lotteries/{id}/result")
+        call("GET", "/lotteries?status=active", "GET /lotteries?status")
+        page = call("GET", "/lotteries?limit=1", "GET /lotteries?limit")
+        while "X-Next-Cursor" in page.headers:  # through the active part into the finished one
+            page = call("GET", f"/lotteries?limit=1&cursor={page.headers['X-Next-Cursor']}", "GET /lotteries?limit")
+        page = call("GET", "/tickets?user_id=3&limit=1", "GET /tickets?limit")
+        call("GET", f"/tickets?user_id=3&limit=1&cursor={page.headers['X-Next-Cursor']}", "GET /tickets?limit")
+        page = call("GET", f"/lotteries/{lid}/tickets?limit=5", "GET /lotteries/{id}/tickets?limit")
+        call("GET", f"/lotteries/{lid}/tickets?limit=5&cursor={page.headers['X-Next-Cursor']}", "GET /lotteries/{id}/tickets?limit")
+        call("GET", "/export/lotteries")
+        call("GET", "/export/tickets")
+        call("GET", f"/export/tickets?lottery_id={lid}&format=ndjson&gzip=true", "GET /export/tickets?lottery_id")
+        label["current"] = "archive"
+        deadline = time.monotonic() + 10
+        while not archive_due(SessionLocal, timedelta(0)):  # waits for the draw job to settle
+            if time.monotonic() > deadline:
+                raise SystemExit("the drawn lottery was never archived")
+            time.sleep(0.2)
+        call("GET", f"/tickets?lottery_id={lid}", "GET /tickets?lottery_id (archived)")
+        call("GET", "/tickets?user_id=3", "GET /tickets?user_id (archived)")
+        page = call("GET", "/tickets?user_id=3&include_archived=true&limit=1", "GET /tickets?limit (archived)")
+        call("GET", f"/tickets?user_id=3&include_archived=true&limit=1&cursor={page.headers['X-Next-Cursor']}",
+             "GET /tickets?limit (archived)")
+        call("GET", f"/lotteries/{lid}/tickets", "GET /lotteries/{id}/tickets (archived)")
+        call("GET", f"/lotteries/{lid}/grid?user_id=3", "GET /lotteries/{id}/grid (archived)")
+        call("GET", "/users/3/stats", "GET /users/{id}/stats (archived)")
+        call("GET", "/bootstrap/3", "GET /bootstrap/{id} (archived)")
+        call("GET", f"/export/tickets?lottery_id={lid}", "GET /export/tickets?lottery_id (archived)")
+        label["current"] = "background"  # draw worker / dispatcher polls
+        time.sleep(1.5)
+        event.remove(Engine, "before_cursor_execute", _record)
+
+        failures = []
+        with engine.connect() as conn:
+            for (name, statement), parameters in recorded.items():
+                plan = [row[3] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+                scans = [m.group(1) for m in map(FULL_SCAN_RE.match, plan) if m]
+                bad = [t for t in scans if (name, t) not in ALLOWED_FULL_SCANS]
+                if args.verbose or bad:
+                    print(f"[{name}] {' '.join(statement.split())[:160]}")
+                    for line in plan:
+                        print("    " + line)
+                if bad:
+                    failures.append(f"{name}: full scan of {', '.join(bad)}")
+    stub.stop()
+
+    print(f"checked {len(recorded)} statements")
+    if failures:
+        print("FAILED:\n  " + "\n  ".join(failures))
+        return 1
+    print("OK: no unexpected full table scans")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
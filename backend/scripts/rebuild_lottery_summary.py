@@ -0,0 +1,31 @@
+"""Backfill or repair the denormalized lottery summary columns.
+
+Recomputes ``participants_count``, ``revenue`` and the winner's
+username / first / last name for every lottery from the ``tickets`` table.
+The columns are filled automatically when they are first added by
+``init_db()``; run this script afterwards if they ever drift.
+
+Run from the backend directory:
+    python scripts/rebuild_lottery_summary.py
+"""
+from __future__ import annotations
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from db import SessionLocal, init_db, rebuild_lottery_summaries  # noqa: E402
+
+
+def main():
+    init_db()
+    db = SessionLocal()
+    try:
+        rebuild_lottery_summaries(db)
+    finally:
+        db.close()
+    print("Lottery summaries rebuilt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Synthetic data generator for benchmarks and manual testing.
+
+Creates ``--users`` users and ``--lotteries`` lotteries, with a
+``--finished`` share of them already drawn, and spreads ``--tickets``
+tickets over the lotteries. Finished lotteries are sold out. Active ones
+are about half full and leave ``--room`` free numbers for benchmark
+purchases. Buyers take runs of consecutive numbers, like real purchases
+do. Summary columns, winners and versions are filled in so every endpoint
+sees consistent data.
+
+The schema comes from init_db(), so the result is a regular database at
+the current migration version.
+
+    python scripts/seed_data.py --db /tmp/bench.db --lotteries 200 --tickets 1000000 --users 20000
+Refuses to touch an existing file unless ``--append`` is given.
+"""
+from __future__ import annotations
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+BATCH_ROWS = 20_000
+
+
+def wallet_address(user_id: int) -> str:
+    return f"UQ{user_id:046d}"
+
+
+def seed(lotteries: int, tickets: int, users: int, finished: float = 0.5, room: int = 100_000,
+         seed: int = 1) -> dict:
+    """Fill the database behind db.engine (DATABASE_URL); returns a summary of what was created."""
+    from sqlalchemy import func, insert, select, text
+    from db import LOTTERY_SUMMARY_SQL, Lottery, Ticket, User, bump_version, engine, init_db, SessionLocal
+
+    rnd = random.Random(seed)
+    init_db()
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        first_user = (conn.execute(select(func.max(User.user_id))).scalar() or 0) + 1
+        user_ids = list(range(first_user, first_user + users))
+        for i in range(0, users, BATCH_ROWS):
+            conn.execute(insert(User), [
+                {"user_id": u, "username": f"user{u}", "first_name": f"User {u}",
+                 "ton_wallet_address": wallet_address(u) if u % 3 == 0 else None}
+                for u in user_ids[i:i + BATCH_ROWS]
+            ])
+
+        n_finished = round(lotteries * finished)
+        per_lottery = max(tickets // max(lotteries, 1), 1)
+        lottery_ids = {"active": [], "finished": []}
+        total = 0
+        for n in range(lotteries):
+            is_finished = n < n_finished
+            sold = per_lottery if is_finished else per_lottery // 2
+            max_tickets = sold if is_finished else sold + room
+            created = now - timedelta(hours=lotteries - n)
+            lottery_id = conn.execute(insert(Lottery).values(
+                name=f"Bench #{n + 1}", ticket_price=rnd.choice([1, 2, 5, 10]), max_tickets=max_tickets,
+                tickets_sold=sold, created_at=created,
+                finished_at=created + timedelta(minutes=30) if is_finished else None,
+            )).inserted_primary_key[0]
+            lottery_ids["finished" if is_finished else "active"].append(lottery_id)
+            # runs of consecutive numbers per buyer, numbers 1..sold
+            rows, number = [], 1
+            while number <= sold:
+                run = min(rnd.randint(1, 20), sold - number + 1)
+                user_id = rnd.choice(user_ids)
+                rows.extend({"lottery_id": lottery_id, "user_id": user_id, "username": f"user{user_id}",
+                             "ticket_number": k, "created_at": created} for k in range(number, number + run))
+                number += run
+                if len(rows) >= BATCH_ROWS:
+                    conn.execute(insert(Ticket), rows)
+                    rows = []
+            if rows:
+                conn.execute(insert(Ticket), rows)
+            if is_finished and sold:
+                winner_number = rnd.randint(1, sold)
+                conn.execute(text(
+                    "UPDATE lotteries SET winner_ticket_number = :n, winner_id = "
+                    "(SELECT user_id FROM tickets WHERE lottery_id = :l AND ticket_number = :n) WHERE id = :l"
+                ), {"n": winner_number, "l": lottery_id})
+            total += sold
+        for stmt in LOTTERY_SUMMARY_SQL:
+            conn.execute(text(stmt))
+
+    db = SessionLocal()
+    try:
+        for lottery_id in lottery_ids["active"] + lottery_ids["finished"]:
+            bump_version(db, lottery_id)
+        db.commit()
+    finally:
+        db.close()
+    if engine.dialect.name == "sqlite":
+        # fold the WAL into the main file, so the result can be copied as one file
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    engine.dispose()
+    return {
+        "users": users,
+        "first_user_id": first_user,
+        "active_lotteries": lottery_ids["active"],
+        "finished_lotteries": lottery_ids["finished"],
+        "tickets": total,
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", type=Path, required=True, help="SQLite file to create")
+    parser.add_argument("--lotteries", type=int, default=50)
+    parser.add_argument("--tickets", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=5_000)
+    parser.add_argument("--finished", type=float, default=0.5, help="share of lotteries already drawn")
+    parser.add_argument("--room", type=int, default=100_000, help="free numbers left in each active lottery")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--append", action="store_true", help="add to an existing database")
+    args = parser.parse_args()
+    if args.db.exists() and not args.append:
+        print(f"{args.db} exists; pass --append to add to it")
+        return 1
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db.resolve()}"
+    summary = seed(args.lotteries, args.tickets, args.users, args.finished, args.room, args.seed)
+    print(f"seeded {args.db}: {summary['tickets']} tickets, {len(summary['active_lotteries'])} active and "
+          f"{len(summary['finished_lotteries'])} finished lotteries, {summary['users']} users "
+          f"in {summary['seconds']} s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""Concurrency stress test for ticket purchases on a single hot lottery.
+
+Splits all ticket numbers of one lottery into random chunks and has several
+different users race for every chunk, firing hundreds of parallel /buy
+requests in a throw-away SQLite database. Exactly one buyer should win each
+chunk, so the lottery ends up full. Afterwards the invariants are checked:
+
+* no ticket number is sold twice and tickets_sold equals the real row count;
+* the lottery is never oversold;
+* participants_count and revenue match the tickets table;
+* a full lottery gets exactly one draw job, which picks the winner;
+* no request failed with a 5xx.
+
+Run from the backend directory:
+    python scripts/stress_buy.py [--contention 3] [--threads 64] [--max-tickets 500]
+Exits with status 1 if any invariant is violated.
+"""
+from __future__ import annotations
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--contention", type=int, default=3, help="buyers racing for each chunk")
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--max-tickets", type=int, default=500)
+    parser.add_argument("--per-buy", type=int, default=5, help="max tickets per request")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+
+    # The app opens ./lottery.db, so run inside a scratch directory
+    workdir = tempfile.mkdtemp(prefix="lottery-stress-")
+    os.chdir(workdir)
+    os.environ.pop("BOT_TOKEN", None)
+    os.environ.pop("RANDOM_API_KEY", None)
+
+    import app as app_module
+    from db import SessionLocal, DrawJob, Lottery, Ticket
+    from fastapi.testclient import TestClient
+    from sqlalchemy import func
+
+    client = TestClient(app_module.app)
+    client.__enter__()  # runs startup, i.e. the background draw worker
+    lottery_id = client.post("/lotteries/add", json={
+        "name": "stress", "ticket_price": 3, "max_tickets": args.max_tickets,
+    }).json()["id"]
+
+    numbers = list(range(1, args.max_tickets + 1))
+    rnd.shuffle(numbers)
+    chunks = []
+    while numbers:
+        size = rnd.randint(1, args.per_buy)
+        chunks.append(numbers[:size])
+        numbers = numbers[size:]
+    # users are reused across chunks so participants_count sees repeat buyers
+    users = max(len(chunks) // 2, 1)
+    requests_plan = [(1000 + rnd.randrange(users), chunk) for chunk in chunks for _ in range(args.contention)]
+    rnd.shuffle(requests_plan)
+
+    def buy(plan):
+        user_id, numbers = plan
+        resp = client.post(f"/lotteries/{lottery_id}/buy", json={"user_id": user_id, "ticket_numbers": numbers})
+        return resp.status_code
+
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        statuses = Counter(pool.map(buy, requests_plan))
+
+    # give the draw worker a moment to pick the winner
+    deadline = time.monotonic() + 30
+    db = SessionLocal()
+    try:
+        while time.monotonic() < deadline:
+            if db.query(Lottery.winner_id).filter(Lottery.id == lottery_id).scalar() is not None:
+                break
+            db.rollback()
+            time.sleep(0.2)
+        draw_jobs = db.query(DrawJob.state).filter(DrawJob.lottery_id == lottery_id).all()
+        lot = db.query(Lottery).filter(Lottery.id == lottery_id).one()
+        rows = db.query(func.count(Ticket.id)).filter(Ticket.lottery_id == lottery_id).scalar()
+        distinct_numbers = db.query(func.count(func.distinct(Ticket.ticket_number))).filter(Ticket.lottery_id == lottery_id).scalar()
+        distinct_users = db.query(func.count(func.distinct(Ticket.user_id))).filter(Ticket.lottery_id == lottery_id).scalar()
+    finally:
+        db.close()
+
+    failures = []
+    if rows != distinct_numbers:
+        failures.append(f"duplicate ticket numbers: {rows} rows, {distinct_numbers} distinct")
+    if lot.tickets_sold != rows:
+        failures.append(f"tickets_sold={lot.tickets_sold} but {rows} ticket rows")
+    if lot.tickets_sold > lot.max_tickets:
+        failures.append(f"oversold: {lot.tickets_sold} > {lot.max_tickets}")
+    if lot.participants_count != distinct_users:
+        failures.append(f"participants_count={lot.participants_count} but {distinct_users} distinct buyers")
+    if lot.revenue != rows * lot.ticket_price:
+        failures.append(f"revenue={lot.revenue} but expected {rows * lot.ticket_price}")
+    full = lot.tickets_sold == lot.max_tickets
+    if not full:
+        failures.append(f"every chunk had a buyer but only {lot.tickets_sold}/{lot.max_tickets} sold")
+    if statuses[200] != len(chunks):
+        failures.append(f"{statuses[200]} successful purchases for {len(chunks)} chunks")
+    if full and (len(draw_jobs) != 1 or lot.winner_id is None):
+        failures.append(f"full lottery has {len(draw_jobs)} draw jobs, winner={lot.winner_id}")
+    if not full and draw_jobs:
+        failures.append(f"lottery not full but has {len(draw_jobs)} draw jobs")
+    server_errors = sum(n for code, n in statuses.items() if code >= 500)
+    if server_errors:
+        failures.append(f"{server_errors} requests failed with 5xx")
+
+    print(f"statuses: {dict(sorted(statuses.items()))}")
+    print(f"sold {lot.tickets_sold}/{lot.max_tickets}, participants {lot.participants_count}, "
+          f"revenue {lot.revenue}, draw jobs {[state for (state,) in draw_jobs]}, winner {lot.winner_id}")
+    client.__exit__(None, None, None)
+    if failures:
+        print("FAILED:\n  " + "\n  ".join(failures))
+        return 1
+    print("OK: all invariants hold")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
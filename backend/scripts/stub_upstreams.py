@@ -0,0 +1,190 @@
+"""Local stand-ins for the external HTTP APIs the backend talks to.
+
+Used by the check/benchmark scripts, and handy for manual testing:
+    python scripts/stub_upstreams.py --port 9000
+then start the backend with the environment it prints.
+
+Stubs:
+    TelegramStub  – Bot API ``/bot<token>/sendMessage``. It records every
+                    accepted message and can inject 429s (per-second limit),
+                    5xx failures and latency.
+    UpstreamStubs – TelegramStub plus CoinGecko ``/simple/price``, tonapi
+                    ``/accounts/<address>``, random.org ``/invoke`` and
+                    is.gd ``/create.php``, all on one port. ``env()`` gives
+                    the variables that point the backend at it.
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """Runs a handler class on 127.0.0.1 in a daemon thread."""
+
+    def __init__(self, port: int = 0):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def do_GET(self):
+                stub.dispatch(self, "GET", b"")
+
+            def do_POST(self):
+                stub.dispatch(self, "POST", self._body())
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def dispatch(self, handler: BaseHTTPRequestHandler, method: str, body: bytes):
+        raise NotImplementedError
+
+    @staticmethod
+    def reply(handler: BaseHTTPRequestHandler, status: int, payload, content_type: str = "application/json"):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class TelegramStub(StubServer):
+    def __init__(self, port: int = 0, rate_limit: int | None = None, fail_every: int = 0, latency: float = 0.0):
+        super().__init__(port)
+        self.rate_limit = rate_limit
+        self.fail_every = fail_every
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.messages: list[dict] = []
+        self.accepted_at: list[float] = []
+        self.rejected_429 = 0
+        self.failed_5xx = 0
+
+    def dispatch(self, handler, method, body):
+        if not handler.path.endswith("/sendMessage"):
+            return self.reply(handler, 404, {"ok": False, "description": "Not Found"})
+        if self.latency:
+            time.sleep(self.latency)
+        now = time.monotonic()
+        with self.lock:
+            self.requests += 1
+            n = self.requests
+            if self.fail_every and n % self.fail_every == 0:
+                self.failed_5xx += 1
+                status, payload = 502, {"ok": False, "description": "Bad Gateway"}
+            elif self.rate_limit and sum(1 for t in self.accepted_at[-self.rate_limit:] if now - t < 1.0) >= self.rate_limit:
+                self.rejected_429 += 1
+                status, payload = 429, {"ok": False, "error_code": 429,
+                                        "description": "Too Many Requests: retry after 1",
+                                        "parameters": {"retry_after": 1}}
+            else:
+                msg = json.loads(body or b"{}")
+                self.messages.append(msg)
+                self.accepted_at.append(now)
+                status, payload = 200, {"ok": True, "result": {"message_id": len(self.messages), "chat": {"id": msg.get("chat_id")}}}
+        self.reply(handler, status, payload)
+
+
+class UpstreamStubs(TelegramStub):
+    """Every upstream on one port. ``upstream_latency`` delays the non-Telegram APIs."""
+
+    def __init__(self, port: int = 0, upstream_latency: float = 0.0, ton_usd: float = 5.5, **telegram):
+        super().__init__(port, **telegram)
+        self.upstream_latency = upstream_latency
+        self.ton_usd = ton_usd
+        self.calls: dict[str, int] = {}
+        self.rnd = random.Random(0)
+
+    def env(self) -> dict[str, str]:
+        return {
+            "COINGECKO_API_URL": self.url,
+            "TONAPI_URL": self.url,
+            "RANDOM_ORG_URL": self.url,
+            "ISGD_URL": self.url,
+            "TELEGRAM_API_URL": self.url,
+        }
+
+    def _count(self, name: str):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def dispatch(self, handler, method, body):
+        parsed = urllib.parse.urlsplit(handler.path)
+        path = parsed.path
+        if path.startswith("/bot"):
+            self._count("telegram")
+            return super().dispatch(handler, method, body)
+        if self.upstream_latency:
+            time.sleep(self.upstream_latency)
+        if path == "/simple/price":
+            self._count("coingecko")
+            return self.reply(handler, 200, {"the-open-network": {"usd": self.ton_usd}})
+        if path.startswith("/accounts/"):
+            self._count("tonapi")
+            address = path.rsplit("/", 1)[1]
+            return self.reply(handler, 200, {"address": address, "balance": 1_000_000_000 + len(address)})
+        if path == "/invoke" and method == "POST":
+            self._count("random_org")
+            request = json.loads(body or b"{}")
+            params = request.get("params", {})
+            with self.lock:
+                number = self.rnd.randint(params.get("min", 1), params.get("max", 1))
+            random_obj = {"method": "generateSignedIntegers", "data": [number], "serialNumber": self.calls["random_org"]}
+            return self.reply(handler, 200, {"jsonrpc": "2.0", "id": request.get("id"),
+                                             "result": {"random": random_obj, "signature": "stub-signature"}})
+        if path == "/create.php":
+            self._count("isgd")
+            return self.reply(handler, 200, f"https://is.gd/stub{self.calls['isgd']}".encode(), "text/plain")
+        return self.reply(handler, 404, {"error": f"no stub for {method} {path}"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local upstream stubs")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--rate-limit", type=int, default=None, help="Telegram messages per second before 429")
+    parser.add_argument("--fail-every", type=int, default=0, help="answer every Nth Telegram request with 502")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to the non-Telegram APIs")
+    args = parser.parse_args()
+    stub = UpstreamStubs(args.port, upstream_latency=args.latency,
+                         rate_limit=args.rate_limit, fail_every=args.fail_every).start()
+    print(f"Upstream stubs on {stub.url}; start the backend with:")
+    for name, value in stub.env().items():
+        print(f"    {name}={value}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"messages={len(stub.messages)} 429={stub.rejected_429} 5xx={stub.failed_5xx}")
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
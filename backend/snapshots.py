@@ -0,0 +1,110 @@
+"""Pre-encoded snapshots of the hot read responses.
+
+A snapshot is the JSON body of a response at one data version, encoded
+once with orjson and then served as raw bytes. There is no Pydantic
+validation and no re-encoding per request. Each snapshot has a scope:
+``None`` for responses that follow the global DATA_VERSION, or a lottery
+id for responses that follow that lottery's version.
+
+Commits in this process that bump a version drop the affected keys
+immediately (see db.version_listeners). Until that happens, a key is
+served from memory without reading its version for SNAPSHOT_RECHECK_SECONDS.
+That delay bounds how long other workers serve a response that changed
+elsewhere. After it, one version lookup either confirms the snapshot or
+triggers a rebuild. Concurrent rebuilds of one version share one build.
+"""
+import json
+import os
+import threading
+import time
+from typing import NamedTuple
+
+from fastapi import Request, Response
+
+from cache import AsyncTTLCache
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - slower, same output for our payloads
+    orjson = None
+
+SNAPSHOT_RECHECK_SECONDS = float(os.getenv("SNAPSHOT_RECHECK_SECONDS", "1"))
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, default=lambda v: v.isoformat(), separators=(",", ":"), ensure_ascii=False).encode()
+
+
+class Snapshot(NamedTuple):
+    version: int
+    etag: str
+    payload: object  # the encoded value, for responses that add to it
+    body: bytes
+
+
+class SnapshotCache:
+    def __init__(self, maxsize: int = 1024, recheck: float = SNAPSHOT_RECHECK_SECONDS):
+        self.recheck = recheck
+        # (key, version) -> Snapshot; versions never repeat, so entries never go stale
+        self._built = AsyncTTLCache(maxsize=maxsize, ttl=3600, stale_ttl=0)
+        self._current: dict = {}  # key -> (scope, version, checked_at)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "rechecks": 0, "builds": 0}
+
+    async def get(self, key, scope, read_version, build) -> Snapshot | None:
+        """The snapshot of ``key``; None when ``read_version`` finds nothing.
+
+        ``read_version()`` and ``build(version)`` are coroutine factories.
+        Run them on the same session, so the body matches its version.
+        """
+        with self._lock:
+            current = self._current.get(key)
+            generation = self._generation
+        if current is not None and time.monotonic() - current[2] < self.recheck:
+            version = current[1]
+            self.stats["hits"] += 1
+        else:
+            version = await read_version()
+            if version is None:
+                return None
+            self.stats["rechecks"] += 1
+            with self._lock:
+                if generation == self._generation:  # no commit invalidated it meanwhile
+                    self._current[key] = (scope, version, time.monotonic())
+
+        async def _build():
+            self.stats["builds"] += 1
+            etag, payload = await build(version)
+            return Snapshot(version, etag, payload, dumps(payload))
+
+        snapshot, _ = await self._built.get((key, version), _build)
+        return snapshot
+
+    def invalidate(self, lottery_ids):
+        """Forget global snapshots and those of ``lottery_ids``. Thread-safe."""
+        with self._lock:
+            self._generation += 1
+            self._current = {
+                key: entry for key, entry in self._current.items()
+                if entry[0] is not None and entry[0] not in lottery_ids
+            }
+
+
+def is_current(request: Request, etag: str) -> bool:
+    """True when the client's If-None-Match already names ``etag``."""
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def snapshot_response(request: Request, snapshot: Snapshot, body: bytes | None = None) -> Response:
+    """Serve the encoded body (or ``body`` built from it), or a 304 when the client's ETag is current."""
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if is_current(request, snapshot.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(snapshot.body if body is None else body, media_type="application/json", headers=headers)
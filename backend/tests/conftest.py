@@ -0,0 +1,50 @@
+"""Shared fixtures: the app on a scratch SQLite database, and per-request statement counts.
+
+The app reads its settings when it is imported, so the environment is set
+up in the ``client`` fixture before anything imports it.
+
+Run from the backend directory:
+    python -m pytest -q
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+sys.path.insert(0, str(BACKEND_DIR / "scripts"))
+
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    """TestClient inside the app's lifespan; the database is ./lottery.db in a scratch directory."""
+    os.chdir(tmp_path_factory.mktemp("app"))
+    for name in ("BOT_TOKEN", "ADMIN_CHAT_ID", "RANDOM_API_KEY", "DATABASE_URL"):
+        os.environ.pop(name, None)
+    # snapshots rechecked on every call, so cached endpoints are counted like the rest
+    os.environ.update({"SNAPSHOT_RECHECK_SECONDS": "0", "QUERY_STATS_HEADERS": "1"})
+
+    import app as app_module
+    from fastapi.testclient import TestClient
+
+    with TestClient(app_module.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def query_count(client):
+    """query_count(method, path, **kwargs): statements one request ran.
+
+    The count is db.count_queries() around the request, which
+    MetricsMiddleware sends back as X-DB-Queries.
+    """
+    from metrics import QUERY_COUNT_HEADER
+
+    def count(method: str, path: str, **kwargs) -> int:
+        resp = client.request(method, path, **kwargs)
+        assert resp.status_code < 400, f"{method} {path} -> {resp.status_code}: {resp.text}"
+        return int(resp.headers[QUERY_COUNT_HEADER])
+
+    return count
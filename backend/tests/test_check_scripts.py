@@ -0,0 +1,29 @@
+"""The other scripts/check_*.py gates and the purchase stress test.
+
+Each runs in a process of its own: they import the app with their own
+environment (Telegram stub, scratch database), which cannot share this
+process's app.
+"""
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# script -> arguments, scaled down to keep the suite quick
+SCRIPTS = {
+    "check_query_plans.py": [],
+    "check_notifier.py": ["--participants", "40"],
+    "stress_buy.py": ["--max-tickets", "200", "--seed", "1"],
+}
+
+
+@pytest.mark.parametrize("script", SCRIPTS)
+def test_script_passes(script):
+    proc = subprocess.run(
+        [sys.executable, "-W", "ignore", str(BACKEND_DIR / "scripts" / script), *SCRIPTS[script]],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=600,
+    )
+    assert proc.returncode == 0, proc.stdout[-4000:] + proc.stderr[-4000:]
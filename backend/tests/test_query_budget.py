@@ -0,0 +1,19 @@
+"""Per-endpoint statement budgets from scripts/check_query_budget.py."""
+import pytest
+
+from check_query_budget import BUDGETS, budget_problems, measure
+
+
+@pytest.fixture(scope="module")
+def rounds(client, query_count):
+    return measure(client, query_count)
+
+
+@pytest.mark.parametrize("endpoint", BUDGETS)
+def test_within_budget(rounds, endpoint):
+    small, large = rounds
+    assert not budget_problems(endpoint, small, large)
+
+
+def test_ping_runs_no_statements(query_count):
+    assert query_count("GET", "/ping") == 0
@@ -5,6 +5,7 @@ import LotteryCard from './LotteryCard';
 import { DetailsModal } from './DetailsModal';
 import { TonConnectButton, useTonWallet } from '@tonconnect/ui-react';
 import { toUserFriendlyAddress } from '@tonconnect/sdk';
+import { subscribeLiveUpdates } from './liveUpdates';
 
 interface Lottery {
   id: string;
@@ -63,6 +64,8 @@ export const LotteriesPage: React.FC<{ userId: string }> = ({ userId }) => {
   const [lotteries, setLotteries] = useState<Lottery[]>([]);
   const [selected, setSelected] = useState<string | null>(null);
   const [myTickets,setMyTickets]=useState<UserTicket[]>([]);
+  // архивные лотереи приходят только счётчиками: [{lottery_id, tickets}]
+  const [myArchived,setMyArchived]=useState<{lottery_id:number;tickets:number}[]>([]);
   const [tickets, setTickets] = useState<Ticket[]>([]);
   const [selectedTickets, setSelectedTickets] = useState<number[]>([]);
   const [userWallet, setUserWallet] = useState<string | null>(null);
@@ -111,65 +114,49 @@ export const LotteriesPage: React.FC<{ userId: string }> = ({ userId }) => {
   }, [wallet, userId]);
 
   useEffect(() => {
-    // Получить кошелек пользователя
+    // Всё для стартового экрана одним запросом; version — чтобы при опросе
+    // не перекачивать лотереи и билеты, пока данные не менялись
+    let version: number | null = null;
+    const bootstrap = async () => {
+      const res = await fetch(`${getApiUrl()}/bootstrap/${userId}` + (version === null ? '' : `?version=${version}`));
+      if (!res.ok) throw new Error('Failed to load lotteries');
+      const data = await res.json();
+      version = data.version;
+      if (data.lotteries) setLotteries(data.lotteries);
+      if (data.tickets) setMyTickets(data.tickets);
+      if (data.archived_tickets) setMyArchived(data.archived_tickets);
+      if (data.stats) setStats(data.stats);
+      if (data.stars_balance !== null) setStarsBalance(data.stars_balance);
+      if (data.rate) setTonRate(data.rate.ton_to_star);
+      return data;
+    };
+
     setWalletLoading(true);
-    fetch(`${getApiUrl()}/users/${userId}`)
-      .then(r => r.json())
-      .then(user => {
-        setUserWallet(user.ton_wallet_address || null);
-        if(user.ton_wallet_address){loadWalletBalance(user.ton_wallet_address);}
-        setWalletInput(user.ton_wallet_address || "");
-        setWalletLoading(false);
+    bootstrap()
+      .then(data => {
+        const address = data.user?.ton_wallet_address || null;
+        setUserWallet(address);
+        if (address) loadWalletBalance(address);
+        setWalletInput(address || "");
       })
       .catch(() => {
         setUserWallet(null);
+        setError('Ошибка загрузки лотерей');
+      })
+      .finally(() => {
         setWalletLoading(false);
+        setLoading(false);
       });
-    fetch(`${getApiUrl()}/lotteries`)
-      .then(r => r.json())
-      .then(setLotteries)
-      .then(()=>{
-        // Load user stats, balance and rate
-        Promise.all([
-          fetch(`${getApiUrl()}/users/${userId}/stats`).then(r=>r.json()).catch(()=>null),
-          fetch(`${getApiUrl()}/users/${userId}/balance`).then(r=>r.json()).catch(()=>null),
-          fetch(`${getApiUrl()}/rates/ton_star`).then(r=>r.json()).catch(()=>null)
-        ]).then(([statsData,balData,rateData])=>{
-          if(statsData) setStats(statsData);
-          if(balData) setStarsBalance(balData.stars_balance);
-          if(rateData) setTonRate(rateData.ton_to_star);
-        });
-      })
-      .catch(() => setError('Ошибка загрузки лотерей'))
-      .finally(() => setLoading(false));
-        // helper to load user tickets
-        const fetchMyTickets = async () => {
-          try {
-            const res = await fetch(`${getApiUrl()}/tickets?user_id=${userId}`);
-            if(res.ok){
-              setMyTickets(await res.json());
-            }
-          }catch{}
-        };
-        fetchMyTickets();
-    // Polling
-    const poll = setInterval(async () => {
+    // Перечитываем по событиям с сервера; редкий опрос — только если поток недоступен
+    return subscribeLiveUpdates(getApiUrl(), async () => {
       try {
-        const res = await fetch(`${getApiUrl()}/lotteries`);
-        if (!res.ok) throw new Error('Failed to load lotteries');
-        setLotteries(await res.json());
-        // refresh my tickets as well
-        try{
-          const tRes=await fetch(`${getApiUrl()}/tickets?user_id=${userId}`);
-          if(tRes.ok) setMyTickets(await tRes.json());
-        }catch{}
+        await bootstrap();
         if (selected) await fetchTickets(selected);
       } catch (err) {
         console.error('Error loading lotteries:', err);
         setError('Ошибка загрузки лотерей');
       }
-    }, 3000);
-    return () => clearInterval(poll);
+    });
   }, [userId]);
 
   // Обновление баланса звёзд и курса TON→⭐ каждые 5 минут
@@ -212,11 +199,20 @@ const reload = useCallback(async () => {
   }
 }, [selected]);
 
-const fetchTickets = async (lotteryId:string) => {
-    const res = await fetch(`${getApiUrl()}/lotteries/${lotteryId}/tickets`);
-    const raw = await res.json();
-    setTickets(raw.map((t:any)=>({ ...t, number: t.ticket_number })));
+// проданные номера приходят диапазонами [first, last] вместо списка билетов
+const loadGrid = async (lotteryId: string): Promise<Ticket[]> => {
+    const res = await fetch(`${getApiUrl()}/lotteries/${lotteryId}/grid`);
+    if (!res.ok) throw new Error('Failed to load tickets');
+    const grid = await res.json();
+    const sold: Ticket[] = [];
+    for (const [first, last] of grid.ranges) {
+      for (let n = first; n <= last; ++n) sold.push({ id: String(n), number: n, isAvailable: false });
+    }
+    return sold;
+  };
 
+const fetchTickets = async (lotteryId:string) => {
+    setTickets(await loadGrid(lotteryId));
   };
 
   const handleBuy = async (lotteryId: string, ticketNumbers: number[]) => {
@@ -260,13 +256,7 @@ const fetchTickets = async (lotteryId:string) => {
     const loadTickets = async () => {
       try {
         setLoading(true);
-        const response = await fetch(`${getApiUrl()}/lotteries/${lotteryId}/tickets`);
-        if (!response.ok) {
-          throw new Error('Failed to load tickets');
-        }
-        const data = await response.json();
-        // map backend ticket_number -> number expected by UI
-        setTickets(data.map((t: any) => ({ ...t, number: t.ticket_number })));
+        setTickets(await loadGrid(lotteryId));
       } catch (err) {
         console.error('Error loading tickets:', err);
         setError('Failed to load tickets. Please try again.');
@@ -417,7 +407,8 @@ const fetchTickets = async (lotteryId:string) => {
   // Tabs arrays
   const activeLots = lotteries.filter(l=>!l.winner_id);
   const finishedLots = lotteries.filter(l=>l.winner_id);
-  const participatedLots = lotteries.filter(l=>myTickets.some(t=>String(t.lottery_id)===String(l.id)));
+  const participatedLots = lotteries.filter(l=>myTickets.some(t=>String(t.lottery_id)===String(l.id))
+    || myArchived.some(a=>String(a.lottery_id)===String(l.id)));
   const wonLots = lotteries.filter(l=>l.winner_id===userId);
   
   
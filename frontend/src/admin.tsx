@@ -1,4 +1,5 @@
 import React, { useEffect, useState } from 'react';
+import { subscribeLiveUpdates } from './liveUpdates';
 
 function getApiUrl() {
   return import.meta.env.VITE_API_URL || 'https://starslottery-backend-production.up.railway.app';
@@ -42,13 +43,13 @@ export const AdminPanel: React.FC = () => {
       .then(setLotteries)
       .catch(() => setError('Ошибка загрузки лотерей'))
       .finally(() => setLoading(false));
-    // Polling
-    const poll = setInterval(() => {
+    // Перечитываем список по событиям с сервера, с редким опросом на случай обрыва
+    return subscribeLiveUpdates(getApiUrl(), () => {
       fetch(`${getApiUrl()}/lotteries`)
         .then(r => r.json())
-        .then(setLotteries);
-    }, 3000);
-    return () => clearInterval(poll);
+        .then(setLotteries)
+        .catch(() => setError('Ошибка загрузки лотерей'));
+    });
   }, [loggedIn, status]);
 
   const refresh = () => {
@@ -0,0 +1,47 @@
+// Живые обновления через Server-Sent Events (GET /events) вместо частого опроса.
+// onChange вызывается после любого события о лотереях/билетах/розыгрыше, после
+// resync (сервер выбросил отставшую очередь) и после переподключения — события
+// за время обрыва потеряны, поэтому состояние надо перечитать.
+// Пока поток недоступен, работает редкий опрос.
+
+const EVENT_TYPES = ['lottery', 'tickets', 'draw', 'lottery_deleted', 'resync'];
+const COALESCE_MS = 300; // пачка событий (покупка = tickets + lottery) -> один refetch
+export const FALLBACK_POLL_MS = 30_000;
+
+export function subscribeLiveUpdates(
+  apiUrl: string,
+  onChange: () => void,
+  options: { lotteryId?: number | string | null; fallbackMs?: number } = {},
+): () => void {
+  let timer: ReturnType<typeof setTimeout> | null = null;
+  const schedule = () => {
+    if (timer) return;
+    timer = setTimeout(() => {
+      timer = null;
+      onChange();
+    }, COALESCE_MS);
+  };
+
+  let source: EventSource | null = null;
+  if (typeof EventSource !== 'undefined') {
+    const query = options.lotteryId != null ? `?lottery_id=${options.lotteryId}` : '';
+    source = new EventSource(`${apiUrl}/events${query}`);
+    let connectedBefore = false;
+    source.onopen = () => {
+      if (connectedBefore) schedule();
+      connectedBefore = true;
+    };
+    EVENT_TYPES.forEach(type => source!.addEventListener(type, schedule));
+  }
+
+  // EventSource переподключается сам; опрос нужен только пока потока нет
+  const poll = setInterval(() => {
+    if (!source || source.readyState !== EventSource.OPEN) onChange();
+  }, options.fallbackMs ?? FALLBACK_POLL_MS);
+
+  return () => {
+    clearInterval(poll);
+    if (timer) clearTimeout(timer);
+    source?.close();
+  };
+}